@@ -1,86 +1,318 @@
 import csv
+import random
+import threading
+import weakref
 from contextlib import contextmanager
 
-import mysql.connector.errors as errors
-import numpy as np
-from mysql.connector import Error, connect, errorcode
-from time import sleep
+from mysql.connector import Error, errorcode
+from time import monotonic, sleep
+from types import FunctionType
 
+from backends import MySQLBackend
+from cache import CACHE_TTL, ResultCache
+from instrumentation import Instrumentation, InstrumentedCursor, instrumented
 from messages import *
-from schema import DB_NAME, TABLES
+from pool import POOL_MIN_SIZE, POOL_TIMEOUT, ConnectionPool
+from prepared import PreparedCursor, StatementCache, StatementStats
+from recommender import ItemSimilarityEngine, PopularityLeaderboard, RatingMatrix
+from replicas import REPLICA_MAX_LAG, ReplicaSet
+from retry import *
+from schema import BASELINE_VERSION, DB_NAME, MIGRATIONS, MIGRATIONS_TABLE, TABLES
+from similarity_model import SimilarityModelStore, publish_model
 from sql_queries import *
 from utils import *
 
+np = lazy_import("numpy")  # only needed by the recommendations and bulk loads
+
 DEFAULT_DATA = "data.csv"
 NUM_TRIES = 3
+CONNECT_BACKOFF = 0.5  # seconds before the second connection attempt, doubling after each failure
+CONNECT_BACKOFF_MAX = 8.0
+MAX_RESERVATIONS = 10
+BULK_CHUNK_SIZE = 10000
+LEADERBOARD_SIZE = 100
+PAGE_SIZE = 50
+MIGRATION_LOCK_TIMEOUT = 10  # seconds DDL may wait for a table's metadata lock
+INCREMENTAL_SIMILARITY_LIMIT = 1000  # larger rating batches rebuild the similarity engine lazily instead
 
 class SQLConnector:
-    def __init__(self):
-        for _ in range(NUM_TRIES):
+    def __init__(self, pool_size=None, pool_min_size=POOL_MIN_SIZE, pool_timeout=POOL_TIMEOUT, prepared_statements=True,
+                 backend=None, instrument=True, slow_query_threshold=None, slow_query_log=None, explain_slow_queries=False,
+                 lazy_connect=True, retry_attempts=RETRY_ATTEMPTS, replicas=None, replica_selection="round_robin",
+                 replica_max_lag=REPLICA_MAX_LAG):
+        """Connect to the database, or to a pool of up to `pool_size` connections if given.
+
+        With `lazy_connect`, nothing is opened until the first query; otherwise the connection, or the
+        pool's first `pool_min_size` connections, are opened right away. Connecting is attempted
+        NUM_TRIES times with jittered exponential backoff before `DatabaseConnectionError` is raised.
+        In pooled mode each thread borrows its own connection for the duration of a transaction,
+        so the agent can be shared by many worker threads. With `prepared_statements`, the queries
+        in `PREPARED_QUERIES` are prepared lazily on each connection and reused. `backend` is the
+        database to connect to (see `backends.py`), the MySQL server by default.
+
+        With `instrument`, every statement and public method of a subclass is timed (see
+        `instrumentation.py` and `query_stats()`), and statements slower than `slow_query_threshold`
+        seconds are written to `slow_query_log`, explained if `explain_slow_queries` is set.
+
+        Public methods of a subclass are replayed up to `retry_attempts` times after a lost
+        connection, a deadlock or a lock wait timeout, as far as their kind allows (see `retry.py`
+        and `retry_stats()`).
+
+        `replicas` are backends of read replicas of `backend`. Read-only methods run on one of them,
+        chosen by `replica_selection` ("round_robin" or "least_latency"), unless it trails by more
+        than `replica_max_lag` seconds or fails, or the thread committed a write within the last
+        `replica_max_lag` seconds (so it reads its own writes); the primary serves them then.
+        """
+        self.backend = backend if backend is not None else MySQLBackend()
+        self.instrumentation = Instrumentation(slow_query_threshold, slow_query_log, explain_slow_queries) if instrument else None
+        self.pool = None
+        self._local = threading.local()
+        self.prepared_statements = prepared_statements and self.backend.supports_prepared_statements
+        self.statement_stats = StatementStats()
+        self._statement_caches = weakref.WeakKeyDictionary()
+        self._statement_caches_lock = threading.Lock()
+        self.retry_attempts = retry_attempts
+        self.retry_counts = RetryStats()
+        self.replicas = ReplicaSet(replicas, self._new_replica_connection, pool_size or 1, replica_selection,
+                                   replica_max_lag) if replicas else None
+        self._last_write = float("-inf")  # by any thread
+        self.connection = None
+        self._connect_lock = threading.Lock()
+        if pool_size and self.backend.max_connections is not None:
+            pool_size = min(pool_size, self.backend.max_connections)
+        if pool_size:
+            self.pool = ConnectionPool(self._new_connection, min(pool_min_size, pool_size), pool_size, pool_timeout,
+                                       warm=not lazy_connect)
+        elif not lazy_connect:
+            self._connect()
+
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, attribute in list(vars(cls).items()):
+            if not name.startswith("_") and isinstance(attribute, FunctionType) and operation_kind(name) != LOCAL:
+                setattr(cls, name, instrumented(retried(attribute)))
+
+
+    def _new_connection(self, backend=None, attempts=NUM_TRIES):
+        backend = backend if backend is not None else self.backend
+        for attempt in range(attempts):
             try:
-                self._connect()
-            except:
-                sleep(3)
-                continue
-            else:
-                break
+                return backend.connect()
+            except (Error, OSError) as e:
+                if attempt == attempts - 1:
+                    raise DatabaseConnectionError(attempts, e) from e
+                sleep(random.uniform(0, min(CONNECT_BACKOFF_MAX, CONNECT_BACKOFF * 2 ** attempt)))  # full jitter
+
+
+    def _new_replica_connection(self, backend):
+        return self._new_connection(backend, attempts=1)  # an unreachable replica is skipped, not waited for
 
 
     def _connect(self):
-        self.connection = connect(
-            host="astronaut.snu.ac.kr",
-            port=7000,
-            user=DB_NAME,
-            password=DB_NAME,
-            db=DB_NAME,
-            charset="utf8",
-            connection_timeout=3
-        )
+        with self._connect_lock:
+            if self.connection is None:
+                self.connection = self._new_connection()
+        return self.connection
         
     
-    def _reconnect(self):
-        self.connection.reconnect(attempts=3, delay=5)
+    def _reconnect(self, connection):
+        with self._statement_caches_lock:
+            cache = self._statement_caches.pop(connection, None)
+        if cache is not None:  # statements do not survive the session
+            cache.close()
+        connection.reconnect(attempts=1, delay=0)  # `_retrying` backs off between attempts
+
+
+    def _statement_cache(self, connection):
+        with self._statement_caches_lock:
+            cache = self._statement_caches.get(connection)
+            if cache is None:
+                cache = self._statement_caches[connection] = StatementCache(connection, self.statement_stats)
+        return cache
+
+
+    @contextmanager
+    def _borrow(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:  # nested call within the same thread's transaction
+            yield connection
+            return
+        
+        if self._reads_from_replica():
+            with self.replicas.connection() as connection:
+                if connection is not None:
+                    self._local.connection = connection
+                    try:
+                        yield connection
+                    finally:
+                        self._local.connection = None
+                    return
+        
+        if self.pool is None:
+            yield self.connection if self.connection is not None else self._connect()
+            return
+        
+        with self.pool.connection() as connection:
+            self._local.connection = connection
+            try:
+                yield connection
+            finally:
+                self._local.connection = None
         
     
+    def _reads_from_replica(self):
+        if self.replicas is None or not getattr(self._local, "read_only", False):
+            return False
+        # Consistent reads must see every write, other reads the thread's own ones
+        last_write = self._last_write if getattr(self._local, "consistent", False) else getattr(self._local, "last_write", float("-inf"))
+        return monotonic() - last_write >= self.replicas.max_lag
+
+
     @contextmanager
-    def _connection(self):
+    def _consistent_reads(self):
+        """Read from a replica only if no thread wrote for as long as a replica may lag."""
+        self._local.consistent = True
         try:
-            yield self.connection
-        except errors.OperationalError as e:
-            if e.errno == errorcode.CR_SERVER_LOST:
-                self._reconnect()
-                yield self.connection
-        except:
-            self.connection.rollback()
-            raise
-        else:
-            self.connection.commit()
+            yield
+        finally:
+            self._local.consistent = False
+
+
+    @contextmanager
+    def _connection(self):
+        with self._borrow() as connection:
+            try:
+                yield connection
+            except:
+                self._rollback(connection)
+                raise
+            self._commit(connection)
     
     
     @contextmanager
     def _connection_without_halt(self):
+        """Like `_connection`, but a rejected row is rolled back without stopping the caller."""
+        with self._borrow() as connection:
+            try:
+                yield connection
+            except CustomBaseException:
+                self._rollback(connection)
+            except:
+                self._rollback(connection)
+                raise
+            else:
+                self._commit(connection)
+
+
+    def _commit(self, connection):
         try:
-            yield self.connection
-        except errors.OperationalError as e:
-            if e.errno == errorcode.CR_SERVER_LOST:
-                self._reconnect()
-                yield self.connection
-        except:
-            self.connection.rollback()
-        else:
-            self.connection.commit()
+            connection.commit()
+        except Error:
+            self._local.commit_failed = True  # the transaction may have been committed all the same
+            raise
+        if not getattr(self._local, "read_only", False):
+            self._local.last_write = self._last_write = monotonic()
+
+
+    @staticmethod
+    def _rollback(connection):
+        try:
+            connection.rollback()
+        except Error:  # the server rolls back the transaction of a lost connection itself
+            pass
+
+
+    def _retrying(self, name, call, kind=None):
+        """Run `call()` as the operation `name`, replaying it after transient database failures.
+
+        Reads and idempotent writes are replayed with jittered exponential backoff. Other writes are
+        replayed only when their transaction rolled back; if the connection was lost while committing,
+        a write in `ALREADY_APPLIED` is replayed and its "already" error taken as success, while any
+        other raises `TransactionOutcomeUnknownError`. Calls nested in another operation run once, and
+        so do operations of kind ONCE, whose own `_retrying` steps are replayed instead.
+        """
+        if getattr(self._local, "retrying", False):
+            return call()
+        kind = kind or operation_kind(name)
+        read_only, self._local.read_only = getattr(self._local, "read_only", False), is_read_only(name, kind)
+        if kind == ONCE:
+            try:
+                return call()
+            finally:
+                self._local.read_only = read_only
+        self._local.retrying = True
+        ambiguous = False  # an earlier attempt may have committed
+        try:
+            for attempt in range(self.retry_attempts + 1):
+                self._local.commit_failed = False
+                try:
+                    result = call()
+                except Error as e:
+                    reason = transient_reason(e)
+                    if reason is None:
+                        raise
+                    if self._local.commit_failed and reason == "connection_lost" and kind == WRITE:
+                        self.retry_counts.record(name, "ambiguous_commits", reason)
+                        if name not in ALREADY_APPLIED:
+                            raise TransactionOutcomeUnknownError(name) from e
+                        ambiguous = True
+                    if attempt == self.retry_attempts:
+                        self.retry_counts.record(name, "exhausted", reason)
+                        if ambiguous:
+                            raise TransactionOutcomeUnknownError(name) from e
+                        raise
+                    self._recover(reason)
+                    sleep(backoff(attempt))
+                    self.retry_counts.record(name, "retries", reason)
+                    if self.instrumentation is not None:
+                        self.instrumentation.record_retry()
+                except CustomBaseException as e:
+                    if not ambiguous:
+                        raise
+                    already_applied, success = ALREADY_APPLIED[name]
+                    if not isinstance(e, already_applied):  # cannot tell whether the lost commit went through
+                        raise TransactionOutcomeUnknownError(name) from e
+                    self.retry_counts.record(name, "recovered")
+                    return success()
+                else:
+                    if attempt:
+                        self.retry_counts.record(name, "recovered")
+                    return result
+        finally:
+            self._local.retrying = False
+            self._local.read_only = read_only
+
+
+    def _recover(self, reason):
+        """Prepare the next attempt after a transient failure; a lost pooled connection was discarded already,
+        and a failed replica is skipped for a while."""
+        if reason == "connection_lost" and self.pool is None and self.connection is not None and not self.connection.is_connected():
+            try:
+                self._reconnect(self.connection)
+            except Error:  # still unreachable, the next attempt fails and backs off again
+                pass
     
     
     @contextmanager
-    def _cursor(self):
+    def _cursor(self, buffered=True):
         with self._connection() as connection:
-            cursor = connection.cursor(buffered=True)
+            cursor = self._open_cursor(connection, buffered)
             try:
                 yield cursor
             finally:
                 cursor.close()
                 
                 
+    def _open_cursor(self, connection, buffered=True):
+        cursor = connection.cursor(buffered=buffered)
+        if self.prepared_statements:
+            cursor = PreparedCursor(cursor, self._statement_cache(connection), PREPARED_QUERIES)
+        if self.instrumentation is not None:
+            cursor = InstrumentedCursor(cursor, self.instrumentation, connection, buffered)
+        return cursor
+
+
     @contextmanager
     def _optional_cursor(self, cursor=None):
         if cursor is None:
@@ -90,90 +322,525 @@ class SQLConnector:
             yield cursor
                 
                 
+    def pool_stats(self):
+        return self.pool.stats() if self.pool is not None else None
+
+
+    def replica_stats(self):
+        """Reads, failures, lag, latency and pool of each replica, and reads that fell back to the primary."""
+        return self.replicas.stats() if self.replicas is not None else None
+
+
+    def statement_cache_stats(self):
+        return self.statement_stats.snapshot()
+
+
+    def query_stats(self):
+        """Per-statement and per-method latency histograms, rows and retries; None without instrumentation."""
+        return self.instrumentation.snapshot() if self.instrumentation is not None else None
+
+
+    def retry_stats(self):
+        """Replays after transient failures, in total and by operation and reason."""
+        return self.retry_counts.snapshot()
+
+
+    def reset_query_stats(self):
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+
+
     def terminate(self):
-        self.connection.close()
+        if self.instrumentation is not None:
+            self.instrumentation.close()
+        if self.replicas is not None:
+            self.replicas.close()
+        if self.pool is not None:
+            self.pool.close()
+        elif self.connection is not None:
+            self.connection.close()
         
         
 
 class MovieBookingAgent(SQLConnector):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, result_cache=True, similarity_model=None, **connector_options):
+        """See `SQLConnector` for the connection options.
+
+        `result_cache` caches the movie and user listings, per movie and per user (see `cache.py`):
+        True for an in-process `ResultCache`, a cache object such as `RedisResultCache` to share it
+        between processes, or None to always query.
+
+        `similarity_model` is a directory `train_similarity_model` publishes to. Item-based
+        recommendations are then scored with its memory-mapped model while it matches the
+        database, and with the in-process engine otherwise (see `similarity_model.py`).
+        """
+        super().__init__(**connector_options)
+        self.similarity_engine = ItemSimilarityEngine()
+        self.similarity_model = SimilarityModelStore(similarity_model) if similarity_model is not None else None
+        self.leaderboard = PopularityLeaderboard(LEADERBOARD_SIZE, CACHE_TTL)  # expires with the listings
+        self.result_cache = ResultCache() if result_cache is True else result_cache or None
     
 
     # Problem 1 (5 pt.)
-    def initialize_database(self, only_create_tables=False):
-        with self._cursor() as cursor:
-            cursor.execute(check_database_empty)
-            num_tables = cursor.fetchone()[0]
-            if num_tables == 0:
-                for create_table_query in TABLES.values():
-                    cursor.execute(create_table_query)
+    def initialize_database(self, only_create_tables=False, bulk=False, migrate=True, **bulk_options):
+        self.similarity_engine.invalidate()
+        self._expire_similarity_model()
+        self.leaderboard.invalidate()
+        self._retrying("initialize_database", self._create_tables, IDEMPOTENT)
+        self._clear_results()
+        if migrate:
+            self.migrate()
                 
-            if only_create_tables:
+        if only_create_tables:
+            with self._cursor() as cursor:
                 cursor.execute("SHOW TABLES")
                 all_tables = cursor.fetchall()
                 return all_tables  # for debugging
 
+        if bulk:
+            return self.bulk_load(**bulk_options)
+
         with open(DEFAULT_DATA) as csvfile:
             reader = csv.DictReader(csvfile)
-            for i, row in enumerate(reader):
-                with self._connection_without_halt() as connection:
-                    cursor = connection.cursor(buffered=True)
-                    title, director, price = row["title"], row["director"], int(row["price"])
-                    name, age, class_ = row["name"], int(row["age"]), row["class"]
-                    try:
-                        self.insert_movie(title, director, price, cursor)
-                    except MovieTitleAlreadyExistsError:  # note that each record is a reservation
-                        pass
-                    try:
-                        self.insert_user(name, age, class_, cursor)
-                    except UserAlreadyExistsError:
-                        pass
-                    
-                    # ID may not be equal to the lastrowid because of the duplicate entries
-                    cursor.execute(select_id_from_movie, (title,))
-                    movie_id = cursor.fetchone()[0]
-                    cursor.execute(select_id_from_user, (name, age))
-                    user_id = cursor.fetchone()[0]
-                    
-                    self.book_movie(movie_id, user_id, price, class_, cursor)
+            for row in reader:  # a row already loaded is rolled back, so each one can be replayed on its own
+                self._retrying("initialize_database", lambda: self._load_row(row), IDEMPOTENT)
+        self._clear_results()
                 
         return DatabaseInitializeSuccess()
+
+
+    def _create_tables(self):
+        with self._cursor() as cursor:
+            cursor.execute(check_database_empty)
+            num_tables = cursor.fetchone()[0]
+            if num_tables == 0:
+                for create_table_query in TABLES.values():
+                    cursor.execute(create_table_query)
+            elif num_tables < len(TABLES):  # created before movie_stats existed
+                self.rebuild_movie_stats(cursor)
+
+
+    def _load_row(self, row):
+        with self._connection_without_halt() as connection:
+            cursor = self._open_cursor(connection)
+            title, director, price = row["title"], row["director"], int(row["price"])
+            name, age, class_ = row["name"], int(row["age"]), row["class"]
+            try:
+                self.insert_movie(title, director, price, cursor)
+            except MovieTitleAlreadyExistsError:  # note that each record is a reservation
+                pass
+            try:
+                self.insert_user(name, age, class_, cursor)
+            except UserAlreadyExistsError:
+                pass
+            
+            # ID may not be equal to the lastrowid because of the duplicate entries
+            cursor.execute(select_id_from_movie, (title,))
+            movie_id = cursor.fetchone()[0]
+            cursor.execute(select_id_from_user, (name, age))
+            user_id = cursor.fetchone()[0]
+            
+            self.book_movie(movie_id, user_id, price, class_, cursor)
+
+
+    def bulk_load(self, path=DEFAULT_DATA, chunk_size=BULK_CHUNK_SIZE, progress=None, rejects=None):
+        """Set-based version of the row-by-row loop in `initialize_database`.
+
+        Rows are validated and deduplicated in memory against the current contents of the
+        database, then movies, users and reservations are inserted with multi-row `executemany`
+        statements, committing every `chunk_size` rows. A row is rejected exactly when its own
+        transaction would have been rolled back by the row-by-row loop. Titles and names are
+        matched as the database's case-insensitive collation compares them, so "alien" books the
+        movie "Alien" like the row loop's lookup by title does.
+
+        Each chunk is replayed on its own after a transient failure. If the connection is lost
+        while a chunk commits, `TransactionOutcomeUnknownError` is raised; loading the file again
+        then rejects the rows that were loaded as duplicates.
+
+        `progress(num_done, num_total)` is called after each committed chunk of reservations. If
+        `rejects` is a path, rejected rows are written there as CSV together with the reason.
+        """
+        movie_ids, user_ids, num_reservations, reserved = self._retrying(
+            "bulk_load", lambda: self._load_bulk_keys(reservations=True), IDEMPOTENT)
+
+        # Natural keys stand in for ids until the new movies and users are inserted
+        title_counts = {title: num_reservations.get(movie_id, 0) for title, movie_id in movie_ids.items()}
+        titles = {movie_id: title for title, movie_id in movie_ids.items()}
+        users = {user_id: user for user, user_id in user_ids.items()}
+        booked = {(titles[movie_id], users[user_id]) for movie_id, user_id in reserved}
+        new_movies, new_users = {}, {}  # insertion order and spelling follow the first accepted row
+        accepted, rejected = [], []
+
+        with open(path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            fieldnames = reader.fieldnames
+            for row in reader:
+                try:
+                    title, director, price, user, class_ = self._validate_bulk_row(row, movie_ids, user_ids)
+                    if (title, user) in booked:
+                        raise MovieAlreadyBookedError(row["name"], row["title"])
+                    if title_counts.get(title, 0) >= MAX_RESERVATIONS:
+                        raise MovieFullyBookedError(row["title"])
+                except CustomBaseException as e:
+                    rejected.append((row, e))
+                    continue
+                booked.add((title, user))
+                title_counts[title] = title_counts.get(title, 0) + 1
+                if title not in movie_ids:
+                    new_movies.setdefault(title, (row["title"], director, price))
+                if user not in user_ids:
+                    new_users.setdefault(user, (row["name"], user[1], class_))
+                accepted.append((title, price, user, class_))
+
+        for rows, query in ((list(new_movies.values()), insert_into_movie), (list(new_users.values()), insert_into_user)):
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                self._retrying("bulk_load", lambda: self._insert_bulk_chunk(query, chunk), WRITE)
+
+        # IDs may not be consecutive, so resolve them with one query per table
+        movie_ids, user_ids, _, _ = self._retrying("bulk_load", self._load_bulk_keys, IDEMPOTENT)
+
+        prices = np.array([price for _, price, _, _ in accepted], dtype=float)
+        discounts = np.array([DiscountRate[class_.upper()].value for _, _, _, class_ in accepted], dtype=float)
+        reservation_prices = np.around(prices * (1 - discounts), 4).tolist()
+        reservations = [(movie_ids[title], user_ids[user], reservation_price)
+                        for (title, _, user, _), reservation_price in zip(accepted, reservation_prices)]
+
+        for start in range(0, len(reservations), chunk_size):
+            chunk = reservations[start:start + chunk_size]
+            chunk_movie_ids = {movie_id for movie_id, _, _ in chunk}
+            self._retrying("bulk_load", lambda: self._insert_bulk_chunk(insert_into_reservation, chunk, chunk_movie_ids), WRITE)
+            if progress is not None:
+                progress(min(start + chunk_size, len(reservations)), len(reservations))
+        self.similarity_engine.invalidate()
+        self._expire_similarity_model()
+        self.leaderboard.invalidate()
+        self._clear_results()
+
+        if rejects is not None:
+            with open(rejects, "w", newline="") as rejectfile:
+                writer = csv.DictWriter(rejectfile, fieldnames=fieldnames + ["reason"])
+                writer.writeheader()
+                for row, e in rejected:
+                    writer.writerow({**row, "reason": str(e)})
+
+        return DatabaseInitializeSuccess()
+
+
+    def _load_bulk_keys(self, reservations=False):
+        """Ids of the movies and users by collation key, and with `reservations` the number of
+        reservations of every movie and the booked (movie_id, user_id) pairs."""
+        num_reservations = reserved = None
+        with self._cursor() as cursor:
+            cursor.execute(select_movie_id_title_pairs)
+            movie_ids = {self._collation_key(title): movie_id for movie_id, title in cursor.fetchall()}
+            cursor.execute(select_user_id_name_age_triples)
+            user_ids = {(self._collation_key(name), age): user_id for user_id, name, age in cursor.fetchall()}
+            if reservations:
+                cursor.execute(select_reservation_counts)
+                num_reservations = dict(cursor.fetchall())
+                cursor.execute(select_reservation_pairs)
+                reserved = set(cursor.fetchall())
+        
+        return movie_ids, user_ids, num_reservations, reserved
+
+
+    def _insert_bulk_chunk(self, query, rows, movie_ids=None):
+        """Insert `rows` with `query` in one transaction, refreshing the movie_stats of `movie_ids` if given."""
+        with self._cursor() as cursor:
+            cursor.executemany(query, rows)
+            if movie_ids is not None:
+                cursor.execute(*self._movie_stats_query(refresh_movie_stats, movie_ids))
+
+
+    def _validate_bulk_row(self, row, movie_ids, user_ids):
+        """Collation keys of the row's movie and user, its director, price and class, or the row's error."""
+        title, director = self._collation_key(row["title"]), row["director"]
+        name, class_ = self._collation_key(row["name"]), row["class"]
+        try:
+            price = int(row["price"])
+        except ValueError:
+            raise MoviePriceError()
+        if title not in movie_ids and not 0 <= price <= 100000:
+            raise MoviePriceError()
+        try:
+            age = int(row["age"])
+        except ValueError:
+            raise UserAgeError()
+        if (name, age) not in user_ids and not 12 <= age <= 110:
+            raise UserAgeError()
+        if class_.upper() not in DiscountRate.__members__:
+            raise UserClassError()
+        return title, director, price, (name, age), class_
+
+
+    @staticmethod
+    def _collation_key(value):
+        """`value` as MySQL's default collation compares it: ignoring case and trailing spaces."""
+        return value.rstrip(" ").casefold()
     
     
     # Problem 15 (5 pt.)
+    def migrate(self, target_version=None):
+        """Apply the `schema.MIGRATIONS` newer than the database, up to `target_version` if given.
+
+        Each migration is recorded in `schema_migrations` once all its statements succeeded. Its DDL
+        waits at most MIGRATION_LOCK_TIMEOUT seconds for the tables' metadata locks, so a long
+        transaction makes it fail instead of stalling every query queued behind it; run it again later.
+        """
+        with self._cursor() as cursor:
+            cursor.execute(MIGRATIONS_TABLE)
+            cursor.execute(select_schema_version)
+            version = cursor.fetchone()[0] or BASELINE_VERSION  # tables from before migrations are the baseline
+        
+        applied = []
+        for migration_version, description, statements in MIGRATIONS:
+            if migration_version <= version or (target_version is not None and migration_version > target_version):
+                continue
+            with self._cursor() as cursor:
+                cursor.execute(set_lock_wait_timeout, (MIGRATION_LOCK_TIMEOUT,))
+                try:
+                    for statement in statements:
+                        try:
+                            cursor.execute(statement)
+                        except Error as err:
+                            if err.errno != errorcode.ER_DUP_KEYNAME:  # built by an interrupted run
+                                raise SchemaMigrationError(migration_version, err.msg)
+                    try:
+                        cursor.execute(insert_schema_version, (migration_version, description))
+                    except Error as err:
+                        if err.errno != errorcode.ER_DUP_ENTRY:  # applied concurrently by another agent
+                            raise
+                finally:
+                    cursor.execute(reset_lock_wait_timeout)
+            version = migration_version
+            applied.append(migration_version)
+        
+        return SchemaMigrationSuccess(version, applied)
+
+
+    def schema_version(self):
+        with self._cursor() as cursor:
+            cursor.execute(check_database_empty)
+            if cursor.fetchone()[0] == 0:
+                return None
+            try:
+                cursor.execute(select_schema_version)
+            except Error as err:
+                if err.errno == errorcode.ER_NO_SUCH_TABLE:  # created before migrations existed
+                    return BASELINE_VERSION
+                raise
+            return cursor.fetchone()[0] or BASELINE_VERSION
+
+
     def reset(self, confirmation, only_create_tables=False):
         if confirmation == 'n':
             return None
         
         with self._cursor() as cursor:
             cursor.execute(drop_all_tables)
+        self._clear_results()
             
         return self.initialize_database(only_create_tables)
 
 
+    def rebuild_movie_stats(self, cursor=None):
+        """Recompute every row of movie_stats from the reservation and rating tables."""
+        with self._optional_cursor(cursor) as cursor:
+            cursor.execute(TABLES["movie_stats"])
+            cursor.execute(*self._movie_stats_query(refresh_movie_stats))
+        self.leaderboard.invalidate()
+        self._invalidate_results(catalogs=["movies"])
+        
+        return MovieStatsRebuildSuccess()
+
+
+    def verify_movie_stats(self, repair=True):
+        """Return the ids of movies whose movie_stats row has drifted, repairing them if asked."""
+        with self._cursor() as cursor:
+            cursor.execute(*self._movie_stats_query(select_drifted_movie_stats))
+            drifted = [record[0] for record in cursor.fetchall()]
+            if drifted and repair:
+                cursor.execute(*self._movie_stats_query(refresh_movie_stats, drifted))
+        if drifted and repair:
+            self.leaderboard.invalidate()
+            self._invalidate_results(catalogs=["movies"])
+        
+        return drifted
+
+
+    @staticmethod
+    def _movie_stats_query(template, movie_ids=None):
+        if movie_ids is None:
+            condition = movie_condition = ""
+            params = ()
+        else:
+            movie_ids = tuple(movie_ids)
+            placeholders = ', '.join(['%s'] * len(movie_ids))
+            condition = f"WHERE movie_id IN ({placeholders})"
+            movie_condition = f"WHERE movie.movie_id IN ({placeholders})"
+            params = movie_ids * 3  # reservation, rating and movie filters
+        computed = computed_movie_stats.format(condition=condition, movie_condition=movie_condition)
+        
+        return template.format(computed=computed), params
+
+
     # Problem 2 (4 pt.)
     def print_movies(self):
+        return format_select_output(*self.fetch_movies())
+
+
+    def fetch_movies(self):
+        """Headers and records of `print_movies`, unformatted.
+
+        Every `print_*` method has a `fetch_*` counterpart returning its rows this way.
+        """
+        return self._cached("movies", self._load_movies, lambda records: ["movies"])
+
+
+    def _load_movies(self):
         headers = ["id", "title", "director", "price", "avg. price", "reservation", "avg. rating"]
         with self._cursor() as cursor:
             cursor.execute(select_all_from_movie)
             records = cursor.fetchall()
         
-        return format_select_output(headers, records)
+        return headers, records
 
 
     # Problem 3 (3 pt.)
     def print_users(self):
+        return format_select_output(*self.fetch_users())
+
+
+    def fetch_users(self):
+        return self._cached("users", self._load_users, lambda records: ["users"])
+
+
+    def _load_users(self):
         headers = ["id", "name", "age", "class"]
         with self._cursor() as cursor:
             cursor.execute(select_all_from_user)
             records = cursor.fetchall()
             
-        return format_select_output(headers, records)
+        return headers, records
+
+
+    def print_movies_page(self, after_id=0, limit=PAGE_SIZE):
+        """One page of `print_movies` starting after `after_id`, with the cursor of the next page.
+
+        The cursor is None on the last page. The same convention holds for the other `*_page` methods.
+        """
+        headers, records, next_after_id = self.fetch_movies_page(after_id, limit)
+        return format_select_output(headers, records), next_after_id
+
+
+    def fetch_movies_page(self, after_id=0, limit=PAGE_SIZE):
+        self._check_page_limit(limit)
+        headers = ["id", "title", "director", "price", "avg. price", "reservation", "avg. rating"]
+        with self._cursor() as cursor:
+            records, next_after_id = self._fetch_page(cursor, select_movies_page, (), after_id, limit)
+        
+        return headers, records, next_after_id
+
+
+    def print_users_page(self, after_id=0, limit=PAGE_SIZE):
+        headers, records, next_after_id = self.fetch_users_page(after_id, limit)
+        return format_select_output(headers, records), next_after_id
+
+
+    def fetch_users_page(self, after_id=0, limit=PAGE_SIZE):
+        self._check_page_limit(limit)
+        headers = ["id", "name", "age", "class"]
+        with self._cursor() as cursor:
+            records, next_after_id = self._fetch_page(cursor, select_users_page, (), after_id, limit)
+        
+        return headers, records, next_after_id
+
+
+    def export_movies(self, sink, fmt="table", exact_widths=False):
+        """Stream `print_movies` to a file-like `sink` in "table", "csv" or "jsonl" format.
+
+        Rows are read from an unbuffered cursor and written as they arrive. With `exact_widths`,
+        table column widths are measured on the server instead of from a sample of rows.
+        """
+        headers = ["id", "title", "director", "price", "avg. price", "reservation", "avg. rating"]
+        columns = ["movie_id", "title", "director", "price", "avg_price", "num_reservations", "avg_rating"]
+        return self._export(sink, headers, select_all_from_movie, columns, fmt, exact_widths)
+
+
+    def export_users(self, sink, fmt="table", exact_widths=False):
+        headers = ["id", "name", "age", "class"]
+        columns = ["user_id", "name", "age", "class"]
+        return self._export(sink, headers, select_all_from_user, columns, fmt, exact_widths)
+
+
+    def _export(self, sink, headers, query, columns, fmt, exact_widths):
+        with self._cursor(buffered=False) as cursor:
+            column_widths = None
+            if exact_widths and fmt == "table":
+                cursor.execute(select_column_widths.format(
+                    columns=', '.join(f"MAX(COALESCE(CHAR_LENGTH({column}), 4))" for column in columns),  # 4 == len("None")
+                    query=query.strip().rstrip(';')))
+                column_widths = [width or 0 for width in cursor.fetchall()[0]]
+            cursor.execute(query)
+            
+            return write_select_output(sink, headers, cursor, fmt=fmt, column_widths=column_widths)
+
+
+    def _cached(self, key, load, tags):
+        """`load()`'s headers and records, from the result cache under `key` if possible.
+
+        `tags(records)` names the rows the records were built from: "movies" or "users" for a whole
+        table, or `("movie", id)` and `("user", id)`. A None `key` is never cached.
+        """
+        if self.result_cache is None or key is None:
+            return load()
+        hit, value = self.result_cache.lookup(key)
+        if hit:
+            return value
+        with self._consistent_reads():  # a lagging replica's result must not outlive the lag
+            headers, records = load()
+        result = headers, tuple(records)
+        self.result_cache.store(key, result, tags(records), token=value)
+        return result
+
+
+    def _invalidate_results(self, movie_ids=(), user_ids=(), catalogs=()):
+        """Drop the cached results built from the rows of `movie_ids` and `user_ids`, and the `catalogs` listings."""
+        if self.result_cache is not None:
+            tags = [("movie", self._as_int(movie_id)) for movie_id in movie_ids]
+            tags += [("user", self._as_int(user_id)) for user_id in user_ids]
+            self.result_cache.invalidate(list(dict.fromkeys(tags)) + list(catalogs))
+
+
+    def _clear_results(self):
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+
+    def cache_stats(self):
+        """Hits, misses, evictions and invalidations of the result cache; None without one."""
+        return self.result_cache.stats() if self.result_cache is not None else None
+
+
+    @staticmethod
+    def _check_page_limit(limit):
+        if limit < 1:  # an empty page would hand out a cursor that never advances
+            raise ValueError(f"Page limit should be at least 1, got {limit}")
+
+
+    @staticmethod
+    def _fetch_page(cursor, query, params, after_id, limit):
+        cursor.execute(query, params + (after_id, limit + 1))  # one extra row tells whether a next page exists
+        records = cursor.fetchall()
+        next_after_id = records[limit - 1][0] if len(records) > limit else None
+        
+        return records[:limit], next_after_id
 
 
     # Problem 4 (4 pt.)
     def insert_movie(self, title, director, price, cursor=None):
+        owns_cursor = cursor is None
         with self._optional_cursor(cursor) as cursor:
             try:
                 cursor.execute(insert_into_movie, (title, director, price))
@@ -182,6 +849,12 @@ class MovieBookingAgent(SQLConnector):
                     raise MovieTitleAlreadyExistsError(title)
                 elif err.errno == errorcode.ER_CHECK_CONSTRAINT_VIOLATED:
                     raise MoviePriceError()
+                raise
+            movie_id = cursor.lastrowid  # before the movie_stats insert, whose table has no AUTO_INCREMENT
+            cursor.execute(insert_into_movie_stats, (movie_id,))
+        if owns_cursor:  # otherwise the caller's transaction may still be rolled back
+            self._update_similarity("add_movie", movie_id)
+            self._invalidate_results(catalogs=["movies"])
         
         return MovieInsertSuccess()
 
@@ -192,12 +865,16 @@ class MovieBookingAgent(SQLConnector):
             cursor.execute(delete_from_movie, (movie_id,))
             if cursor.rowcount == 0:
                 raise MovieNotExistError(movie_id)
+        self._update_similarity("remove_movie", movie_id)
+        self.leaderboard.invalidate()
+        self._invalidate_results([movie_id], catalogs=["movies"])
         
         return MovieRemoveSuccess()
 
 
     # Problem 5 (4 pt.)
     def insert_user(self, name, age, class_, cursor=None):
+        owns_cursor = cursor is None
         with self._optional_cursor(cursor) as cursor:
             try:
                 cursor.execute(insert_into_user, (name, age, class_))
@@ -208,6 +885,11 @@ class MovieBookingAgent(SQLConnector):
                     raise UserAgeError()
                 elif err.errno == errorcode.WARN_DATA_TRUNCATED:  # unallowed value for an ENUM field
                     raise UserClassError()
+                raise
+            user_id = cursor.lastrowid
+        if owns_cursor:
+            self._update_similarity("add_user", user_id)
+            self._invalidate_results(catalogs=["users"])
         
         return UserInsertSuccess()
 
@@ -215,53 +897,117 @@ class MovieBookingAgent(SQLConnector):
     # Problem 7 (4 pt.)
     def remove_user(self, user_id):
         with self._cursor() as cursor:
+            # Cascaded deletes do not reach movie_stats, so subtract the user's share first
+            cursor.execute(update_movie_stats_for_user_removal, (user_id,))
             cursor.execute(delete_from_user, (user_id,))
             if cursor.rowcount == 0:
                 raise UserNotExistError(user_id)
+        self._update_similarity("remove_user", user_id)
+        self.leaderboard.invalidate()
+        self._invalidate_results(user_ids=[user_id], catalogs=["users", "movies"])
         
         return UserRemoveSuccess()
 
 
     # Problem 8 (5 pt.)
     def book_movie(self, movie_id, user_id, price=None, class_=None, cursor=None):
+        if class_ and class_.upper() not in DiscountRate.__members__:  # the price would be NULL
+            raise UserClassError()
         with self._optional_cursor(cursor) as cursor:
-            cursor.execute(count_num_reservations, (movie_id,))
-            num_reservations = cursor.fetchall()
-            if num_reservations and num_reservations[0][0] == 10:
-                raise MovieFullyBookedError(movie_id)
-
-            if price:
-                orig_price = price
-            else:
-                cursor.execute(select_price_from_movie, (movie_id,))
-                orig_price_ = cursor.fetchone()
-                if orig_price_ is None:
-                    raise MovieNotExistError(movie_id)
-                orig_price = orig_price_[0]  # (price,)
-            if class_:
-                user_class = class_
-            else:
-                cursor.execute(select_class_from_user, (user_id,))
-                user_class_ = cursor.fetchone()
-                if user_class_ is None:
-                    raise UserNotExistError(user_id)
-                user_class = user_class_[0]  # (class,)
-            reservation_price = calculate_reservation_price(orig_price, user_class)
-            
+            # Taking the seat locks the movie's counter row until commit, so concurrent bookings
+            # of the same movie are serialized and can never exceed the capacity
+            self._reserve_seat(movie_id, cursor)
             try:
-                cursor.execute(insert_into_reservation, (movie_id, user_id, reservation_price))
+                cursor.execute(insert_into_reservation_with_price, (price or None, class_ or None, movie_id, user_id))
             except Error as err:
                 if err.errno == errorcode.ER_DUP_ENTRY:
                     raise MovieAlreadyBookedError(user_id, movie_id)
-                elif err.errno == errorcode.ER_NO_REFERENCED_ROW:
-                    if "`movie`" in str(err):
-                        raise MovieNotExistError(movie_id)
-                    elif "`user`" in str(err):
-                        raise UserNotExistError(user_id)
+                raise
+            else:
+                if cursor.rowcount == 0:  # the movie exists, so the user does not
+                    raise UserNotExistError(user_id)
+                cursor.execute(update_movie_stats_for_reservation, (movie_id, user_id, movie_id))
+        self.leaderboard.invalidate()
+        self._invalidate_results([movie_id], [user_id], ["movies"])
         
         return MovieBookSuccess()
 
 
+    def book_movies(self, pairs, all_or_nothing=False):
+        """Book many `(movie_id, user_id)` pairs in one transaction with set-wise validation.
+
+        Returns one result per pair, in order: `MovieBookSuccess` or the exception `book_movie`
+        would have raised for it, as if the pairs were booked one after another. With
+        `all_or_nothing`, any failure rolls back the whole batch and the otherwise valid pairs
+        report `BookingBatchRolledBackError`.
+        """
+        pairs = [(int(movie_id), int(user_id)) for movie_id, user_id in pairs]
+        if not pairs:
+            return []
+        movie_ids = sorted({movie_id for movie_id, _ in pairs})
+        user_ids = sorted({user_id for _, user_id in pairs})
+        movie_placeholders = ', '.join(['%s'] * len(movie_ids))
+        user_placeholders = ', '.join(['%s'] * len(user_ids))
+        
+        results, reservations = [], []
+        with self._cursor() as cursor:
+            # Locks the movies' counter rows like book_movie does, so capacity holds under concurrency;
+            # a missing row is created first, since a locking read cannot lock a row that does not exist
+            cursor.execute(*self._movie_stats_query(insert_missing_movie_stats, movie_ids))
+            cursor.execute(select_movies_for_booking.format(placeholders=movie_placeholders), tuple(movie_ids))
+            movie_records = cursor.fetchall()
+            prices = {movie_id: price for movie_id, price, _ in movie_records}
+            seats = {movie_id: num_reservations for movie_id, _, num_reservations in movie_records}
+            cursor.execute(select_class_for_users.format(placeholders=user_placeholders), tuple(user_ids))
+            user_classes = dict(cursor.fetchall())
+            cursor.execute(select_reservations_for_pairs.format(movie_placeholders=movie_placeholders, user_placeholders=user_placeholders),
+                           tuple(movie_ids) + tuple(user_ids))
+            booked = set(cursor.fetchall())
+            
+            for movie_id, user_id in pairs:  # same checks, in the same order, as book_movie
+                if movie_id not in prices:
+                    results.append(MovieNotExistError(movie_id))
+                elif seats[movie_id] >= MAX_RESERVATIONS:
+                    results.append(MovieFullyBookedError(movie_id))
+                elif (movie_id, user_id) in booked:
+                    results.append(MovieAlreadyBookedError(user_id, movie_id))
+                elif user_id not in user_classes:
+                    results.append(UserNotExistError(user_id))
+                else:
+                    seats[movie_id] += 1
+                    booked.add((movie_id, user_id))
+                    reservations.append((movie_id, user_id, calculate_reservation_price(prices[movie_id], user_classes[user_id])))
+                    results.append(MovieBookSuccess())
+            
+            if all_or_nothing and len(reservations) < len(pairs):
+                results = [BookingBatchRolledBackError(*pair) if isinstance(result, SuccessLog) else result
+                           for pair, result in zip(pairs, results)]
+                reservations = []
+            if reservations:
+                cursor.executemany(insert_into_reservation, reservations)
+                cursor.execute(*self._movie_stats_query(refresh_movie_stats, {movie_id for movie_id, _, _ in reservations}))
+        if reservations:
+            self.leaderboard.invalidate()
+            self._invalidate_results(*zip(*[(movie_id, user_id) for movie_id, user_id, _ in reservations]), ["movies"])
+        
+        return results
+
+
+    def _reserve_seat(self, movie_id, cursor, retry=True):
+        cursor.execute(reserve_seat, (movie_id, MAX_RESERVATIONS))
+        if cursor.rowcount == 1:
+            return
+        
+        cursor.execute(select_seat_count, (movie_id,))
+        record = cursor.fetchone()
+        if record is None:
+            raise MovieNotExistError(movie_id)
+        if record[0] is None and retry:  # missing movie_stats row
+            cursor.execute(*self._movie_stats_query(refresh_movie_stats, [movie_id]))
+            return self._reserve_seat(movie_id, cursor, retry=False)
+        raise MovieFullyBookedError(movie_id)
+
+
     # Problem 9 (5 pt.)
     def rate_movie(self, movie_id, user_id, rating):
         with self._cursor() as cursor:
@@ -284,12 +1030,128 @@ class MovieBookingAgent(SQLConnector):
                     raise UserAlreadyRatedError(user_id, movie_id)
                 elif err.errno == errorcode.ER_CHECK_CONSTRAINT_VIOLATED:
                     raise RatingError()
+                raise
+            else:
+                cursor.execute(update_movie_stats_for_rating, (movie_id, user_id, movie_id))
+        self._update_similarity("add_rating", user_id, movie_id, rating)
+        self.leaderboard.invalidate()
+        self._invalidate_results([movie_id], [user_id], ["movies"])
             
         return MovieRateSuccess()
 
 
+    def rate_movies(self, triples, upsert=False, chunk_size=BULK_CHUNK_SIZE):
+        """Rate many `(movie_id, user_id, rating)` triples with set-wise validation.
+
+        Returns one result per triple, in order: `MovieRateSuccess` or the exception `rate_movie`
+        would have raised for it. With `upsert`, existing ratings are overwritten instead of
+        rejected with `UserAlreadyRatedError`. Each chunk of `chunk_size` triples is committed
+        on its own, and replayed on its own after a transient failure.
+        """
+        triples = list(triples)
+        results = []
+        for start in range(0, len(triples), chunk_size):
+            chunk = triples[start:start + chunk_size]
+            results += self._retrying("rate_movies", lambda: self._rate_movies_chunk(chunk, upsert), IDEMPOTENT if upsert else WRITE)
+        
+        return results
+
+
+    def import_ratings(self, path, upsert=False, chunk_size=BULK_CHUNK_SIZE, rejects=None):
+        """Import a CSV file with movie_id, user_id and rating columns through `rate_movies`.
+
+        If `rejects` is a path, rejected rows are written there as CSV together with the reason.
+        """
+        with open(path) as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        results = self.rate_movies([(row["movie_id"], row["user_id"], row["rating"]) for row in rows], upsert, chunk_size)
+        rejected = [(row, result) for row, result in zip(rows, results) if isinstance(result, CustomBaseException)]
+        
+        if rejects is not None:
+            with open(rejects, "w", newline="") as rejectfile:
+                writer = csv.DictWriter(rejectfile, fieldnames=["movie_id", "user_id", "rating", "reason"], extrasaction="ignore")
+                writer.writeheader()
+                for row, e in rejected:
+                    writer.writerow({**row, "reason": str(e)})
+        
+        return RatingsImportSuccess(len(rows) - len(rejected), len(rejected))
+
+
+    def _rate_movies_chunk(self, triples, upsert):
+        parsed = [tuple(self._as_int(value) for value in triple) for triple in triples]
+        # IN (NULL) keeps a query valid when no id parsed, and matches nothing
+        movie_ids = sorted({movie_id for movie_id, _, _ in parsed if movie_id is not None}) or [None]
+        user_ids = sorted({user_id for _, user_id, _ in parsed if user_id is not None}) or [None]
+        movie_placeholders = ', '.join(['%s'] * len(movie_ids))
+        user_placeholders = ', '.join(['%s'] * len(user_ids))
+        pair_placeholders = dict(movie_placeholders=movie_placeholders, user_placeholders=user_placeholders)
+        
+        results, ratings = [], {}
+        with self._cursor() as cursor:
+            cursor.execute(select_existing_movie_ids.format(placeholders=movie_placeholders), tuple(movie_ids))
+            existing_movies = {record[0] for record in cursor.fetchall()}
+            cursor.execute(select_class_for_users.format(placeholders=user_placeholders), tuple(user_ids))
+            existing_users = {record[0] for record in cursor.fetchall()}
+            cursor.execute(select_reservations_for_pairs.format(**pair_placeholders), tuple(movie_ids) + tuple(user_ids))
+            booked = set(cursor.fetchall())
+            cursor.execute(select_ratings_for_pairs.format(**pair_placeholders), tuple(movie_ids) + tuple(user_ids))
+            rated = set(cursor.fetchall())
+            
+            for (movie_id, user_id, rating), (movie_id_, user_id_, _) in zip(parsed, triples):
+                if movie_id not in existing_movies:
+                    results.append(MovieNotExistError(movie_id_))
+                elif user_id not in existing_users:
+                    results.append(UserNotExistError(user_id_))
+                elif rating is None or not 1 <= rating <= 5:
+                    results.append(RatingError())
+                elif (movie_id, user_id) not in booked:
+                    results.append(UserNotBookedError(user_id, movie_id))
+                elif (movie_id, user_id) in rated and not upsert:
+                    results.append(UserAlreadyRatedError(user_id, movie_id))
+                else:
+                    rated.add((movie_id, user_id))
+                    ratings[(movie_id, user_id)] = rating  # with upsert, the last rating of a pair wins
+                    results.append(MovieRateSuccess())
+            
+            if ratings:
+                cursor.executemany(upsert_into_rating if upsert else insert_into_rating,
+                                   [(movie_id, user_id, rating) for (movie_id, user_id), rating in ratings.items()])
+                cursor.execute(*self._movie_stats_query(refresh_movie_stats, {movie_id for movie_id, _ in ratings}))
+        
+        if len(ratings) > INCREMENTAL_SIMILARITY_LIMIT:
+            self.similarity_engine.invalidate()
+            self._expire_similarity_model()
+        else:
+            for (movie_id, user_id), rating in ratings.items():
+                self._update_similarity("add_rating", user_id, movie_id, rating)
+        if ratings:
+            self.leaderboard.invalidate()
+            self._invalidate_results(*zip(*ratings), ["movies"])
+        
+        return results
+
+
+    @staticmethod
+    def _as_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+
     # # Problem 10 (5 pt.)
     def print_users_for_movie(self, movie_id):
+        return format_select_output(*self.fetch_users_for_movie(movie_id))
+
+
+    def fetch_users_for_movie(self, movie_id):
+        movie_id_ = self._as_int(movie_id)
+        return self._cached(("users_for_movie", movie_id_) if movie_id_ is not None else None,
+                            lambda: self._load_users_for_movie(movie_id),
+                            lambda records: [("movie", movie_id_)] + [("user", record[0]) for record in records])
+
+
+    def _load_users_for_movie(self, movie_id):
         headers = ["id", "name", "age", "res. price", "rating"]
         with self._cursor() as cursor:
             cursor.execute(check_movie_id, (movie_id,))
@@ -300,11 +1162,22 @@ class MovieBookingAgent(SQLConnector):
             cursor.execute(select_users_for_movie, (movie_id,))
             records = cursor.fetchall()
         
-        return format_select_output(headers, records)
+        return headers, records
 
 
     # Problem 11 (5 pt.)
     def print_movies_for_user(self, user_id):
+        return format_select_output(*self.fetch_movies_for_user(user_id))
+
+
+    def fetch_movies_for_user(self, user_id):
+        user_id_ = self._as_int(user_id)
+        return self._cached(("movies_for_user", user_id_) if user_id_ is not None else None,
+                            lambda: self._load_movies_for_user(user_id),
+                            lambda records: [("user", user_id_)] + [("movie", record[0]) for record in records])
+
+
+    def _load_movies_for_user(self, user_id):
         headers = ["id", "title", "director", "res. price", "rating"]
         with self._cursor() as cursor:
             cursor.execute(check_user_id, (user_id,))
@@ -315,36 +1188,95 @@ class MovieBookingAgent(SQLConnector):
             cursor.execute(select_movies_for_user, (user_id,))
             records = cursor.fetchall()
         
-        return format_select_output(headers, records)
+        return headers, records
 
 
-    # Problem 12 (6 pt.)
-    def recommend_popularity(self, user_id):
-        headers = ["id", "title", "res. price", "reservation", "avg. rating"]
-        output = ""
+    def print_users_for_movie_page(self, movie_id, after_id=0, limit=PAGE_SIZE):
+        headers, records, next_after_id = self.fetch_users_for_movie_page(movie_id, after_id, limit)
+        return format_select_output(headers, records), next_after_id
+
+
+    def fetch_users_for_movie_page(self, movie_id, after_id=0, limit=PAGE_SIZE):
+        self._check_page_limit(limit)
+        headers = ["id", "name", "age", "res. price", "rating"]
+        with self._cursor() as cursor:
+            cursor.execute(check_movie_id, (movie_id,))
+            movie_exists = cursor.fetchone()
+            if not movie_exists:
+                raise MovieNotExistError(movie_id)
+            
+            records, next_after_id = self._fetch_page(cursor, select_users_for_movie_page, (movie_id,), after_id, limit)
         
+        return headers, records, next_after_id
+
+
+    def print_movies_for_user_page(self, user_id, after_id=0, limit=PAGE_SIZE):
+        headers, records, next_after_id = self.fetch_movies_for_user_page(user_id, after_id, limit)
+        return format_select_output(headers, records), next_after_id
+
+
+    def fetch_movies_for_user_page(self, user_id, after_id=0, limit=PAGE_SIZE):
+        self._check_page_limit(limit)
+        headers = ["id", "title", "director", "res. price", "rating"]
         with self._cursor() as cursor:
             cursor.execute(check_user_id, (user_id,))
             user_exists = cursor.fetchone()
             if not user_exists:
                 raise UserNotExistError(user_id)
             
-            cursor.execute(select_class_from_user, (user_id,))
-            user_class = cursor.fetchone()[0]
-            
-            cursor.execute(select_highest_rating_movie, (user_id,))
-            result1 = cursor.fetchone()
-            highest_rating_record = [self._replace_reservation_price(result1, user_class)] if result1 else []
-            output += format_select_output(headers, highest_rating_record, title="Rating-based")
-            output += "\n"
-            cursor.execute(select_most_popular_movie, (user_id,))
-            result2 = cursor.fetchone()
-            most_popular_record = [self._replace_reservation_price(result2, user_class)] if result2 else []
-            output += format_select_output(headers, most_popular_record, title="Popularity-based")
+            records, next_after_id = self._fetch_page(cursor, select_movies_for_user_page, (user_id,), after_id, limit)
+        
+        return headers, records, next_after_id
+
+
+    # Problem 12 (6 pt.)
+    def recommend_popularity(self, user_id):
+        headers, recommendations = self.fetch_popularity_recommendations(user_id)
+        output = format_select_output(headers, recommendations["Rating-based"], title="Rating-based")
+        output += "\n"
+        output += format_select_output(headers, recommendations["Popularity-based"], title="Popularity-based")
         
         return output
+
+
+    def fetch_popularity_recommendations(self, user_id):
+        """Headers and a dict mapping "Rating-based" and "Popularity-based" to their records."""
+        headers = ["id", "title", "res. price", "reservation", "avg. rating"]
+        
+        generation, rankings = self.leaderboard.snapshot()
+        if rankings is None:
+            rankings = self._load_leaderboard(generation)
+        with self._cursor() as cursor:
+            cursor.execute(select_class_and_booked_movies, (user_id,))
+            records = cursor.fetchall()
+            if not records:
+                raise UserNotExistError(user_id)
+            user_class = records[0][0]
+            booked = {movie_id for _, movie_id in records if movie_id is not None}
+            
+            best = {}
+            for ranking, ranked_records in rankings.items():
+                record, known = self.leaderboard.first_unseen(ranked_records, booked)
+                if not known:  # the user has booked every cached movie, rank the whole catalog
+                    cursor.execute(select_popularity_recommendations, (user_id, user_id))
+                    best = {ranking: tuple(record) if record[0] is not None else None
+                            for ranking, _, *record in cursor.fetchall()}
+                    break
+                best[ranking] = record
+        
+        highest_rating_record = [self._replace_reservation_price(best["rating"], user_class)] if best["rating"] else []
+        most_popular_record = [self._replace_reservation_price(best["popularity"], user_class)] if best["popularity"] else []
+        
+        return headers, {"Rating-based": highest_rating_record, "Popularity-based": most_popular_record}
     
     
+    def _load_leaderboard(self, generation):
+        # Served to every user until it expires, so a lagging replica's rankings must not be stored
+        with self._consistent_reads(), self._cursor() as cursor:
+            cursor.execute(select_popularity_leaderboard, (self.leaderboard.size, self.leaderboard.size))
+            return self.leaderboard.store(generation, cursor.fetchall())
+
+
     def _replace_reservation_price(self, record, user_class):
         orig_price = record[2]
         reservation_price = calculate_reservation_price(orig_price, user_class)
@@ -353,68 +1285,271 @@ class MovieBookingAgent(SQLConnector):
 
     # Problem 13 (10 pt.)
     def recommend_item_based(self, user_id, k):
-        headers = ["id", "title", "res. price", "avg. rating", "expected rating"]
+        result = self.recommend_item_based_many([user_id], k)[int(user_id)]
+        if isinstance(result, CustomBaseException):
+            raise result
         
+        return result
+
+
+    def recommend_item_based_many(self, user_ids, k):
+        """Item-based recommendations for several users from one model and one scoring pass.
+
+        Returns a dict mapping each user id to its formatted top-k table, or to the exception
+        `recommend_item_based` would have raised for that user.
+        """
+        return self.format_item_based(*self.fetch_item_based_recommendations(user_ids, k))
+
+
+    def fetch_item_based_recommendations(self, user_ids, k):
+        """Headers and a dict mapping each user id to its top-k records or to its exception."""
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+        if not user_ids:
+            return [], {}
+        
+        user_classes, reservations = self._load_recommendation_users(user_ids)
+        model = self._fresh_similarity_model()
+        if model is not None:
+            user_ratings = self._load_user_ratings(user_classes)
+            results, recommendations = self._score_with_model(model, user_ids, user_classes, user_ratings, reservations, k)
+        else:
+            if self._similarity_stale(user_classes):
+                self.rebuild_similarity_state()
+            results, recommendations = self._score_item_based(user_ids, user_classes, reservations, k)
+        
+        return self._item_based_records(results, recommendations, user_classes)
+
+
+    @staticmethod
+    def format_item_based(headers, results):
+        return {user_id: result if isinstance(result, CustomBaseException) else format_select_output(headers, result)
+                for user_id, result in results.items()}
+
+
+    def _load_recommendation_users(self, user_ids):
+        placeholders = ', '.join(['%s'] * len(user_ids))
         with self._cursor() as cursor:
-            cursor.execute(check_user_id, (user_id,))
-            user_exists = cursor.fetchone()
-            if not user_exists:
-                raise UserNotExistError(user_id)
-            
-            cursor.execute(select_all_from_user)
+            cursor.execute(select_class_for_users.format(placeholders=placeholders), tuple(user_ids))
+            user_classes = dict(cursor.fetchall())
+            cursor.execute(select_reservations_for_users.format(placeholders=placeholders), tuple(user_ids))
+            reservations = cursor.fetchall()
+        
+        return user_classes, reservations
+
+
+    def _similarity_stale(self, user_classes):
+        engine = self.similarity_engine
+        return not engine.ready or any(user_id not in engine.user_ratings for user_id in user_classes)
+
+
+    def _score_item_based(self, user_ids, user_classes, reservations, k):
+        """CPU-bound part of `recommend_item_based_many`: no database access.
+
+        Returns the per-user exceptions and, for every other user, its top-k `(movie_id, expected
+        rating)` pairs.
+        """
+        engine = self.similarity_engine
+        with engine.lock:
+            results, scored_user_ids = self._scored_users(user_ids, user_classes, engine.user_ratings)
+            movie_ids = np.array(engine.movie_ids)
+            means = engine.means()
+            similarity_matrix = engine.similarity()
+            filled_matrix = np.array([engine.filled_row(user_id, means) for user_id in scored_user_ids]).reshape(-1, len(movie_ids))
+            movie_index = dict(engine.movie_index)
+        
+        # Weighted average of each user's ratings by similarity, leaving out the movie itself
+        diagonal = np.diag(similarity_matrix)
+        with np.errstate(invalid="ignore"):  # nan similarities give nan ratings, which rank last
+            estimated_ratings = np.round((np.dot(filled_matrix, similarity_matrix.T) - filled_matrix * diagonal)
+                                         / (similarity_matrix.sum(axis=1) - diagonal), 4)
+        
+        return results, self._rank_item_based(scored_user_ids, estimated_ratings, reservations, movie_ids, movie_index, k)
+
+
+    def _fresh_similarity_model(self):
+        """The published similarity model if it matches the database, None to use the engine."""
+        if self.similarity_model is None:
+            return None
+        with self._consistent_reads():  # a lagging replica would still match an older model
+            return self.similarity_model.fresh(self._rating_fingerprint)
+
+
+    def _load_user_ratings(self, user_classes):
+        """`{movie_id: rating}` of every user in `user_classes`."""
+        user_ratings = {user_id: {} for user_id in user_classes}
+        if user_ratings:
+            placeholders = ', '.join(['%s'] * len(user_ratings))
+            with self._cursor() as cursor:
+                cursor.execute(select_ratings_for_users.format(placeholders=placeholders), tuple(user_ratings))
+                for user_id, movie_id, rating in cursor.fetchall():
+                    user_ratings[user_id][movie_id] = rating
+        
+        return user_ratings
+
+
+    def _score_with_model(self, model, user_ids, user_classes, user_ratings, reservations, k):
+        """`_score_item_based` with a published model instead of the engine: no database access."""
+        results, scored_user_ids = self._scored_users(user_ids, user_classes, user_ratings)
+        filled_matrix = np.array([model.filled_row(user_ratings[user_id]) for user_id in scored_user_ids]).reshape(-1, len(model.movie_ids))
+        estimated_ratings = model.estimate(filled_matrix)
+        
+        return results, self._rank_item_based(scored_user_ids, estimated_ratings, reservations, np.array(model.movie_ids),
+                                              model.movie_index, k)
+
+
+    @staticmethod
+    def _scored_users(user_ids, user_classes, user_ratings):
+        """Exceptions of the users that cannot be scored, and the ids of the others."""
+        results, scored_user_ids = {}, []
+        for user_id in user_ids:
+            if user_id not in user_classes:
+                results[user_id] = UserNotExistError(user_id)
+            elif not user_ratings[user_id]:
+                results[user_id] = RatingNotExistError()
+            else:
+                scored_user_ids.append(user_id)
+        
+        return results, scored_user_ids
+
+
+    def _rank_item_based(self, scored_user_ids, estimated_ratings, reservations, movie_ids, movie_index, k):
+        """Top-k `(movie_id, expected rating)` pairs of every scored user among the movies it has not booked."""
+        # Candidate movies that the user has already seen are filtered out
+        row_index = {user_id: row for row, user_id in enumerate(scored_user_ids)}
+        candidates = np.ones(estimated_ratings.shape, dtype=bool)
+        for user_id, movie_id in reservations:
+            if user_id in row_index and movie_id in movie_index:
+                candidates[row_index[user_id], movie_index[movie_id]] = False
+        
+        recommendations = {}
+        for user_id, row in row_index.items():
+            indices = self._top_k(estimated_ratings[row], candidates[row], movie_ids, k)
+            recommendations[user_id] = [(int(movie_ids[idx]), estimated_ratings[row, idx]) for idx in indices]
+        
+        return recommendations
+
+
+    def _item_based_records(self, results, recommendations, user_classes):
+        headers = ["id", "title", "res. price", "avg. rating", "expected rating"]
+        recommended_ids = sorted({movie_id for pairs in recommendations.values() for movie_id, _ in pairs})
+        movie_records = {}
+        if recommended_ids:
+            placeholders = ', '.join(['%s'] * len(recommended_ids))
+            with self._cursor() as cursor:
+                cursor.execute(select_movies_recommend_info.format(placeholders=placeholders), tuple(recommended_ids))
+                movie_records = {record[0]: record for record in cursor.fetchall()}
+        
+        for user_id, pairs in recommendations.items():
+            top_k_records = []
+            for movie_id, expected_rating in pairs:
+                if movie_id not in movie_records:  # removed by another process since the model was trained
+                    continue
+                record = self._replace_reservation_price(movie_records[movie_id], user_classes[user_id])
+                top_k_records.append(record + (expected_rating,))
+            results[user_id] = top_k_records
+        
+        return headers, results
+
+
+    @staticmethod
+    def _top_k(estimated_ratings, candidates, movie_ids, k):
+        """Indices of the k best candidates by estimated rating, then by movie_id."""
+        indices = np.flatnonzero(candidates)
+        if k <= 0 or len(indices) == 0:
+            return indices[:0]
+        ranks = np.nan_to_num(estimated_ratings[indices], nan=-np.inf)
+        if k < len(indices):
+            kth_rank = ranks[np.argpartition(-ranks, k - 1)[:k]].min()
+            keep = ranks >= kth_rank  # keep ties at the boundary so movie_id decides between them
+            indices, ranks = indices[keep], ranks[keep]
+        
+        return indices[np.lexsort((movie_ids[indices], -ranks))][:k]
+
+
+    def _load_ratings(self, cursor=None):
+        # Writes are applied to the engine as they commit, so it must not be rebuilt from a replica missing some
+        with self._consistent_reads(), self._optional_cursor(cursor) as cursor:
+            cursor.execute(select_all_user_ids)
             user_ids = [record[0] for record in cursor.fetchall()]
-            cursor.execute(select_all_from_movie)
+            cursor.execute(select_all_movie_ids)
             movie_ids = [record[0] for record in cursor.fetchall()]
-            
             cursor.execute(select_user_movie_rating_triples)
             user_movie_ratings = cursor.fetchall()
-            
-        matrix = np.zeros((len(user_ids), len(movie_ids)))
-        user_has_ratings = False
-        for user_id_, movie_id, rating in user_movie_ratings:
-            user_has_ratings = (user_has_ratings or user_id_ == user_id)
-            user_idx = user_ids.index(user_id_)
-            movie_idx = movie_ids.index(movie_id)
-            matrix[user_idx, movie_idx] = rating
-        if not user_has_ratings:
-            raise RatingNotExistError()
-        
-        zeros = matrix == 0
-        means = np.around(np.ma.array(matrix, mask=zeros).mean(axis=0), 2)
-        filled_matrix = matrix + zeros * means.data
-
-        mu = np.around(np.mean(filled_matrix), 4)
-        diff = filled_matrix - mu
-        dot_product = np.dot(diff.T, diff)
-        norms = np.linalg.norm(diff, axis=0)
-        similarity_matrix = np.around(dot_product / np.outer(norms, norms), 4)
-
-        user_idx = user_ids.index(user_id)
-        def weighted_average(movie_idx):
-            movie_id = movie_ids[movie_idx]
-            user_ratings = filled_matrix[user_idx]
-            user_ratings = np.delete(user_ratings, movie_idx)
-            similarity_weights = similarity_matrix[movie_idx]
-            similarity_weights = np.delete(similarity_weights, movie_idx)
-            estimated_rating = np.round(np.sum(user_ratings * similarity_weights) / np.sum(similarity_weights), 4)
-            return movie_id, estimated_rating
-        
-        # Compute estimated ratings for movies that the user has not rated
-        not_rated_indices = np.where(matrix[user_idx] == 0)[0]
-        estimated_ratings_dict = dict(map(weighted_average, not_rated_indices))  # movie_id: estimated_rating
-        placeholders = ', '.join(['%s'] * len(estimated_ratings_dict))
         
-        with self._cursor() as cursor:
-            cursor.execute(select_class_from_user, (user_id,))
-            user_class = cursor.fetchone()[0]
-            cursor.execute(select_movie_recommend_info.format(placeholders=placeholders), tuple(estimated_ratings_dict.keys()) + (user_id,))  # candidate movies that user has already seen is filtered out
-            movie_records = cursor.fetchall()
-        movie_with_estimated_rating_records = []
-        for record in movie_records:
-            record = self._replace_reservation_price(record, user_class)
-            record += (estimated_ratings_dict[record[0]],)  # append estimated rating (record[0] is movie_id)
-            movie_with_estimated_rating_records.append(record)
-        # Sort by estimated rating, then by movie_id, and select top k
-        top_k_records = sorted(movie_with_estimated_rating_records, key=lambda x: (-x[4], x[0]))[:k]
-        
-        return format_select_output(headers, top_k_records)
\ No newline at end of file
+        return user_ids, movie_ids, user_movie_ratings
+
+
+    def _rating_fingerprint(self, cursor=None):
+        """Counts and checksums of the users, movies and ratings, telling whether a model is current."""
+        with self._optional_cursor(cursor) as cursor:
+            cursor.execute(select_rating_fingerprint)
+            return [int(value) for value in cursor.fetchone()]
+
+
+    def rebuild_similarity_state(self):
+        self.similarity_engine.rebuild(*self._load_ratings())
+
+
+    def train_similarity_model(self, directory, **build_options):
+        """Compute the item similarity model from the current ratings and publish it in `directory`.
+
+        The matrix is built in blocks by a pool of processes within a memory bound; `build_options`
+        (`dtype`, `block_size`, `workers`, `max_memory`, `progress`) go to `build_item_similarity`.
+        Serving processes opened with `similarity_model=directory` swap to the new version once they
+        find it matches the database. The fingerprint is read before the ratings, so a write landing
+        in between makes the model look stale rather than a stale model look current.
+        """
+        with self._consistent_reads(), self._cursor() as cursor:
+            fingerprint = self._rating_fingerprint(cursor)
+            user_ids, movie_ids, user_movie_ratings = self._load_ratings(cursor)
+        ratings = RatingMatrix(user_ids, movie_ids, user_movie_ratings)
+        version = publish_model(directory, ratings, fingerprint, **build_options)
+        
+        return SimilarityModelPublishSuccess(version, directory)
+
+
+    def similarity_model_stats(self):
+        """Version and freshness of the published similarity model in use; None without one."""
+        return self.similarity_model.stats() if self.similarity_model is not None else None
+
+
+    def _expire_similarity_model(self):
+        if self.similarity_model is not None:
+            self.similarity_model.expire()
+
+
+    def check_similarity_state(self):
+        """Compare the incrementally maintained statistics with the database, rebuilding on drift.
+
+        Returns True if they were consistent. Changes made by other processes are only picked up
+        here or on a full rebuild.
+        """
+        engine = self.similarity_engine
+        ratings = self._load_ratings()
+        fresh = ItemSimilarityEngine()
+        fresh.rebuild(*ratings)
+        with engine.lock:
+            consistent = engine.ready and self._same_statistics(engine.statistics(), fresh.statistics())
+            if not consistent:
+                engine.rebuild(*ratings)
+        
+        return consistent
+
+
+    @staticmethod
+    def _same_statistics(stats, other):
+        num_users, movie_ids, *matrices = stats
+        other_num_users, other_movie_ids, *other_matrices = other
+        return (num_users == other_num_users and movie_ids == other_movie_ids
+                and all(np.array_equal(a, b) for a, b in zip(matrices, other_matrices)))
+
+
+    def _update_similarity(self, method, *ids):
+        self._expire_similarity_model()
+        engine = self.similarity_engine
+        if not engine.ready:
+            return
+        try:
+            getattr(engine, method)(*map(int, ids))
+        except (KeyError, ValueError, TypeError):  # unknown to the engine, rebuild lazily
+            engine.invalidate()
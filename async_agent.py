@@ -0,0 +1,157 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from agent import PAGE_SIZE, MovieBookingAgent
+from messages import CustomBaseException
+from pool import POOL_MAX_SIZE
+
+REQUEST_TIMEOUT = 30.0
+
+
+class AsyncMovieBookingAgent:
+    """asyncio front end of a pooled `MovieBookingAgent`.
+
+    Database calls run on a thread pool with one worker per pooled connection. At most `pool_size`
+    of them are in flight; the others wait in the event loop, where cancelling them is free. The
+    numpy scoring of `recommend_item_based` runs on a separate pool of `cpu_workers` threads (numpy
+    releases the GIL), so it never holds a connection.
+
+    Every method takes a `timeout` in seconds, defaulting to the agent's `timeout` (None waits
+    forever), and raises `TimeoutError` when it expires. A call that already reached the database
+    cannot be interrupted: it finishes in its worker and its transaction commits or rolls back as a
+    whole, so a `book_movie` that timed out may still have booked.
+    """
+    def __init__(self, pool_size=POOL_MAX_SIZE, cpu_workers=None, timeout=REQUEST_TIMEOUT, **connector_options):
+        self.agent = MovieBookingAgent(pool_size=pool_size, **connector_options)
+        self.timeout = timeout
+        self._db_executor = ThreadPoolExecutor(pool_size, thread_name_prefix="movie-db")
+        self._cpu_executor = ThreadPoolExecutor(cpu_workers or os.cpu_count(), thread_name_prefix="movie-cpu")
+        self._db_slots = asyncio.Semaphore(pool_size)
+        self._rebuild_lock = asyncio.Lock()
+
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """Construct the agent without blocking the event loop on the pool's first connections."""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(cls, *args, **kwargs))
+
+
+    async def _db(self, function, *args):
+        async with self._db_slots:
+            return await asyncio.get_running_loop().run_in_executor(self._db_executor, partial(function, *args))
+
+
+    async def _cpu(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_executor, partial(function, *args))
+
+
+    async def _run(self, coroutine, timeout):
+        return await asyncio.wait_for(coroutine, self.timeout if timeout is None else timeout)
+
+
+    async def print_movies(self, timeout=None):
+        return await self._run(self._db(self.agent.print_movies), timeout)
+
+
+    async def print_users(self, timeout=None):
+        return await self._run(self._db(self.agent.print_users), timeout)
+
+
+    async def print_movies_page(self, after_id=0, limit=PAGE_SIZE, timeout=None):
+        return await self._run(self._db(self.agent.print_movies_page, after_id, limit), timeout)
+
+
+    async def print_users_page(self, after_id=0, limit=PAGE_SIZE, timeout=None):
+        return await self._run(self._db(self.agent.print_users_page, after_id, limit), timeout)
+
+
+    async def book_movie(self, movie_id, user_id, timeout=None):
+        return await self._run(self._db(self.agent.book_movie, movie_id, user_id), timeout)
+
+
+    async def rate_movie(self, movie_id, user_id, rating, timeout=None):
+        return await self._run(self._db(self.agent.rate_movie, movie_id, user_id, rating), timeout)
+
+
+    async def print_users_for_movie(self, movie_id, timeout=None):
+        return await self._run(self._db(self.agent.print_users_for_movie, movie_id), timeout)
+
+
+    async def print_movies_for_user(self, user_id, timeout=None):
+        return await self._run(self._db(self.agent.print_movies_for_user, user_id), timeout)
+
+
+    async def print_users_for_movie_page(self, movie_id, after_id=0, limit=PAGE_SIZE, timeout=None):
+        return await self._run(self._db(self.agent.print_users_for_movie_page, movie_id, after_id, limit), timeout)
+
+
+    async def print_movies_for_user_page(self, user_id, after_id=0, limit=PAGE_SIZE, timeout=None):
+        return await self._run(self._db(self.agent.print_movies_for_user_page, user_id, after_id, limit), timeout)
+
+
+    async def recommend_popularity(self, user_id, timeout=None):
+        return await self._run(self._db(self.agent.recommend_popularity, user_id), timeout)
+
+
+    async def recommend_item_based(self, user_id, k, timeout=None):
+        result = (await self.recommend_item_based_many([user_id], k, timeout))[int(user_id)]
+        if isinstance(result, CustomBaseException):
+            raise result
+
+        return result
+
+
+    async def recommend_item_based_many(self, user_ids, k, timeout=None):
+        return await self._run(self._recommend_item_based_many(user_ids, k), timeout)
+
+
+    async def _recommend_item_based_many(self, user_ids, k):
+        agent = self.agent
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+        if not user_ids:
+            return {}
+
+        user_classes, reservations = await self._db(agent._load_recommendation_users, user_ids)
+        model = await self._db(agent._fresh_similarity_model)
+        if model is not None:
+            user_ratings = await self._db(agent._load_user_ratings, user_classes)
+            results, recommendations = await self._cpu(agent._score_with_model, model, user_ids, user_classes,
+                                                       user_ratings, reservations, k)
+        else:
+            if agent._similarity_stale(user_classes):
+                async with self._rebuild_lock:  # requests that find the engine stale together share one rebuild
+                    if agent._similarity_stale(user_classes):
+                        ratings = await self._db(agent._load_ratings)
+                        await self._cpu(agent.similarity_engine.rebuild, *ratings)
+            results, recommendations = await self._cpu(agent._score_item_based, user_ids, user_classes, reservations, k)
+
+        return agent.format_item_based(*await self._db(agent._item_based_records, results, recommendations, user_classes))
+
+
+    def pool_stats(self):
+        return self.agent.pool_stats()
+
+
+    def query_stats(self):
+        return self.agent.query_stats()
+
+
+    async def close(self):
+        """Wait for the calls already running, then close the executors and the connection pool."""
+        await asyncio.get_running_loop().run_in_executor(None, self._shutdown)
+
+
+    def _shutdown(self):
+        self._db_executor.shutdown(wait=True, cancel_futures=True)
+        self._cpu_executor.shutdown(wait=True, cancel_futures=True)
+        self.agent.terminate()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
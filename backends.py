@@ -0,0 +1,204 @@
+import sqlite3
+from contextlib import contextmanager
+
+from mysql.connector import connect, errorcode, errors
+
+from schema import DB_NAME
+from sqlite_dialect import translate
+
+SQLITE_BUSY_TIMEOUT = 5.0
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+class MySQLBackend:
+    """Connections to the MySQL server the queries in `sql_queries.py` are written for.
+
+    A backend creates connections with `connect()` and tells the agent whether they support
+    server-side prepared statements and how many of them may be open at once (None for no limit).
+    """
+    supports_prepared_statements = True
+    max_connections = None
+
+    def __init__(self, host="astronaut.snu.ac.kr", port=7000, user=DB_NAME, password=DB_NAME, database=DB_NAME, connection_timeout=3):
+        self.options = dict(host=host, port=port, user=user, password=password, db=database,
+                            charset="utf8", connection_timeout=connection_timeout)
+
+
+    def connect(self):
+        return connect(**self.options)
+
+
+class SQLiteBackend:
+    """Embedded SQLite database at `path`, or in memory by default.
+
+    Connections look like MySQL connections to the agent: queries are translated by
+    `sqlite_dialect.translate` and errors are raised as the MySQL errors with the matching errno.
+    A file database runs in WAL mode so readers never wait for the writer. An in-memory database
+    lives in a single connection, so the agent never pools more than one. With `read_only`, the file
+    is opened read-only, e.g. to stand in for a read replica of a writable backend on the same file.
+    """
+    supports_prepared_statements = False  # sqlite3 already caches compiled statements per connection
+
+    def __init__(self, path=":memory:", busy_timeout=SQLITE_BUSY_TIMEOUT, pragmas=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.busy_timeout = busy_timeout
+        self.pragmas = {**SQLITE_PRAGMAS, **(pragmas or {})}
+        self.max_connections = 1 if path == ":memory:" else None
+
+
+    def connect(self):
+        with mysql_errors():
+            database, uri = (f"file:{self.path}?mode=ro", True) if self.read_only else (self.path, False)
+            connection = sqlite3.connect(database, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False, cached_statements=256, uri=uri)
+            for name, value in self.pragmas.items():
+                connection.execute(f"PRAGMA {name} = {value}")
+        return SQLiteConnection(connection)
+
+
+# (message prefix, errno, SQLSTATE) of the MySQL error raised for a failed SQLite constraint
+SQLITE_CONSTRAINT_ERRORS = [
+    ("UNIQUE constraint failed", errorcode.ER_DUP_ENTRY, "23000"),
+    ("FOREIGN KEY constraint failed", errorcode.ER_NO_REFERENCED_ROW_2, "23000"),
+    ("NOT NULL constraint failed", errorcode.ER_BAD_NULL_ERROR, "23000"),
+    ("CHECK constraint failed: class_enum", errorcode.WARN_DATA_TRUNCATED, "01000"),
+    ("CHECK constraint failed", errorcode.ER_CHECK_CONSTRAINT_VIOLATED, "HY000"),
+]
+SQLITE_BUSY_SNAPSHOT = 517  # a deferred transaction cannot write after another one committed
+
+
+@contextmanager
+def mysql_errors():
+    """Re-raise `sqlite3` errors as the `mysql.connector` errors the agent handles."""
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        for prefix, errno, sqlstate in SQLITE_CONSTRAINT_ERRORS:
+            if str(e).startswith(prefix):
+                raise errors.get_mysql_exception(errno, str(e), sqlstate) from e
+        raise errors.IntegrityError(str(e)) from e
+    except sqlite3.OperationalError as e:
+        if getattr(e, "sqlite_errorcode", None) == SQLITE_BUSY_SNAPSHOT:
+            raise errors.get_mysql_exception(errorcode.ER_LOCK_DEADLOCK, str(e), "40001") from e
+        if "database is locked" in str(e):
+            raise errors.get_mysql_exception(errorcode.ER_LOCK_WAIT_TIMEOUT, str(e), "HY000") from e
+        if str(e).startswith("no such table"):
+            raise errors.get_mysql_exception(errorcode.ER_NO_SUCH_TABLE, str(e), "42S02") from e
+        raise errors.OperationalError(str(e)) from e
+    except sqlite3.Error as e:
+        raise errors.DatabaseError(str(e)) from e
+
+
+class SQLiteConnection:
+    """The part of the MySQL connection interface the agent uses, over an autocommit sqlite3 connection.
+
+    A transaction is opened by the first statement after a commit or rollback, like MySQL with
+    autocommit off. It takes the write lock right away (BEGIN IMMEDIATE) if that statement writes
+    or locks rows; a transaction that starts by reading and writes later fails with MySQL's
+    deadlock error if another connection committed in between.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+        self._closed = False
+
+
+    def cursor(self, buffered=True, prepared=False):
+        return SQLiteCursor(self)
+
+
+    def _begin(self, writes):
+        if not self._connection.in_transaction:
+            with mysql_errors():
+                self._connection.execute("BEGIN IMMEDIATE" if writes else "BEGIN")
+
+
+    def commit(self):
+        if self._connection.in_transaction:
+            with mysql_errors():
+                self._connection.execute("COMMIT")
+
+
+    def rollback(self):
+        if self._connection.in_transaction:
+            with mysql_errors():
+                self._connection.execute("ROLLBACK")
+
+
+    def is_connected(self):
+        return not self._closed
+
+
+    def reconnect(self, attempts=1, delay=0):
+        pass  # an embedded database cannot lose its connection
+
+
+    def close(self):
+        self._closed = True
+        self._connection.close()
+
+
+class SQLiteCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection._connection.cursor()
+
+
+    def execute(self, operation, params=()):
+        statements, writes = translate(operation)
+        self._connection._begin(writes)
+        with mysql_errors():
+            for statement in statements:
+                self._cursor.execute(statement, tuple(params or ()))
+
+
+    def executemany(self, operation, seq_params):
+        (statement,), writes = translate(operation)
+        self._connection._begin(writes)
+        with mysql_errors():
+            self._cursor.executemany(statement, seq_params)
+
+
+    def fetchone(self):
+        with mysql_errors():
+            return self._cursor.fetchone()
+
+
+    def fetchall(self):
+        with mysql_errors():
+            return self._cursor.fetchall()
+
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+    def close(self):
+        self._cursor.close()
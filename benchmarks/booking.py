@@ -0,0 +1,114 @@
+"""Concurrent booking benchmark.
+
+Creates scratch movies and users, lets worker threads book random (movie, user) pairs through a
+pooled agent, then reports bookings/sec and checks that no movie holds more than
+MAX_RESERVATIONS reservations. Run from the repository root:
+
+    python -m benchmarks.booking --threads 16 --movies 50 --users 400
+
+Pass `--sqlite PATH` to run against an embedded SQLite database file instead of the MySQL server.
+"""
+import argparse
+import random
+import threading
+import uuid
+from collections import Counter
+from time import perf_counter
+
+from agent import MAX_RESERVATIONS, MovieBookingAgent
+from backends import SQLiteBackend
+from messages import CustomBaseException, MovieAlreadyBookedError, MovieFullyBookedError
+from sql_queries import select_id_from_movie, select_id_from_user
+
+
+def create_fixtures(agent, num_movies, num_users):
+    prefix = uuid.uuid4().hex[:8]
+    movie_ids, user_ids = [], []
+    for i in range(num_movies):
+        title = f"bench-{prefix}-{i}"
+        agent.insert_movie(title, "bench", 10000)
+        with agent._cursor() as cursor:
+            cursor.execute(select_id_from_movie, (title,))
+            movie_ids.append(cursor.fetchone()[0])
+    for i in range(num_users):
+        name = f"bench-{prefix}-{i}"
+        agent.insert_user(name, 30, random.choice(["basic", "premium", "vip"]))
+        with agent._cursor() as cursor:
+            cursor.execute(select_id_from_user, (name, 30))
+            user_ids.append(cursor.fetchone()[0])
+    return movie_ids, user_ids
+
+
+def run(agent, movie_ids, user_ids, num_threads, attempts_per_thread):
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = Counter()
+        for _ in range(attempts_per_thread):
+            try:
+                agent.book_movie(rng.choice(movie_ids), rng.choice(user_ids))
+            except MovieFullyBookedError:
+                local["full"] += 1
+            except MovieAlreadyBookedError:
+                local["duplicate"] += 1
+            except CustomBaseException:
+                local["other error"] += 1
+            else:
+                local["booked"] += 1
+        with lock:
+            outcomes.update(local)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(num_threads)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes, perf_counter() - start
+
+
+def count_reservations(agent, movie_ids):
+    placeholders = ', '.join(['%s'] * len(movie_ids))
+    with agent._cursor() as cursor:
+        cursor.execute(f"SELECT movie_id, COUNT(*) FROM reservation WHERE movie_id IN ({placeholders}) GROUP BY movie_id",
+                       tuple(movie_ids))
+        return dict(cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--movies", type=int, default=50)
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--attempts", type=int, default=100, help="booking attempts per thread")
+    parser.add_argument("--sqlite", metavar="PATH", help="SQLite database file to use instead of the MySQL server")
+    args = parser.parse_args()
+
+    agent = MovieBookingAgent(pool_size=args.threads, backend=SQLiteBackend(args.sqlite) if args.sqlite else None)
+    if args.sqlite:
+        agent.initialize_database(only_create_tables=True)  # creates the tables of a new database file
+    movie_ids, user_ids = create_fixtures(agent, args.movies, args.users)
+    try:
+        outcomes, elapsed = run(agent, movie_ids, user_ids, args.threads, args.attempts)
+        counts = count_reservations(agent, movie_ids)
+        overbooked = {movie_id: count for movie_id, count in counts.items() if count > MAX_RESERVATIONS}
+
+        total = sum(outcomes.values())
+        print(f"{total} attempts in {elapsed:.2f}s: {total / elapsed:.1f} attempts/sec, "
+              f"{outcomes['booked'] / elapsed:.1f} bookings/sec")
+        print(", ".join(f"{outcome}: {count}" for outcome, count in sorted(outcomes.items())))
+        print(f"reservations stored: {sum(counts.values())}, booked successfully: {outcomes['booked']}")
+        print(f"overbooked movies: {len(overbooked)}" + (f" {overbooked}" if overbooked else ""))
+        print("pool:", agent.pool_stats())
+    finally:
+        for movie_id in movie_ids:
+            agent.remove_movie(movie_id)
+        for user_id in user_ids:
+            agent.remove_user(user_id)
+        agent.terminate()
+
+
+if __name__ == "__main__":
+    main()
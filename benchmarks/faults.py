@@ -0,0 +1,150 @@
+"""Fault-injection check of the agent's retry policy (see `retry.py`).
+
+Runs a mixed workload of bookings, ratings and reads from many threads over a SQLite database whose
+connections fail at random: statements hit deadlocks, lock wait timeouts or lost connections, and
+commits lose the connection before or after the transaction is committed. Once the workload is done,
+faults are turned off and the database is checked: every acknowledged booking and rating is stored,
+nothing is stored that was not acknowledged unless its outcome was reported unknown, no movie is
+overbooked and movie_stats matches the reservation and rating tables. Reports the retry counts and
+exits with status 1 if a check fails. Run from the repository root:
+
+    python -m benchmarks.faults --threads 8 --operations 300 --fault-rate 0.05
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+from mysql.connector import Error
+
+from agent import MAX_RESERVATIONS, MovieBookingAgent
+from backends import SQLiteBackend
+from benchmarks.booking import count_reservations, create_fixtures
+from fault_injection import FaultInjector
+from messages import CustomBaseException, TransactionOutcomeUnknownError
+from sql_queries import select_reservation_pairs
+
+
+def run(agent, movie_ids, user_ids, num_threads, operations_per_thread, seed):
+    """Acknowledged and possibly applied bookings and ratings, and a count of every outcome."""
+    booked, rated = set(), set()
+    unknown_bookings, unknown_ratings = set(), set()
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def worker(worker_seed):
+        rng = random.Random(worker_seed)
+        for _ in range(operations_per_thread):
+            choice = rng.random()
+            if choice < 0.4:
+                operation, target, unknown = "book_movie", booked, unknown_bookings
+                pair = (rng.choice(movie_ids), rng.choice(user_ids))
+                call = lambda: agent.book_movie(*pair)
+            elif choice < 0.6 and booked:
+                operation, target, unknown = "rate_movie", rated, unknown_ratings
+                with lock:
+                    pair = rng.choice(sorted(booked))
+                call = lambda: agent.rate_movie(*pair, rng.randint(1, 5))
+            else:
+                operation, target, unknown, pair = "read", None, None, None
+                user_id = rng.choice(user_ids)
+                call = rng.choice([lambda: agent.fetch_movies_for_user(user_id),
+                                   lambda: agent.fetch_popularity_recommendations(user_id),
+                                   lambda: agent.fetch_movies_page(limit=20)])
+            try:
+                call()
+            except TransactionOutcomeUnknownError:
+                outcome = "unknown outcome"
+            except CustomBaseException:
+                outcome = "rejected"
+            except Error:
+                outcome = "failed"  # still failing after the last retry
+            else:
+                outcome = "ok"
+            with lock:
+                outcomes[f"{operation} {outcome}"] += 1
+                if target is not None and outcome == "ok":
+                    target.add(pair)
+                elif unknown is not None and outcome == "unknown outcome":
+                    unknown.add(pair)
+
+    threads = [threading.Thread(target=worker, args=(seed + i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return booked, rated, unknown_bookings, unknown_ratings, outcomes
+
+
+def check(agent, movie_ids, booked, rated, unknown_bookings, unknown_ratings):
+    """Descriptions of the consistency checks that failed."""
+    with agent._cursor() as cursor:
+        cursor.execute(select_reservation_pairs)
+        stored_bookings = set(cursor.fetchall())
+        cursor.execute("SELECT movie_id, user_id FROM rating")
+        stored_ratings = set(cursor.fetchall())
+    failures = []
+    if booked - stored_bookings:
+        failures.append(f"{len(booked - stored_bookings)} acknowledged bookings are missing")
+    if stored_bookings - booked - unknown_bookings:
+        failures.append(f"{len(stored_bookings - booked - unknown_bookings)} bookings were stored without being acknowledged")
+    if rated - stored_ratings:
+        failures.append(f"{len(rated - stored_ratings)} acknowledged ratings are missing")
+    if stored_ratings - rated - unknown_ratings:
+        failures.append(f"{len(stored_ratings - rated - unknown_ratings)} ratings were stored without being acknowledged")
+    overbooked = [movie_id for movie_id, count in count_reservations(agent, movie_ids).items() if count > MAX_RESERVATIONS]
+    if overbooked:
+        failures.append(f"movies {overbooked} are overbooked")
+    drifted = agent.verify_movie_stats(repair=False)
+    if drifted:
+        failures.append(f"movie_stats drifted for movies {drifted}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=300, help="operations per thread")
+    parser.add_argument("--movies", type=int, default=30)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--fault-rate", type=float, default=0.05, help="probability of a fault per statement and per commit")
+    parser.add_argument("--pool-size", type=int, default=8, help="0 shares one connection between the threads")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        injector = FaultInjector(SQLiteBackend(os.path.join(work_dir, "faults.db")), args.fault_rate, args.seed)
+        agent = MovieBookingAgent(backend=injector, pool_size=args.pool_size or None)
+        try:
+            agent.initialize_database(only_create_tables=True)
+            movie_ids, user_ids = create_fixtures(agent, args.movies, args.users)
+
+            injector.enabled = True
+            booked, rated, unknown_bookings, unknown_ratings, outcomes = run(
+                agent, movie_ids, user_ids, args.threads, args.operations, args.seed)
+            injector.enabled = False
+
+            failures = check(agent, movie_ids, booked, rated, unknown_bookings, unknown_ratings)
+            retries = agent.retry_stats()
+        finally:
+            agent.terminate()
+
+    print("injected faults: " + ", ".join(f"{fault} {count}" for fault, count in sorted(injector.injected.items())))
+    print("outcomes:        " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(outcomes.items())))
+    print("retries:         " + ", ".join(f"{event} {retries[event]}" for event in ("retries", "recovered", "exhausted", "ambiguous_commits")))
+    for name, stats in retries["operations"].items():
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(stats["reasons"].items()))
+        print(f"  {name:<34}retries {stats['retries']:>4}  recovered {stats['recovered']:>4}  exhausted {stats['exhausted']:>3}  ({reasons})")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("all consistency checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Query plans and latencies of the lookups by user before and after the schema migrations.
+
+Loads a synthetic data set (see `benchmarks.synthetic`) into a SQLite database at the baseline
+schema, explains and times the statements that filter reservation or rating by user, applies
+`migrate()` and does the same again. Run from the repository root:
+
+    python -m benchmarks.indexes --size small --iterations 200
+"""
+import argparse
+import os
+import random
+import tempfile
+from statistics import mean
+from time import perf_counter
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from benchmarks.synthetic import SIZES, generate
+from sql_queries import (count_num_users, select_class_and_booked_movies, select_movies_for_user,
+                         select_movies_for_user_page, select_movies_recommend_info, select_popularity_recommendations,
+                         select_reservations_for_users, update_movie_stats_for_user_removal)
+
+RECOMMEND_CANDIDATES = 20
+
+
+def statements(num_movies):
+    """(name, query, params(user_id)) of the statements looking up a user's reservations and ratings, and
+    of the movies recommended to the user."""
+    candidates = lambda: tuple(random.sample(range(1, num_movies + 1), RECOMMEND_CANDIDATES))
+    return [
+        ("select_movies_for_user", select_movies_for_user, lambda user_id: (user_id,)),
+        ("select_movies_for_user_page", select_movies_for_user_page, lambda user_id: (user_id, 0, 50)),
+        ("select_class_and_booked_movies", select_class_and_booked_movies, lambda user_id: (user_id,)),
+        ("select_movies_recommend_info", select_movies_recommend_info.format(placeholders=', '.join(['%s'] * RECOMMEND_CANDIDATES)),
+         lambda user_id: candidates()),
+        ("select_popularity_recommendations", select_popularity_recommendations, lambda user_id: (user_id,) * 2),
+        ("select_reservations_for_users", select_reservations_for_users.format(placeholders='%s'), lambda user_id: (user_id,)),
+        ("update_movie_stats_for_user_removal", update_movie_stats_for_user_removal, lambda user_id: (user_id,)),
+    ]
+
+
+def explain(agent, query, params):
+    with agent._cursor() as cursor:
+        cursor.execute("EXPLAIN " + query, params)
+        return [" ".join(map(str, row[3:] if len(row) == 4 else row)) for row in cursor.fetchall()]  # SQLite: plan detail only
+
+
+def time_statement(agent, query, params, user_ids):
+    latencies = []
+    for user_id in user_ids:
+        with agent._connection() as connection:  # rolled back below, so writes leave the data as it was
+            cursor = connection.cursor()
+            start = perf_counter()
+            cursor.execute(query, params(user_id))
+            if cursor.with_rows:
+                cursor.fetchall()
+            latencies.append(perf_counter() - start)
+            cursor.close()
+            connection.rollback()
+    return mean(latencies) * 1000
+
+
+def report(agent, label, num_movies, user_ids):
+    print(f"\n== {label} (schema version {agent.schema_version()}) ==")
+    results = {}
+    for name, query, params in statements(num_movies):
+        results[name] = time_statement(agent, query, params, user_ids)
+        print(f"\n{name}: {results[name]:.3f} ms")
+        for line in explain(agent, query, params(user_ids[0])):
+            print(f"    {line}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--iterations", type=int, default=200, help="random users per statement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    num_movies, num_users, num_reservations = SIZES[args.size]
+    with tempfile.TemporaryDirectory() as work_dir:
+        reservations_path, ratings_path = generate(work_dir, num_movies, num_users, num_reservations, seed=args.seed)
+        agent = MovieBookingAgent(backend=SQLiteBackend(os.path.join(work_dir, "indexes.db")), instrument=False)
+        try:
+            agent.initialize_database(bulk=True, migrate=False, path=reservations_path)
+            agent.import_ratings(ratings_path)
+            with agent._cursor() as cursor:
+                cursor.execute(count_num_users)
+                num_loaded_users = cursor.fetchone()[0]
+            user_ids = [random.randint(1, num_loaded_users) for _ in range(args.iterations)]
+
+            before = report(agent, "before", num_movies, user_ids)
+            start = perf_counter()
+            print(f"\n{agent.migrate()} in {perf_counter() - start:.2f} s")
+            after = report(agent, "after", num_movies, user_ids)
+        finally:
+            agent.terminate()
+
+    print(f"\n{'statement':<38}{'before ms':>11}{'after ms':>11}{'speedup':>9}")
+    for name in before:
+        print(f"{name:<38}{before[name]:>11.3f}{after[name]:>11.3f}{before[name] / after[name]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
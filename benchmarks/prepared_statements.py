@@ -0,0 +1,74 @@
+"""Text vs. binary (prepared statement) protocol latency for the lookup and booking paths.
+
+Runs the same workload on an agent with and without prepared statements and prints per-call
+latency percentiles together with the statement cache counters. Run from the repository root:
+
+    python -m benchmarks.prepared_statements --iterations 2000
+"""
+import argparse
+from statistics import quantiles
+from time import perf_counter
+
+from agent import MovieBookingAgent
+from benchmarks.booking import create_fixtures
+from sql_queries import check_movie_id, check_user_id, select_class_and_booked_movies
+
+
+def time_calls(call, iterations):
+    latencies = []
+    for i in range(iterations):
+        start = perf_counter()
+        call(i)
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+def summarize(name, latencies):
+    p50, p95, p99 = (quantiles(latencies, n=100)[q - 1] * 1000 for q in (50, 95, 99))
+    print(f"  {name:<8} p50 {p50:.3f} ms  p95 {p95:.3f} ms  p99 {p99:.3f} ms")
+
+
+def lookup(agent, movie_ids, user_ids):
+    def call(i):
+        with agent._cursor() as cursor:
+            cursor.execute(check_movie_id, (movie_ids[i % len(movie_ids)],))
+            cursor.fetchall()
+            cursor.execute(check_user_id, (user_ids[i % len(user_ids)],))
+            cursor.fetchall()
+            cursor.execute(select_class_and_booked_movies, (user_ids[i % len(user_ids)],))
+            cursor.fetchall()
+    return call
+
+
+def booking(agent, movie_ids, user_ids):
+    pairs = [(movie_id, user_id) for movie_id in movie_ids for user_id in user_ids[:10]]
+    def call(i):
+        agent.book_movie(*pairs[i % len(pairs)])
+    return call, len(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for prepared in (False, True):
+        agent = MovieBookingAgent(prepared_statements=prepared)
+        movie_ids, user_ids = create_fixtures(agent, max(1, args.iterations // 10), 10)
+        try:
+            print("binary protocol (prepared)" if prepared else "text protocol")
+            summarize("lookup", time_calls(lookup(agent, movie_ids, user_ids), args.iterations))
+            call, num_pairs = booking(agent, movie_ids, user_ids)
+            summarize("booking", time_calls(call, min(args.iterations, num_pairs)))
+            if prepared:
+                print("  statement cache:", agent.statement_cache_stats())
+        finally:
+            for movie_id in movie_ids:
+                agent.remove_movie(movie_id)
+            for user_id in user_ids:
+                agent.remove_user(user_id)
+            agent.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Booking latency under a concurrent reporting and recommendation load, with and without replicas.
+
+Loads a synthetic data set (see `benchmarks.synthetic`) into a SQLite database file, then runs
+booking threads next to reader threads calling `print_movies`, `recommend_popularity` and
+`print_movies_for_user`: once with every operation on the primary's pool, and once with the reads
+routed to read-only SQLite connections standing in for replicas. Reports booking p50/p95/p99,
+read throughput and where the reads ran. The stand-ins share the process and the database file with
+the primary, so this shows the reads leaving the primary's connection pool, not a lighter load on a
+separate server. Run from the repository root:
+
+    python -m benchmarks.replicas --size small --replicas 2 --seconds 5
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+from statistics import quantiles
+from time import perf_counter
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from benchmarks.synthetic import SIZES, generate
+from messages import CustomBaseException
+from replicas import SELECTIONS
+from sql_queries import count_num_users, select_all_movie_ids
+
+POOL_SIZE = 4
+
+
+def load(database, work_dir, size, seed):
+    num_movies, num_users, num_reservations = SIZES[size]
+    reservations_path, ratings_path = generate(work_dir, num_movies, num_users, num_reservations, seed=seed)
+    agent = MovieBookingAgent(backend=SQLiteBackend(database), instrument=False)
+    try:
+        agent.initialize_database(bulk=True, path=reservations_path)
+        agent.import_ratings(ratings_path)
+    finally:
+        agent.terminate()
+
+
+def run(agent, seconds, bookers, readers, seed):
+    """Booking latencies and the number of reads completed in `seconds`."""
+    with agent._cursor() as cursor:
+        cursor.execute(select_all_movie_ids)
+        movie_ids = [record[0] for record in cursor.fetchall()]
+        cursor.execute(count_num_users)
+        num_users = cursor.fetchone()[0]
+    latencies, reads = [], [0]
+    lock = threading.Lock()
+    deadline = perf_counter() + seconds
+
+    def book(worker_seed):
+        rng, local = random.Random(worker_seed), []
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                agent.book_movie(rng.choice(movie_ids), rng.randint(1, num_users))
+            except CustomBaseException:
+                pass
+            local.append(perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    def read(worker_seed):
+        rng, count = random.Random(worker_seed), 0
+        calls = [lambda: agent.print_movies(), lambda: agent.recommend_popularity(rng.randint(1, num_users)),
+                 lambda: agent.print_movies_for_user(rng.randint(1, num_users))]
+        while perf_counter() < deadline:
+            try:
+                rng.choice(calls)()
+            except CustomBaseException:
+                pass
+            count += 1
+        with lock:
+            reads[0] += count
+
+    threads = [threading.Thread(target=book, args=(seed + i,)) for i in range(bookers)]
+    threads += [threading.Thread(target=read, args=(seed + bookers + i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, reads[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--selection", choices=SELECTIONS, default="round_robin")
+    parser.add_argument("--bookers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        database = os.path.join(work_dir, "replicas.db")
+        load(database, work_dir, args.size, args.seed)
+        print(f"{'setup':<18}{'bookings':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'reads/s':>9}  reads on replicas")
+        for label, num_replicas in [("primary only", 0), (f"{args.replicas} replicas", args.replicas)]:
+            replicas = [SQLiteBackend(database, read_only=True) for _ in range(num_replicas)]
+            agent = MovieBookingAgent(backend=SQLiteBackend(database), pool_size=POOL_SIZE, replicas=replicas,
+                                      replica_selection=args.selection, instrument=False)
+            try:
+                latencies, reads = run(agent, args.seconds, args.bookers, args.readers, args.seed)
+                stats = agent.replica_stats()
+            finally:
+                agent.terminate()
+            p50, p95, p99 = (quantiles(latencies, n=100)[q - 1] * 1000 for q in (50, 95, 99))
+            on_replicas = sum(replica["reads"] for replica in stats["replicas"]) if stats else 0
+            print(f"{label:<18}{len(latencies):>9}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}{reads / args.seconds:>9.1f}  {on_replicas}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Time and peak memory of the item similarity matrix, computed densely and by the block builder.
+
+Draws synthetic ratings (see `benchmarks.synthetic`) and computes their similarity matrix once with
+`recommender.item_similarity`, which holds several movies x movies float64 matrices at once, and
+then with `similarity_builder.build_item_similarity` for every requested number of workers, into a
+memory-mapped .npy file. Each run happens in a fresh process, so the reported peak RSS (the
+largest of the process and its workers) is its own. It includes the pages of the output file a
+process wrote, which the kernel can reclaim, on top of the blocks `--max-memory-mb` bounds. Every
+block-built matrix is compared cell by cell with the dense one cast to the same dtype. Run from
+the repository root:
+
+    python -m benchmarks.similarity --movies 3000 --users 20000 --workers 1 2 4 --max-memory-mb 256
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.synthetic import ratings, reservation_counts, reservation_pairs
+from recommender import RatingMatrix, item_similarity
+from similarity_builder import SIMILARITY_MAX_MEMORY, build_item_similarity
+
+
+def rating_triples(num_movies, num_users, num_reservations, seed):
+    rng = np.random.default_rng(seed)
+    counts = reservation_counts(num_movies, num_reservations, 1.0, rng)
+    movies, users = reservation_pairs(counts, num_users, 0.8, rng)
+    values = ratings(movies, 0.5, 1.2, rng)
+    rated = values > 0
+    return np.stack([users[rated] + 1, movies[rated] + 1, values[rated]], axis=1)
+
+
+def run(work_dir, shape, workers, options):
+    """Seconds and peak RSS in MB of one computation, in the process it runs in; workers=0 is dense."""
+    triples = np.load(os.path.join(work_dir, "triples.npy"))
+    matrix = RatingMatrix(np.arange(1, shape[0] + 1), np.arange(1, shape[1] + 1), triples)
+    start = perf_counter()
+    if workers == 0:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.save(os.path.join(work_dir, "dense.npy"), item_similarity(matrix, matrix.column_means()))
+    else:
+        build_item_similarity(matrix, matrix.column_means(), os.path.join(work_dir, f"blocks{workers}.npy"),
+                              workers=workers, **options)
+    seconds = perf_counter() - start
+    peak_kib = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return seconds, peak_kib / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movies", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--reservations", type=int, help="default: 5 per movie")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32")
+    parser.add_argument("--block-size", type=int, help="default: derived from --max-memory-mb")
+    parser.add_argument("--max-memory-mb", type=int, default=SIMILARITY_MAX_MEMORY // 2 ** 20)
+    parser.add_argument("--no-dense", action="store_true", help="skip the dense computation and the comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    shape = (args.users, args.movies)
+    options = dict(dtype=args.dtype, block_size=args.block_size, max_memory=args.max_memory_mb * 2 ** 20)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as work_dir:
+        triples = rating_triples(args.movies, args.users, args.reservations or 5 * args.movies, args.seed)
+        np.save(os.path.join(work_dir, "triples.npy"), triples)
+        print(f"{args.movies} movies, {args.users} users, {len(triples)} ratings, {args.dtype}")
+        print(f"{'computation':<16}{'seconds':>9}{'peak MB':>9}  cells differing from dense")
+        runs = ([0] if not args.no_dense else []) + args.workers
+        for workers in runs:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                seconds, peak_mb = executor.submit(run, work_dir, shape, workers, options).result()
+            label = "dense" if workers == 0 else f"{workers} worker{'s' if workers > 1 else ''}"
+            differing = ""
+            if workers and not args.no_dense:
+                dense = np.load(os.path.join(work_dir, "dense.npy"), mmap_mode="r").astype(args.dtype)
+                blocks = np.load(os.path.join(work_dir, f"blocks{workers}.npy"), mmap_mode="r")
+                differing = int(np.sum(~((dense == blocks) | (np.isnan(dense) & np.isnan(blocks)))))
+            print(f"{label:<16}{seconds:>9.2f}{peak_mb:>9.1f}  {differing}")
+
+
+if __name__ == "__main__":
+    main()
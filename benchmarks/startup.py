@@ -0,0 +1,72 @@
+"""Startup latency of a short-lived agent process, from `import agent` to its first results.
+
+Each run is a fresh interpreter that imports the agent, constructs it over a SQLite copy of
+`data.csv`, and times the first query and the first item-based recommendation (which imports
+numpy). Reports the median and maximum of every phase over the runs. Run from the repository root:
+
+    python -m benchmarks.startup --runs 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+
+PHASES = ["import agent", "construct agent", "first query", "first recommendation", "interpreter total"]
+
+CHILD = """\
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import agent
+imported = perf_counter()
+from backends import SQLiteBackend
+movie_agent = agent.MovieBookingAgent(backend=SQLiteBackend(sys.argv[1]))
+constructed = perf_counter()
+movie_agent.fetch_movies_page(limit=10)
+queried = perf_counter()
+movie_agent.fetch_item_based_recommendations([1], 1)
+recommended = perf_counter()
+movie_agent.terminate()
+print(json.dumps({"import agent": imported - start, "construct agent": constructed - imported,
+                  "first query": queried - constructed, "first recommendation": recommended - queried}))
+"""
+
+
+def run_child(database):
+    """Phase timings of one fresh interpreter, plus its wall time including interpreter startup."""
+    start = perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, database], capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings["interpreter total"] = perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        database = os.path.join(work_dir, "startup.db")
+        agent = MovieBookingAgent(backend=SQLiteBackend(database))
+        agent.initialize_database(bulk=True)
+        agent.terminate()
+
+        run_child(database)  # warms the file system cache
+        runs = [run_child(database) for _ in range(args.runs)]
+
+    print(f"{'phase':<24}{'median ms':>12}{'max ms':>10}")
+    for phase in PHASES:
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<24}{median(values):>12.1f}{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
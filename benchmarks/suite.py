@@ -0,0 +1,263 @@
+"""Per-operation latency benchmark of the agent at several data sizes.
+
+For every size, synthetic data (see `benchmarks.synthetic`) is loaded into a fresh embedded SQLite
+database through `initialize_database` and `import_ratings`, then each agent method is timed over
+random arguments. Every size runs in its own process so peak RSS is measured per size. Reports
+p50/p95/p99 latency, peak RSS and statements issued per call, and writes them as JSON for
+regression tracking. Run from the repository root:
+
+    python -m benchmarks.suite --sizes tiny,small --iterations 50 --output results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from statistics import mean, quantiles
+from time import perf_counter
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from benchmarks.synthetic import SIZES, generate
+from messages import CustomBaseException
+from sql_queries import count_num_users, select_id_from_movie, select_id_from_user, select_reservation_pairs
+
+MAX_SIMILARITY_MOVIES = 5000  # the similarity state is dense movies x movies, ~24 bytes per pair
+RECOMMEND_COUNT = 5
+
+
+class StatementCounter:
+    """Backend wrapper counting the statements executed through its connections."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.supports_prepared_statements = backend.supports_prepared_statements
+        self.max_connections = backend.max_connections
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+    def connect(self):
+        return _CountingConnection(self.backend.connect(), self)
+
+
+    def add(self, count=1):
+        with self._lock:
+            self.count += count
+
+
+class _CountingConnection:
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._connection.cursor(*args, **kwargs), self._counter)
+
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+
+    def execute(self, *args, **kwargs):
+        self._counter.add()
+        return self._cursor.execute(*args, **kwargs)
+
+
+    def executemany(self, *args, **kwargs):
+        self._counter.add()
+        return self._cursor.executemany(*args, **kwargs)
+
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def operations(agent, num_movies, num_users, rng):
+    """(name, call) pairs in the order they are timed; each call draws its own arguments."""
+    movie = lambda: rng.randint(1, num_movies)
+    user = lambda: rng.randint(1, num_users)
+    new_ids = iter(range(1, 1 << 30))
+    removable_movies, removable_users = [], []
+    with agent._cursor() as cursor:
+        cursor.execute(select_reservation_pairs)
+        reservations = cursor.fetchall()  # rating random pairs would almost never hit a booked one
+
+    def insert_movie():
+        title = f"bench movie {next(new_ids)}"
+        agent.insert_movie(title, "bench", 10000)
+        with agent._cursor() as cursor:
+            cursor.execute(select_id_from_movie, (title,))
+            removable_movies.append(cursor.fetchone()[0])
+
+    def insert_user():
+        name = f"bench user {next(new_ids)}"
+        agent.insert_user(name, 30, rng.choice(["basic", "premium", "vip"]))
+        with agent._cursor() as cursor:
+            cursor.execute(select_id_from_user, (name, 30))
+            removable_users.append(cursor.fetchone()[0])
+
+    return [
+        ("print_movies", agent.print_movies),
+        ("print_users", agent.print_users),
+        ("print_movies_page", lambda: agent.print_movies_page(rng.randint(0, num_movies))),
+        ("print_users_page", lambda: agent.print_users_page(rng.randint(0, num_users))),
+        ("export_movies", lambda: agent.export_movies(io.StringIO())),
+        ("print_users_for_movie", lambda: agent.print_users_for_movie(movie())),
+        ("print_movies_for_user", lambda: agent.print_movies_for_user(user())),
+        ("recommend_popularity", lambda: agent.recommend_popularity(user())),
+        ("rebuild_similarity_state", agent.rebuild_similarity_state),
+        ("recommend_item_based", lambda: agent.recommend_item_based(user(), RECOMMEND_COUNT)),
+        ("recommend_item_based_many", lambda: agent.recommend_item_based_many([user() for _ in range(32)], RECOMMEND_COUNT)),
+        ("book_movie", lambda: agent.book_movie(movie(), user())),
+        ("rate_movie", lambda: agent.rate_movie(*rng.choice(reservations), rng.randint(1, 5))),
+        ("insert_movie", insert_movie),
+        ("insert_user", insert_user),
+        ("remove_movie", lambda: agent.remove_movie(removable_movies.pop() if removable_movies else movie())),
+        ("remove_user", lambda: agent.remove_user(removable_users.pop() if removable_users else user())),
+        ("verify_movie_stats", lambda: agent.verify_movie_stats(repair=False)),
+    ]
+
+
+def time_operation(call, iterations, counter):
+    latencies, num_errors = [], 0
+    statements_before = counter.count
+    for _ in range(iterations):
+        start = perf_counter()
+        try:
+            call()
+        except CustomBaseException:  # e.g. a fully booked movie; still a completed request
+            num_errors += 1
+        latencies.append(perf_counter() - start)
+
+    cuts = quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "iterations": iterations,
+        "errors": num_errors,
+        "mean_ms": mean(latencies) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "statements_per_call": (counter.count - statements_before) / iterations,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_size(size, iterations, work_dir, skip, seed, result_cache=False):
+    """Generate, load and time one data size; runs in a child process."""
+    num_movies, num_users, num_reservations = SIZES[size]
+    reservations_path, ratings_path = generate(os.path.join(work_dir, size), num_movies, num_users, num_reservations, seed=seed)
+    database = os.path.join(work_dir, f"{size}.db")
+    for path in (database, database + "-wal", database + "-shm"):  # ids in ratings.csv assume an empty database
+        if os.path.exists(path):
+            os.remove(path)
+    counter = StatementCounter(SQLiteBackend(database))
+    agent = MovieBookingAgent(backend=counter, result_cache=result_cache or None)
+    results = {"movies": num_movies, "users": num_users, "reservations": num_reservations, "operations": {}}
+    try:
+        for name, call in [("initialize_database", lambda: agent.initialize_database(bulk=True, path=reservations_path)),
+                           ("import_ratings", lambda: agent.import_ratings(ratings_path))]:
+            results["operations"][name] = time_operation(call, 1, counter)
+        with agent._cursor() as cursor:
+            cursor.execute(count_num_users)
+            num_users = cursor.fetchone()[0]  # users who never booked are not in the data
+
+        rng = random.Random(seed)
+        for name, call in operations(agent, num_movies, num_users, rng):
+            if name in skip:
+                continue
+            if "similarity" in name or "item_based" in name:
+                if num_movies > MAX_SIMILARITY_MOVIES:
+                    results["operations"][name] = {"skipped": f"more than {MAX_SIMILARITY_MOVIES} movies for the dense similarity state"}
+                    continue
+            count = 1 if name in ("rebuild_similarity_state", "verify_movie_stats") else iterations
+            results["operations"][name] = time_operation(call, count, counter)
+    finally:
+        agent.terminate()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(size, results):
+    print(f"\n{size}: {results['movies']} movies, {results['users']} users, {results['reservations']} reservations")
+    print(f"  {'operation':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'stmts':>8}{'errors':>8}{'rss MB':>9}")
+    for name, result in results["operations"].items():
+        if "skipped" in result:
+            print(f"  {name:<28}skipped: {result['skipped']}")
+            continue
+        print(f"  {name:<28}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['statements_per_call']:>8.1f}{result['errors']:>8}{result['peak_rss_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="tiny,small", help=f"comma-separated sizes among {', '.join(SIZES)}")
+    parser.add_argument("--iterations", type=int, default=50, help="calls per operation")
+    parser.add_argument("--skip", default="", help="comma-separated operations not to time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--result-cache", action="store_true", help="time the listings through the agent's result cache")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--work-dir", help="where to keep the generated data and databases (a temporary directory by default)")
+    args = parser.parse_args()
+
+    sizes = [size for size in args.sizes.split(",") if size]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+    skip = set(filter(None, args.skip.split(",")))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backend": "sqlite",
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "result_cache": args.result_cache,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        work_dir = args.work_dir or temporary_dir
+        for size in sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                results = executor.submit(run_size, size, args.iterations, work_dir, skip, args.seed, args.result_cache).result()
+            report["sizes"][size] = results
+            print_results(size, results)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
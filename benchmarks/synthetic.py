@@ -0,0 +1,144 @@
+"""Synthetic data sets in the format of data.csv, with skewed popularity and ratings.
+
+Movie popularity follows a Zipf law (clipped to MAX_RESERVATIONS reservations per movie, since the
+loader rejects anything above it), users book with Zipfian activity, and ratings are J-shaped with a
+per-movie bias. Alongside the reservations CSV, a ratings CSV in the `import_ratings` format is
+written; its ids assume the reservations are loaded into an empty database, which numbers movies
+and users in order of first appearance. Run from the repository root:
+
+    python -m benchmarks.synthetic --size medium --output /tmp/medium
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from agent import MAX_RESERVATIONS
+
+# (movies, users, reservations); reservations can be at most MAX_RESERVATIONS per movie
+SIZES = {
+    "tiny": (200, 1000, 1000),
+    "small": (1000, 5000, 5000),
+    "medium": (10000, 50000, 50000),
+    "large": (100000, 500000, 1000000),
+}
+PRICES = [8500, 10000, 12000, 15000, 16000, 17000, 20000, 25000]
+CLASSES = ["basic", "premium", "vip"]
+CLASS_WEIGHTS = [0.5, 0.3, 0.2]
+NAMES = ["Ava", "Mason", "Charlotte", "Sophia", "Liam", "Noah", "Emma", "Olivia", "Elijah", "James",
+         "Amelia", "Lucas", "Mia", "Harper", "Ethan", "Layla", "Minji", "Jiho", "Seoyeon", "Hyunwoo"]
+
+
+def zipf_weights(n, exponent, rng):
+    """Zipf weights over `n` items whose ranks are randomly permuted, normalized to sum to 1."""
+    weights = np.arange(1, n + 1, dtype=float) ** -exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def reservation_counts(num_movies, num_reservations, exponent, rng):
+    """Per-movie reservation counts in [1, MAX_RESERVATIONS] following a clipped Zipf law."""
+    if not num_movies <= num_reservations <= num_movies * MAX_RESERVATIONS:
+        raise ValueError(f"Reservations should be between the number of movies and {MAX_RESERVATIONS} times it")
+    weights = zipf_weights(num_movies, exponent, rng)
+    low, high = 0.0, float(num_reservations) / weights.min()
+    for _ in range(100):  # bisect the scale so the clipped counts add up to the target
+        scale = (low + high) / 2
+        if np.clip(np.rint(scale * weights), 1, MAX_RESERVATIONS).sum() < num_reservations:
+            low = scale
+        else:
+            high = scale
+    counts = np.clip(np.rint(high * weights), 1, MAX_RESERVATIONS).astype(np.int64)
+
+    excess = int(counts.sum()) - num_reservations
+    while excess > 0:  # remove the rounding surplus from the least popular movies that can spare it
+        spare = np.flatnonzero(counts > 1)
+        take = spare[np.argsort(weights[spare])][:excess]
+        counts[take] -= 1
+        excess -= len(take)
+    return counts
+
+
+def reservation_pairs(counts, num_users, exponent, rng):
+    """(movie index, user index) pairs with `counts[m]` distinct Zipf-sampled users per movie."""
+    movies = np.repeat(np.arange(len(counts)), counts)
+    user_weights = zipf_weights(num_users, exponent, rng)
+    users = rng.choice(num_users, size=len(movies), p=user_weights)
+    for _ in range(100):
+        keys = movies * num_users + users
+        order = np.argsort(keys, kind="stable")
+        duplicate = np.zeros(len(keys), dtype=bool)
+        duplicate[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+        if not duplicate.any():
+            break
+        users[duplicate] = rng.choice(num_users, size=int(duplicate.sum()), p=user_weights)
+    else:
+        raise RuntimeError("Could not draw distinct users for every movie; use more users or a flatter skew")
+    return movies, users
+
+
+def ratings(movies, rated_fraction, exponent, rng):
+    """Rating of each reservation (0 if unrated): J-shaped around 5 plus a per-movie bias."""
+    levels = np.array([5, 4, 3, 2, 1])
+    level_weights = np.arange(1, 6, dtype=float) ** -exponent
+    base = rng.choice(levels, size=len(movies), p=level_weights / level_weights.sum())
+    bias = rng.normal(0, 0.75, size=movies.max() + 1 if len(movies) else 0)
+    values = np.clip(np.rint(base + bias[movies]), 1, 5).astype(np.int64)
+    values[rng.random(len(movies)) >= rated_fraction] = 0
+    return values
+
+
+def generate(output_dir, num_movies, num_users, num_reservations, rated_fraction=0.5,
+             popularity_exponent=1.0, activity_exponent=0.8, rating_exponent=1.2, seed=0):
+    """Write `reservations.csv` (data.csv format) and `ratings.csv` to `output_dir` and return their paths."""
+    rng = np.random.default_rng(seed)
+    counts = reservation_counts(num_movies, num_reservations, popularity_exponent, rng)
+    movies, users = reservation_pairs(counts, num_users, activity_exponent, rng)
+    values = ratings(movies, rated_fraction, rating_exponent, rng)
+
+    directors = rng.integers(0, max(1, num_movies // 5), size=num_movies)
+    prices = rng.choice(PRICES, size=num_movies)
+    ages = rng.integers(12, 81, size=num_users)
+    classes = rng.choice(len(CLASSES), size=num_users, p=CLASS_WEIGHTS)
+
+    # The loader numbers users by first appearance, which the ratings file has to follow
+    user_ids = np.zeros(num_users, dtype=np.int64)
+    seen, first = np.unique(users, return_index=True)
+    user_ids[seen[np.argsort(first)]] = np.arange(1, len(seen) + 1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    reservations_path = os.path.join(output_dir, "reservations.csv")
+    ratings_path = os.path.join(output_dir, "ratings.csv")
+    with open(reservations_path, "w", newline="") as reservations_file, open(ratings_path, "w", newline="") as ratings_file:
+        reservations_writer, ratings_writer = csv.writer(reservations_file), csv.writer(ratings_file)
+        reservations_writer.writerow(["title", "director", "price", "name", "age", "class"])
+        ratings_writer.writerow(["movie_id", "user_id", "rating"])
+        for movie, user, rating in zip(movies.tolist(), users.tolist(), values.tolist()):
+            reservations_writer.writerow([f"Movie {movie:06d}", f"Director {directors[movie]:05d}", prices[movie],
+                                          f"{NAMES[user % len(NAMES)]} {user:07d}", ages[user], CLASSES[classes[user]]])
+            if rating:
+                ratings_writer.writerow([movie + 1, user_ids[user], rating])
+
+    return reservations_path, ratings_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--movies", type=int, help="overrides the size preset")
+    parser.add_argument("--users", type=int, help="overrides the size preset")
+    parser.add_argument("--reservations", type=int, help="overrides the size preset")
+    parser.add_argument("--rated-fraction", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True, help="directory for reservations.csv and ratings.csv")
+    args = parser.parse_args()
+
+    num_movies, num_users, num_reservations = SIZES[args.size]
+    paths = generate(args.output, args.movies or num_movies, args.users or num_users,
+                     args.reservations or num_reservations, args.rated_fraction, seed=args.seed)
+    print("\n".join(paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import pickle
+import sys
+import threading
+from collections import OrderedDict, deque
+from time import monotonic
+
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_TTL = 60.0  # seconds, bounds how long writes of other processes may go unnoticed
+INVALIDATION_HISTORY = 4096  # latest invalidations a concurrent load is checked against
+EVERYTHING = object()  # tag of `clear()`, matching every entry
+
+
+def estimate_size(value):
+    """Approximate bytes held by `value` and the tuples and lists within it."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(map(estimate_size, value))
+    return size
+
+
+class ResultCache:
+    """In-process LRU cache of query results, bounded by entries and bytes, with a time to live.
+
+    Each entry is stored with tags naming the rows it was built from, and `invalidate(tags)` drops
+    exactly the entries sharing one of them. `lookup` returns either a hit or a token; `store` skips
+    a result whose tags were invalidated after its token was handed out, so a load racing with a
+    write never caches what the write changed.
+    """
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key: (expires_at, size, tags, value), least recently used first
+        self._keys_by_tag = {}
+        self._bytes = 0
+        self._sequence = 0
+        self._invalidations = deque(maxlen=INVALIDATION_HISTORY)  # (sequence, tag)
+
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        self._num_expirations = 0
+        self._num_invalidations = 0
+        self._num_stale_stores = 0
+
+
+    def lookup(self, key):
+        """`(True, value)` on a hit, `(False, token)` on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self._entries.move_to_end(key)
+                    self._num_hits += 1
+                    return True, entry[3]
+                self._remove(key)
+                self._num_expirations += 1
+            self._num_misses += 1
+            return False, self._sequence
+
+
+    def store(self, key, value, tags, token):
+        size = estimate_size(value)
+        with self._lock:
+            if not self._unchanged_since(token, tags):
+                self._num_stale_stores += 1
+                return
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (monotonic() + self.ttl, size, tags, value)
+            self._bytes += size
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._num_evictions += 1
+
+
+    def _unchanged_since(self, token, tags):
+        if token == self._sequence:
+            return True
+        if not self._invalidations or self._invalidations[0][0] > token + 1:  # the history no longer reaches back
+            return False
+        return not any(tag is EVERYTHING or tag in tags for sequence, tag in self._invalidations if sequence > token)
+
+
+    def _remove(self, key):
+        _, size, tags, _ = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._sequence += 1
+                self._invalidations.append((self._sequence, tag))
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self._num_invalidations += 1
+
+
+    def clear(self):
+        with self._lock:
+            self._sequence += 1
+            self._invalidations.append((self._sequence, EVERYTHING))
+            self._num_invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self._bytes = 0
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self._num_hits + self._num_misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._num_hits,
+                "misses": self._num_misses,
+                "hit_rate": self._num_hits / lookups if lookups else 0.0,
+                "evictions": self._num_evictions,
+                "expirations": self._num_expirations,
+                "invalidations": self._num_invalidations,
+                "stale_stores": self._num_stale_stores,
+            }
+
+
+class RedisResultCache:
+    """`ResultCache` shared by every agent process using the same Redis server (`pip install redis`).
+
+    Entries expire after `ttl` seconds, and the server's `maxmemory` with an LRU eviction policy
+    bounds their memory. Each tag has a version counter that `invalidate` increments; an entry keeps
+    the versions of its tags and is a miss once one of them has moved on. A store is skipped if any
+    process invalidated anything since its `lookup`. Entries are pickled, so the server must only be
+    writable by trusted agents.
+    """
+    def __init__(self, url="redis://localhost:6379/0", ttl=CACHE_TTL, prefix="movie_booking:cache:"):
+        import redis  # optional, only needed for a shared cache
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.ttl = ttl
+        self.prefix = prefix
+        self._writes = f"{prefix}writes"
+        self._lock = threading.Lock()
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_invalidations = 0
+        self._num_stale_stores = 0
+
+
+    def _entry_key(self, key):
+        return f"{self.prefix}entry:{key!r}"
+
+
+    def _tag_keys(self, tags):
+        return [f"{self.prefix}tag:*"] + [f"{self.prefix}tag:{tag!r}" for tag in tags]  # tag:* is bumped by `clear`
+
+
+    def lookup(self, key):
+        raw, token = self._redis.pipeline().get(self._entry_key(key)).get(self._writes).execute()
+        if raw is not None:
+            tags, versions, value = pickle.loads(raw)
+            if self._redis.mget(self._tag_keys(tags)) == versions:
+                self._count("_num_hits")
+                return True, value
+        self._count("_num_misses")
+        return False, token
+
+
+    def store(self, key, value, tags, token):
+        with self._redis.pipeline() as pipeline:
+            try:
+                pipeline.watch(self._writes)
+                versions = pipeline.mget(self._tag_keys(tags))
+                if pipeline.get(self._writes) != token:
+                    self._count("_num_stale_stores")
+                    return
+                pipeline.multi()
+                pipeline.setex(self._entry_key(key), int(self.ttl) or 1, pickle.dumps((tags, versions, value)))
+                pipeline.execute()
+            except self._watch_error:
+                self._count("_num_stale_stores")
+
+
+    def invalidate(self, tags):
+        pipeline = self._redis.pipeline()
+        for tag_key in self._tag_keys(tags)[1:]:
+            pipeline.incr(tag_key)
+        pipeline.incr(self._writes).execute()
+        self._count("_num_invalidations", len(tags))
+
+
+    def clear(self):
+        self._redis.pipeline().incr(self._tag_keys(())[0]).incr(self._writes).execute()
+
+
+    def _count(self, counter, count=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+
+    def stats(self):
+        """Counters of this process, and the server's evictions."""
+        with self._lock:
+            lookups = self._num_hits + self._num_misses
+            stats = {
+                "hits": self._num_hits,
+                "misses": self._num_misses,
+                "hit_rate": self._num_hits / lookups if lookups else 0.0,
+                "invalidations": self._num_invalidations,
+                "stale_stores": self._num_stale_stores,
+            }
+        return {**stats, "evictions": self._redis.info("stats").get("evicted_keys")}
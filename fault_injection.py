@@ -0,0 +1,126 @@
+"""Backend wrapper injecting the transient failures `retry.py` handles, for checks of the retry policy.
+
+Used by `benchmarks/faults.py` and the tests. Wrap any backend and set `enabled`; statements and
+commits then fail at random like their MySQL counterparts.
+"""
+import random
+import threading
+from collections import Counter
+
+from mysql.connector import errorcode, errors
+
+STATEMENT_FAULTS = ("deadlock", "lock_wait_timeout", "connection_lost")
+COMMIT_FAULTS = ("commit_lost_before", "commit_lost_after")
+
+
+class FaultInjector:
+    """Backend wrapper whose connections fail at random once `enabled` is set.
+
+    Faults behave like their MySQL counterparts: a deadlock rolls the transaction back, a lock wait
+    timeout fails the statement only, and a lost connection rolls back whatever was not committed
+    and fails every call until it is reconnected.
+    """
+    def __init__(self, backend, rate, seed=0):
+        self.backend = backend
+        self.supports_prepared_statements = backend.supports_prepared_statements
+        self.max_connections = backend.max_connections
+        self.rate = rate
+        self.enabled = False
+        self.injected = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+
+    def connect(self):
+        return _FaultyConnection(self.backend.connect(), self)
+
+
+    def draw(self, faults):
+        """One of `faults` to inject now, or None."""
+        with self._lock:
+            if not (self.enabled and faults) or self._random.random() >= self.rate:
+                return None
+            fault = self._random.choice(faults)
+            self.injected[fault] += 1
+            return fault
+
+
+class _FaultyConnection:
+    def __init__(self, connection, injector):
+        self._connection = connection
+        self._injector = injector
+        self._lost = False
+
+
+    def check(self, faults=STATEMENT_FAULTS):
+        if self._lost:
+            raise errors.get_mysql_exception(errorcode.CR_SERVER_GONE_ERROR, "MySQL server has gone away (injected)", "HY000")
+        fault = self._injector.draw(faults)
+        if fault == "deadlock":
+            self._connection.rollback()
+            raise errors.get_mysql_exception(errorcode.ER_LOCK_DEADLOCK, "Deadlock found (injected)", "40001")
+        if fault == "lock_wait_timeout":
+            raise errors.get_mysql_exception(errorcode.ER_LOCK_WAIT_TIMEOUT, "Lock wait timeout exceeded (injected)", "HY000")
+        return fault
+
+
+    def lose(self):
+        self._connection.rollback()
+        self._lost = True
+        raise errors.get_mysql_exception(errorcode.CR_SERVER_LOST, "Lost connection to MySQL server (injected)", "HY000")
+
+
+    def cursor(self, *args, **kwargs):
+        return _FaultyCursor(self._connection.cursor(*args, **kwargs), self)
+
+
+    def commit(self):
+        fault = self.check(COMMIT_FAULTS)
+        if fault == "commit_lost_after":
+            self._connection.commit()
+        if fault is not None:
+            self.lose()
+        self._connection.commit()
+
+
+    def rollback(self):
+        self.check(())
+        self._connection.rollback()
+
+
+    def is_connected(self):
+        return not self._lost and self._connection.is_connected()
+
+
+    def reconnect(self, attempts=1, delay=0):
+        self._lost = False
+
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class _FaultyCursor:
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+
+    def execute(self, *args, **kwargs):
+        if self._connection.check() == "connection_lost":
+            self._connection.lose()
+        return self._cursor.execute(*args, **kwargs)
+
+
+    def executemany(self, *args, **kwargs):
+        if self._connection.check() == "connection_lost":
+            self._connection.lose()
+        return self._cursor.executemany(*args, **kwargs)
+
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
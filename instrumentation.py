@@ -0,0 +1,356 @@
+import json
+import re
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+from time import perf_counter
+
+import sql_queries
+from schema import MIGRATIONS, MIGRATIONS_TABLE, TABLES
+from utils import json_default
+
+# Upper bounds of the latency histogram buckets, in seconds; the last bucket is unbounded
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_MS = 100  # default threshold of run.py --slow-query-log
+SLOW_LOG_MAX_PARAMS = 20
+STATEMENT_NAME_LENGTH = 60
+
+WHITESPACE = re.compile(r"\s+")
+PLACEHOLDER_LIST = re.compile(r"%s(?:, %s)+")
+TEMPLATE_FIELD = re.compile(r"\{\w+\}")
+
+
+def _normalize(query):
+    return WHITESPACE.sub(" ", query).strip()
+
+
+@lru_cache(maxsize=None)
+def _statement_index():
+    """Names by query text, and the patterns of the templated queries; built by the first lookup."""
+    names, templates = {}, []
+    for name, value in vars(sql_queries).items():
+        if name.startswith("_") or not isinstance(value, str):
+            continue
+        if TEMPLATE_FIELD.search(value):  # filled in with placeholder lists, conditions or subqueries
+            literals = TEMPLATE_FIELD.split(PLACEHOLDER_LIST.sub("%s", _normalize(value)))
+            pattern = "(.*?)".join(map(re.escape, literals))  # compiled by `re` when first tried
+            templates.append((sum(map(len, literals)), pattern, name))
+        else:
+            names[_normalize(value)] = name
+    for name, query in TABLES.items():
+        names[_normalize(query)] = f"create_table_{name}"
+    names[_normalize(MIGRATIONS_TABLE)] = "create_table_schema_migrations"
+    for version, _, statements in MIGRATIONS:
+        for statement in statements:
+            names[_normalize(statement)] = f"migration_{version}"
+    templates.sort(key=lambda template: -template[0])  # the most specific template wins
+    return names, [(pattern, name) for _, pattern, name in templates]
+
+
+@lru_cache(maxsize=1024)
+def _template_name(query):
+    for pattern, name in _statement_index()[1]:
+        if re.fullmatch(pattern, query, re.DOTALL):
+            return name
+    return query[:STATEMENT_NAME_LENGTH]
+
+
+def statement_name(query):
+    """Name of the `sql_queries.py` constant `query` was built from, or its first words."""
+    query = _normalize(query)
+    name = _statement_index()[0].get(query)
+    if name is None:  # placeholder lists are collapsed so every list length shares a cache entry
+        name = _template_name(PLACEHOLDER_LIST.sub("%s", query))
+    return name
+
+
+def instrumented(method):
+    """Time the agent method `method` as an operation of the agent's `instrumentation`, if any."""
+    @wraps(method)
+    def wrapper(agent, *args, **kwargs):
+        if agent.instrumentation is None:
+            return method(agent, *args, **kwargs)
+        return agent.instrumentation.run_operation(method.__name__, lambda: method(agent, *args, **kwargs))
+
+    return wrapper
+
+
+class LatencyHistogram:
+    """Counts of latencies in the fixed `LATENCY_BUCKETS`, with their count, sum and maximum."""
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, latency):
+        self.counts[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile (the maximum for the last bucket)."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "buckets": [[bound * 1000, count] for bound, count in zip(LATENCY_BUCKETS + (None,), self.counts) if count],
+        }
+
+
+class _StatementStats:
+    __slots__ = ("latency", "rows", "errors", "retries")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.rows = 0
+        self.errors = 0
+        self.retries = 0
+
+
+    def snapshot(self):
+        return {**self.latency.snapshot(), "rows": self.rows, "errors": self.errors, "retries": self.retries}
+
+
+class _OperationStats:
+    __slots__ = ("latency", "errors", "statements")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.statements = {}
+
+
+    def snapshot(self):
+        statements = {name: {"count": count, "total_ms": total * 1000, "share": total / self.latency.total if self.latency.total else 0.0}
+                      for name, (count, total) in sorted(self.statements.items(), key=lambda item: -item[1][1])}
+        return {**self.latency.snapshot(), "errors": self.errors, "statements": statements}
+
+
+class Instrumentation:
+    """Latency, row and retry statistics of every statement the agent runs, by agent method.
+
+    Statements are named after the `sql_queries.py` constant they come from. Each public agent
+    method is an operation with its own latency histogram and a breakdown of the time spent in each
+    of its statements; a method called by another one counts towards its caller. Statements slower
+    than `slow_query_threshold` seconds are written as JSON lines to `slow_query_log` (a path or a
+    text stream), with their `EXPLAIN` plan if `explain_slow_queries` is set.
+    """
+    def __init__(self, slow_query_threshold=None, slow_query_log=None, explain_slow_queries=False):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self._slow_log_path = slow_query_log if isinstance(slow_query_log, str) else None
+        self._slow_log = None if self._slow_log_path else slow_query_log
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._statements = {}
+        self._operations = {}
+
+
+    def run_operation(self, name, call):
+        """Run `call()` as the operation `name`, unless it runs within another operation."""
+        if getattr(self._local, "operation", None) is not None:
+            return call()
+        self._local.operation, self._local.retries = name, 0
+        start, failed = perf_counter(), True
+        try:
+            result = call()
+            failed = False
+            return result
+        finally:
+            latency = perf_counter() - start
+            self._local.operation, self._local.retries = None, 0
+            with self._lock:
+                stats = self._operations.get(name)
+                if stats is None:
+                    stats = self._operations[name] = _OperationStats()
+                stats.latency.add(latency)
+                stats.errors += failed
+
+
+    def record_retry(self):
+        """Count the statements run from now on until the current operation ends as retried."""
+        self._local.retries = getattr(self._local, "retries", 0) + 1
+
+
+    def record(self, name, latency, rows=0, failed=False):
+        operation = getattr(self._local, "operation", None)
+        retried = getattr(self._local, "retries", 0) > 0
+        with self._lock:
+            stats = self._statements.get(name)
+            if stats is None:
+                stats = self._statements[name] = _StatementStats()
+            stats.latency.add(latency)
+            stats.rows += rows
+            stats.errors += failed
+            stats.retries += retried
+            if operation is not None:
+                operation_stats = self._operations.get(operation)
+                if operation_stats is None:
+                    operation_stats = self._operations[operation] = _OperationStats()
+                count, total = operation_stats.statements.get(name, (0, 0.0))
+                operation_stats.statements[name] = (count + 1, total + latency)
+
+
+    def add_rows(self, name, rows):
+        with self._lock:
+            stats = self._statements.get(name)
+            if stats is not None:  # unless reset in between
+                stats.rows += rows
+
+
+    def is_slow(self, latency):
+        return self.slow_query_threshold is not None and latency >= self.slow_query_threshold
+
+
+    def log_slow_query(self, name, query, params, latency, rows, failed, plan=None):
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "operation": getattr(self._local, "operation", None),
+            "statement": name,
+            "latency_ms": round(latency * 1000, 3),
+            "rows": rows,
+            "retried": getattr(self._local, "retries", 0) > 0,
+            "failed": failed,
+            "query": _normalize(query),
+            "params": list(params or ())[:SLOW_LOG_MAX_PARAMS],
+        }
+        if plan is not None:
+            entry["plan"] = plan
+        line = json.dumps(entry, default=json_default) + "\n"
+        with self._lock:
+            if self._slow_log is None and self._slow_log_path is not None:
+                self._slow_log = open(self._slow_log_path, "a", buffering=1)
+            if self._slow_log is not None:
+                self._slow_log.write(line)
+
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "statements": {name: stats.snapshot() for name, stats in sorted(self._statements.items())},
+                "operations": {name: stats.snapshot() for name, stats in sorted(self._operations.items())},
+            }
+
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._operations.clear()
+
+
+    def close(self):
+        with self._lock:
+            if self._slow_log_path is not None and self._slow_log is not None:
+                self._slow_log.close()
+                self._slow_log = None
+
+
+class InstrumentedCursor:
+    """Cursor facade timing each statement and counting the rows it returns or affects.
+
+    Rows of a result set are counted as they are fetched and added to the statement's total when
+    the next statement runs or the cursor closes. Slow `SELECT`s are explained on a separate
+    cursor of the same `connection`, which needs the result set to be buffered already.
+    """
+    def __init__(self, cursor, instrumentation, connection, buffered=True):
+        self._cursor = cursor
+        self._instrumentation = instrumentation
+        self._connection = connection
+        self._buffered = buffered
+        self._name = None
+        self._fetched = 0
+
+
+    def execute(self, operation, params=()):
+        return self._timed(self._cursor.execute, operation, params)
+
+
+    def executemany(self, operation, seq_params):
+        return self._timed(self._cursor.executemany, operation, seq_params, many=True)
+
+
+    def _timed(self, method, operation, params, many=False):
+        name = statement_name(operation)
+        self._flush()
+        start, failed = perf_counter(), True
+        try:
+            result = method(operation, params)
+            failed = False
+            return result
+        finally:
+            latency = perf_counter() - start
+            with_rows = not failed and self._cursor.with_rows
+            rows = 0 if failed or with_rows else max(self._cursor.rowcount, 0)
+            self._instrumentation.record(name, latency, rows, failed)
+            if with_rows:
+                self._name = name
+            if self._instrumentation.is_slow(latency):
+                if with_rows:  # known up front for buffered result sets only
+                    rows = self._cursor.rowcount if self._cursor.rowcount >= 0 else None
+                plan = self._explain(operation, params) if not many and not failed else None
+                self._instrumentation.log_slow_query(name, operation, None if many else params, latency, rows, failed, plan)
+
+
+    def _explain(self, operation, params):
+        if not (self._instrumentation.explain_slow_queries and self._buffered and operation.lstrip().upper().startswith("SELECT")):
+            return None
+        cursor = self._connection.cursor(buffered=True)
+        try:
+            cursor.execute("EXPLAIN " + operation, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:  # the plan is a diagnostic, never fail the statement for it
+            return {"error": str(e)}
+        finally:
+            cursor.close()
+
+
+    def _flush(self):
+        if self._name is not None and self._fetched:
+            self._instrumentation.add_rows(self._name, self._fetched)
+        self._name, self._fetched = None, 0
+
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched += row is not None
+        return row
+
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched += len(rows)
+        return rows
+
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
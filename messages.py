@@ -46,6 +46,27 @@ class MovieRateSuccess(SuccessLog):
         super().__init__("Movie successfully rated")
         
 
+class RatingsImportSuccess(SuccessLog):
+    def __init__(self, num_imported, num_rejected):
+        super().__init__(f"{num_imported} ratings successfully imported, {num_rejected} rejected")
+        
+
+class MovieStatsRebuildSuccess(SuccessLog):
+    def __init__(self):
+        super().__init__("Movie statistics successfully rebuilt")
+
+
+class SchemaMigrationSuccess(SuccessLog):
+    def __init__(self, version, applied):
+        applied = f"applied {', '.join(map(str, applied))}" if applied else "nothing to apply"
+        super().__init__(f"Schema at version {version} ({applied})")
+
+
+class SimilarityModelPublishSuccess(SuccessLog):
+    def __init__(self, version, directory):
+        super().__init__(f"Similarity model {version} successfully published in {directory}")
+        
+
 # ---------------------------------------------------------------------------- #
 #                       Failure messages in DBMS                               #
 # ---------------------------------------------------------------------------- #
@@ -133,6 +154,43 @@ class RatingError(CustomBaseException):
     def __init__(self):
         super().__init__("Wrong value for a rating")
         
+
+class BookingBatchRolledBackError(CustomBaseException):
+    """Raised for a valid booking that was not committed because another booking in its batch failed."""
+    def __init__(self, movie_id, user_id):
+        super().__init__(f"Booking of movie {movie_id} for user {user_id} rolled back with its batch")
+
+
+class DatabaseConnectionError(CustomBaseException):
+    """Raised when the database cannot be reached after every connection attempt."""
+    def __init__(self, attempts, reason):
+        super().__init__(f"Could not connect to the database after {attempts} attempts: {reason}")
+
+
+class TransactionOutcomeUnknownError(CustomBaseException):
+    """Raised when the connection was lost while committing a write that cannot be safely replayed."""
+    def __init__(self, operation):
+        super().__init__(f"Lost the connection while committing {operation}; it may or may not have been applied")
+
+
+class ConnectionPoolTimeoutError(CustomBaseException):
+    """Raised when no pooled connection becomes available within the checkout timeout."""
+    def __init__(self, timeout):
+        super().__init__(f"No database connection available after {timeout} seconds")
+        
+
+
+class SchemaMigrationError(CustomBaseException):
+    """Raised when a schema migration fails; the versions before it stay applied."""
+    def __init__(self, version, reason):
+        super().__init__(f"Schema migration {version} failed: {reason}")
+
+
+class InvalidRequestError(CustomBaseException):
+    """Raised when a service request has a missing or malformed field or parameter."""
+    def __init__(self, reason):
+        super().__init__(reason)
+        
        
 class InvalidActionError(CustomBaseException):
     """Raised when the action is invalid, i.e., menu other than 1-15 is selected."""
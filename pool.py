@@ -0,0 +1,167 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+from messages import ConnectionPoolTimeoutError
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 10.0
+
+
+class ConnectionPool:
+    """Bounded pool of connections created on demand by `factory`.
+
+    At least `min_size` connections are opened up front, or by `warm_up()` if `warm` is false, and
+    at most `max_size` exist at once.
+    `acquire` blocks for up to `timeout` seconds when every connection is checked out, and
+    idle connections are pinged before being handed out if `health_check` is set.
+    """
+    def __init__(self, factory, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT, health_check=True,
+                 warm=True):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("Pool sizes should satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check = health_check
+
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+
+        self._num_checkouts = 0
+        self._num_timeouts = 0
+        self._num_replaced = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        if warm:
+            self.warm_up()
+
+
+    def warm_up(self):
+        """Open connections until at least `min_size` exist."""
+        while True:
+            with self._condition:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self.factory()
+            except:
+                with self._condition:
+                    self._size -= 1
+                raise
+            with self._condition:
+                self._idle.append(connection)
+                self._condition.notify()
+
+
+    def acquire(self):
+        start = perf_counter()
+        deadline = start + self.timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # reserve the slot, connect outside the lock
+                    connection = None
+                    break
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    self._num_timeouts += 1
+                    raise ConnectionPoolTimeoutError(self.timeout)
+                self._condition.wait(remaining)
+
+        try:
+            if connection is None:
+                connection = self.factory()
+            elif self.health_check and not self._is_healthy(connection):
+                self._close_quietly(connection)
+                connection = self.factory()
+                with self._condition:
+                    self._num_replaced += 1
+        except:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        wait = perf_counter() - start
+        with self._condition:
+            self._num_checkouts += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        return connection
+
+
+    def release(self, connection, discard=False):
+        with self._condition:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+        if discard or self._closed:
+            self._close_quietly(connection)
+
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except:
+            self.release(connection, discard=not self._is_healthy(connection))
+            raise
+        else:
+            self.release(connection)
+
+
+    def stats(self):
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self._num_checkouts,
+                "timeouts": self._num_timeouts,
+                "replaced": self._num_replaced,
+                "total_wait": self._total_wait,
+                "avg_wait": self._total_wait / self._num_checkouts if self._num_checkouts else 0.0,
+                "max_wait": self._max_wait,
+            }
+
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            self._close_quietly(connection)
+
+
+    @staticmethod
+    def _is_healthy(connection):
+        try:
+            return connection.is_connected()
+        except Exception:
+            return False
+
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
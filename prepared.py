@@ -0,0 +1,125 @@
+import threading
+import weakref
+
+
+class StatementStats:
+    """Thread-safe counters shared by every statement cache of one agent."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"executions": 0, "hits": 0, "prepares": 0, "invalidations": 0}
+
+
+    def record(self, name, count=1):
+        with self._lock:
+            self._counts[name] += count
+
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class StatementCache:
+    """Prepared-statement cursors of one connection, keyed by query constant.
+
+    The connector prepares a statement on its cursor's first execution and reuses it while the
+    same query object is executed again, so one cursor per query keeps each statement prepared
+    for the lifetime of the connection.
+    """
+    def __init__(self, connection, stats):
+        self._connection = weakref.ref(connection)  # caches are looked up by connection, do not keep it alive
+        self.stats = stats
+        self._cursors = {}
+
+
+    def cursor_for(self, query):
+        cursor = self._cursors.get(query)
+        if cursor is None:
+            cursor = self._cursors[query] = self._connection().cursor(prepared=True)
+            self.stats.record("prepares")
+        else:
+            self.stats.record("hits")
+        return cursor
+
+
+    def close(self):
+        """Drop every statement, e.g. because the connection was re-established."""
+        for cursor in self._cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._cursors.clear()
+        self.stats.record("invalidations")
+
+
+class PreparedCursor:
+    """Cursor facade that sends the queries in `prepared_queries` through a `StatementCache`.
+
+    Result sets of prepared statements are read completely right away, so the text cursor it wraps
+    can be used for the next statement as usual. Everything else is delegated to that cursor.
+    """
+    def __init__(self, cursor, cache, prepared_queries):
+        self._cursor = cursor
+        self._cache = cache
+        self._prepared_queries = prepared_queries
+        self._rows = None
+        self._rowcount = None
+        self._lastrowid = None
+        self._with_rows = False
+
+
+    def execute(self, operation, params=()):
+        if operation not in self._prepared_queries:
+            self._rows = None
+            return self._cursor.execute(operation, params)
+
+        cursor = self._cache.cursor_for(operation)
+        cursor.execute(operation, params)
+        self._cache.stats.record("executions")
+        self._rows = cursor.fetchall() if cursor.with_rows else []
+        self._rowcount = len(self._rows) if cursor.with_rows else cursor.rowcount
+        self._lastrowid = cursor.lastrowid
+        self._with_rows = cursor.with_rows
+
+
+    def executemany(self, operation, seq_params):
+        # Batches always run on the text cursor, so its results replace those of a prepared statement
+        self._rows = None
+        return self._cursor.executemany(operation, seq_params)
+
+
+    def fetchone(self):
+        if self._rows is None:
+            return self._cursor.fetchone()
+        return self._rows.pop(0) if self._rows else None
+
+
+    def fetchall(self):
+        if self._rows is None:
+            return self._cursor.fetchall()
+        rows, self._rows = self._rows, []
+        return rows
+
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount if self._rows is None else self._rowcount
+
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid if self._rows is None else self._lastrowid
+
+
+    @property
+    def with_rows(self):
+        return self._cursor.with_rows if self._rows is None else self._with_rows
+
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
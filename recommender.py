@@ -0,0 +1,342 @@
+import threading
+from time import monotonic
+
+from utils import lazy_import
+
+np = lazy_import("numpy")  # imported by the first recommendation, not at startup
+
+ROW_BLOCK_SIZE = 1024
+PAIR_BLOCK_SIZE = 1 << 20  # pairs of cells a group of users rated, expanded at a time by `ItemSimilarityEngine.rebuild`
+SIMILARITY_BLOCK_CELLS = 1 << 18  # cells of the similarity computed at a time by `ItemSimilarityEngine`
+
+
+class RatingMatrix:
+    """Sparse user x movie rating matrix in CSR form.
+
+    `user_ids` and `movie_ids` must be sorted (the queries order them by id), so ids are mapped
+    to row/column positions with `np.searchsorted` instead of list lookups. Unrated cells are
+    never stored; use `filled_row` or `dense_rows` to expand a bounded slice when needed.
+    """
+    def __init__(self, user_ids, movie_ids, triples):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+
+        triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        rows = np.searchsorted(self.user_ids, triples[:, 0])
+        cols = np.searchsorted(self.movie_ids, triples[:, 1])
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.data = triples[order, 2].astype(float)
+        self.indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.user_ids)), out=self.indptr[1:])
+
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.movie_ids)
+
+
+    def user_position(self, user_id):
+        return int(np.searchsorted(self.user_ids, int(user_id)))
+
+
+    def rated_columns(self, user_idx):
+        return self.indices[self.indptr[user_idx]:self.indptr[user_idx + 1]]
+
+
+    def column_means(self):
+        """Mean rating of every movie rounded to 2 decimals, 0 for movies without ratings."""
+        sums = np.bincount(self.indices, weights=self.data, minlength=self.shape[1])
+        counts = self.column_counts()
+        return np.around(np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0), 2)
+
+
+    def column_counts(self):
+        return np.bincount(self.indices, minlength=self.shape[1])
+
+
+    def filled_row(self, user_idx, means):
+        """Ratings of one user with unrated movies filled by the movie means."""
+        row = means.copy()
+        start, end = self.indptr[user_idx], self.indptr[user_idx + 1]
+        row[self.indices[start:end]] = self.data[start:end]
+        return row
+
+
+    def dense_rows(self, start, stop, values=None):
+        """Dense block of rows `start:stop`, with `values` (aligned with `data`) in rated cells."""
+        values = self.data if values is None else values
+        lo, hi = self.indptr[start], self.indptr[stop]
+        block = np.zeros((stop - start, self.shape[1]))
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        block[rows, self.indices[lo:hi]] = values[lo:hi]
+        return block
+
+
+def centering(ratings, means):
+    """Offsets `means - mu` of the columns of the mean-filled rating matrix centered on its global
+    mean `mu`, and the deviations `rating - mean` of the rated cells, aligned with `ratings.data`."""
+    num_users, num_movies = ratings.shape
+    counts = ratings.column_counts()
+    mu = np.around((ratings.data.sum() + np.dot(num_users - counts, means)) / (num_users * num_movies), 4)
+    return means - mu, ratings.data - means[ratings.indices]
+
+
+def item_similarity(ratings, means, block_size=ROW_BLOCK_SIZE):
+    """Item-item cosine similarity of the mean-filled, globally centered rating matrix.
+
+    Every column of the centered matrix is the constant `means - mu` plus a sparse correction
+    `rating - mean` in its rated cells, so the Gram matrix is assembled from rank-one terms and
+    the Gram matrix of the corrections, which is accumulated over bounded blocks of users.
+    """
+    num_users, num_movies = ratings.shape
+    offsets, deltas = centering(ratings, means)
+    delta_sums = np.bincount(ratings.indices, weights=deltas, minlength=num_movies)
+    cross = np.outer(offsets, delta_sums)
+    dot_product = num_users * np.outer(offsets, offsets) + cross + cross.T
+    for start in range(0, num_users, block_size):
+        block = ratings.dense_rows(start, min(start + block_size, num_users), deltas)
+        dot_product += np.dot(block.T, block)
+
+    norms = np.sqrt(np.diag(dot_product))
+    with np.errstate(invalid="ignore"):  # movies without any spread get nan
+        return np.around(dot_product / np.outer(norms, norms), 4)
+
+
+class ItemSimilarityEngine:
+    """In-memory sufficient statistics for `item_similarity`, maintained incrementally.
+
+    For every pair of movies the engine keeps the number of users who rated both (`C`), the sum
+    of products of their ratings (`P`) and the sum of the first movie's ratings over those users
+    (`S`); the diagonals hold per-movie counts, squared sums and sums. Together with the number of
+    users these determine the centered Gram matrix exactly, so rating changes only touch the
+    rows of the movies rated by the affected user and no rating is re-read from the database.
+
+    The statistics are whole numbers held as int32, exact below 85 million users, and are summed
+    from the sparse ratings without a dense user x movie block. With the float64 similarity matrix
+    that makes 20 bytes per pair of movies, plus blocks of SIMILARITY_BLOCK_CELLS cells while the
+    similarity is recomputed: about 2 GB for 10,000 movies, which is as far as the engine is meant
+    to go. Larger catalogs should serve a published model (see `similarity_model.py`).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.ready = False
+
+
+    def rebuild(self, user_ids, movie_ids, triples, max_pairs=PAIR_BLOCK_SIZE):
+        with self.lock:
+            ratings = RatingMatrix(user_ids, movie_ids, triples)
+            num_users, num_movies = ratings.shape
+            self.movie_ids = [int(movie_id) for movie_id in movie_ids]
+            self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+            self.user_ratings = {int(user_id): {} for user_id in user_ids}
+            self.movie_raters = {movie_id: set() for movie_id in self.movie_ids}
+            for user_id, movie_id, rating in triples:
+                self.user_ratings[user_id][movie_id] = rating
+                self.movie_raters[movie_id].add(user_id)
+
+            self.P, self.S, self.C = (np.zeros((num_movies, num_movies), dtype=np.int32) for _ in range(3))
+            pair_ends = np.cumsum(np.diff(ratings.indptr) ** 2)
+            start = 0
+            while start < num_users:  # groups of users with at most `max_pairs` pairs, or a single user
+                done = pair_ends[start - 1] if start else 0
+                stop = max(start + 1, int(np.searchsorted(pair_ends, done + max_pairs, side="right")))
+                self._add_rated_pairs(ratings, start, stop)
+                start = stop
+            self._similarity = None
+            self.ready = True
+
+
+    def _add_rated_pairs(self, ratings, start, stop):
+        """Add every pair of cells each of the users `start:stop` rated to the statistics."""
+        counts = np.diff(ratings.indptr[start:stop + 1])
+        lengths = np.repeat(counts, counts)  # each rated cell pairs with every cell of its user
+        firsts = np.repeat(np.arange(ratings.indptr[start], ratings.indptr[stop]), lengths)
+        offsets = np.arange(len(firsts)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        seconds = np.repeat(np.repeat(ratings.indptr[start:stop], counts), lengths) + offsets
+        cells = ratings.indices[firsts], ratings.indices[seconds]
+        first_values = ratings.data[firsts].astype(np.int32)
+        np.add.at(self.P, cells, first_values * ratings.data[seconds].astype(np.int32))
+        np.add.at(self.S, cells, first_values)
+        np.add.at(self.C, cells, 1)
+
+
+    def invalidate(self):
+        with self.lock:
+            self.ready = False
+
+
+    def statistics(self):
+        with self.lock:
+            return len(self.user_ratings), self.movie_ids, self.P, self.S, self.C
+
+
+    def add_movie(self, movie_id):
+        with self.lock:
+            if movie_id in self.movie_index:
+                return
+            self.movie_index[movie_id] = len(self.movie_ids)
+            self.movie_ids.append(movie_id)
+            self.movie_raters[movie_id] = set()
+            self.P, self.S, self.C = (np.pad(stat, ((0, 1), (0, 1))) for stat in (self.P, self.S, self.C))
+            self._similarity = None
+
+
+    def remove_movie(self, movie_id):
+        with self.lock:
+            movie_idx = self.movie_index[movie_id]
+            for user_id in self.movie_raters.pop(movie_id):
+                del self.user_ratings[user_id][movie_id]
+            del self.movie_ids[movie_idx]
+            self.movie_index = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+            self.P, self.S, self.C = (np.delete(np.delete(stat, movie_idx, axis=0), movie_idx, axis=1)
+                                      for stat in (self.P, self.S, self.C))
+            self._similarity = None
+
+
+    def add_user(self, user_id):
+        with self.lock:
+            self.user_ratings.setdefault(user_id, {})
+            self._similarity = None
+
+
+    def remove_user(self, user_id):
+        with self.lock:
+            self._apply_user(user_id, -1)
+            for movie_id in self.user_ratings.pop(user_id):
+                self.movie_raters[movie_id].discard(user_id)
+            self._similarity = None
+
+
+    def add_rating(self, user_id, movie_id, rating):
+        with self.lock:
+            self._apply_user(user_id, -1)
+            self.user_ratings[user_id][movie_id] = rating
+            self.movie_raters[movie_id].add(user_id)
+            self._apply_user(user_id, +1)
+            self._similarity = None
+
+
+    def _apply_user(self, user_id, sign):
+        ratings = self.user_ratings[user_id]
+        if not ratings:
+            return
+        indices = np.array([self.movie_index[movie_id] for movie_id in ratings])
+        values = np.array(list(ratings.values()), dtype=np.int32)
+        block = np.ix_(indices, indices)
+        self.P[block] += sign * np.outer(values, values)
+        self.S[block] += sign * values[:, None]
+        self.C[block] += sign
+
+
+    def means(self):
+        counts, sums = np.diag(self.C), np.diag(self.S)
+        return np.around(np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0), 2)
+
+
+    def similarity(self):
+        """Same matrix as `item_similarity` on the current ratings, recomputed only after changes."""
+        with self.lock:
+            if self._similarity is None:
+                self._similarity = self._compute_similarity()
+            return self._similarity
+
+
+    def _compute_similarity(self, block_size=None):
+        num_users, num_movies = len(self.user_ratings), len(self.movie_ids)
+        block_size = block_size or max(1, SIMILARITY_BLOCK_CELLS // max(num_movies, 1))
+        counts, sums = np.diag(self.C), np.diag(self.S)
+        means = self.means()
+        mu = np.around((sums.sum() + np.dot(num_users - counts, means)) / (num_users * num_movies), 4)
+        offsets = means - mu
+
+        # On the diagonal every user rated either both movies or neither
+        norms = np.sqrt(np.diag(self.P) - mu * (sums + sums) + mu * mu * counts
+                        + (num_users - counts - counts + counts) * (offsets * offsets))
+        similarity = np.empty((num_movies, num_movies))
+        for start in range(0, num_movies, block_size):
+            rows = slice(start, min(start + block_size, num_movies))
+            dot_product = self._dot_products(rows, num_users, mu, offsets, counts, sums)
+            with np.errstate(invalid="ignore"):  # movies without any spread get nan, as in item_similarity
+                similarity[rows] = np.around(dot_product / np.outer(norms[rows], norms), 4)
+        return similarity
+
+
+    def _dot_products(self, rows, num_users, mu, offsets, counts, sums):
+        """Rows `rows` of the centered Gram matrix."""
+        P, S, C = self.P[rows], self.S[rows], self.C[rows]
+        S_transposed, C_transposed = self.S[:, rows].T, self.C[:, rows].T
+
+        # Split the users of every pair (i, j) by which of the two movies they rated
+        both = P - mu * (S + S_transposed) + mu * mu * C
+        only_first = offsets[None, :] * ((sums[rows, None] - S) - mu * (counts[rows, None] - C))
+        only_second = offsets[rows, None] * ((sums[None, :] - S_transposed) - mu * (counts[None, :] - C_transposed))
+        neither = (num_users - counts[rows, None] - counts[None, :] + C) * np.outer(offsets[rows], offsets)
+        return both + only_first + only_second + neither
+
+
+    def filled_row(self, user_id, means):
+        row = means.copy()
+        for movie_id, rating in self.user_ratings[user_id].items():
+            row[self.movie_index[movie_id]] = rating
+        return row
+
+
+    def rated_columns(self, user_id):
+        return np.array([self.movie_index[movie_id] for movie_id in self.user_ratings[user_id]], dtype=np.int64)
+
+
+class PopularityLeaderboard:
+    """Global top-`size` movies by average rating and by number of reservations.
+
+    The agent invalidates it on every write that can change a ranking. `store` ignores rankings
+    read before the latest invalidation, so a concurrent write is never hidden by a stale load.
+    Stored rankings expire after `ttl` seconds (never if None), which bounds how long the writes
+    of other processes go unnoticed.
+    """
+    RANKINGS = ("rating", "popularity")
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.rankings = None
+        self.expires_at = float("inf")
+
+
+    def snapshot(self):
+        with self.lock:
+            if self.rankings is not None and monotonic() >= self.expires_at:
+                self.rankings = None
+            return self.generation, self.rankings
+
+
+    def store(self, generation, rows):
+        """Group `(ranking, *record)` rows by ranking, caching them if nothing changed since `generation`."""
+        rankings = {ranking: [] for ranking in self.RANKINGS}
+        for ranking, *record in rows:
+            rankings[ranking].append(tuple(record))
+        with self.lock:
+            if generation == self.generation:
+                self.rankings = rankings
+                self.expires_at = monotonic() + self.ttl if self.ttl is not None else float("inf")
+        return rankings
+
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.rankings = None
+
+
+    def first_unseen(self, records, booked):
+        """First record whose movie is not in `booked`.
+
+        Returns `(record, True)` when the answer is known (`record` may be None if every movie was
+        booked), or `(None, False)` when the user booked every cached movie of a truncated ranking.
+        """
+        for record in records:
+            if record[0] not in booked:
+                return record, True
+        return None, len(records) < self.size
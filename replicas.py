@@ -0,0 +1,168 @@
+import itertools
+import threading
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+
+from mysql.connector import Error
+
+from messages import ConnectionPoolTimeoutError, DatabaseConnectionError
+from pool import ConnectionPool
+from retry import transient_reason
+from sql_queries import select_replica_lag
+
+REPLICA_MAX_LAG = 5.0  # seconds a replica may trail the primary and still serve reads
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+REPLICA_RETRY_INTERVAL = 5.0  # seconds a failed replica is skipped
+REPLICA_CHECKOUT_TIMEOUT = 0.05  # seconds to wait for a busy replica before trying the next one
+LATENCY_SMOOTHING = 0.2
+SELECTIONS = ("round_robin", "least_latency")
+
+
+class Replica:
+    """A read replica's connection pool, last measured lag and smoothed read latency."""
+    def __init__(self, backend, pool):
+        self.backend = backend
+        self.pool = pool
+        self.lag = None
+        self.checked_at = None
+        self.down_until = 0.0
+        self.latency = None
+        self.reads = 0
+        self.failures = 0
+        self.lagging = 0
+
+
+    def available(self, now, max_lag):
+        lag_known = self.checked_at is not None and now - self.checked_at < REPLICA_LAG_CHECK_INTERVAL
+        return now >= self.down_until and not (lag_known and self.lag > max_lag)
+
+
+    def snapshot(self):
+        return {
+            "reads": self.reads,
+            "failures": self.failures,
+            "lagging": self.lagging,
+            "lag": self.lag,
+            "latency_ms": self.latency * 1000 if self.latency is not None else None,
+            "down": monotonic() < self.down_until,
+            "pool": self.pool.stats(),
+        }
+
+
+class ReplicaSet:
+    """Read replicas of the primary database, one of which serves each read-only operation.
+
+    `connection()` picks an available replica by round robin or by the lowest smoothed latency
+    (`selection`) and yields one of its pooled connections, or None to read from the primary
+    instead. A replica is skipped for REPLICA_RETRY_INTERVAL seconds after it failed, and while
+    its last lag, checked every REPLICA_LAG_CHECK_INTERVAL seconds, exceeds `max_lag` seconds.
+    `factory(backend)` opens a connection to a replica's backend.
+    """
+    def __init__(self, backends, factory, pool_size=1, selection="round_robin", max_lag=REPLICA_MAX_LAG):
+        if selection not in SELECTIONS:
+            raise ValueError(f"Replica selection should be one of {', '.join(SELECTIONS)}")
+        self.selection = selection
+        self.max_lag = max_lag
+        self.replicas = []
+        for backend in backends:
+            size = min(pool_size, backend.max_connections or pool_size)
+            pool = ConnectionPool(lambda backend=backend: factory(backend), 0, size, REPLICA_CHECKOUT_TIMEOUT)
+            self.replicas.append(Replica(backend, pool))
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self._num_fallbacks = 0
+
+
+    def _candidates(self):
+        now = monotonic()
+        with self._lock:
+            available = [replica for replica in self.replicas if replica.available(now, self.max_lag)]
+            if self.selection == "least_latency":  # unmeasured replicas first, so every one gets measured
+                return sorted(available, key=lambda replica: -1.0 if replica.latency is None else replica.latency)
+            start = next(self._next) % len(available) if available else 0
+            return available[start:] + available[:start]
+
+
+    @contextmanager
+    def connection(self):
+        for replica in self._candidates():
+            connection = self._acquire(replica)
+            if connection is None:
+                continue
+            start = perf_counter()
+            try:
+                yield connection
+            except Error as e:
+                if transient_reason(e) is not None:
+                    self._mark_down(replica)
+                raise
+            finally:
+                replica.pool.release(connection)  # a broken connection is replaced by the next checkout
+            latency = perf_counter() - start
+            with self._lock:
+                replica.reads += 1
+                replica.latency = latency if replica.latency is None else \
+                    LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * replica.latency
+            return
+        with self._lock:
+            self._num_fallbacks += 1
+        yield None
+
+
+    def _acquire(self, replica):
+        """A connection of `replica` if it is reachable and caught up, None otherwise."""
+        try:
+            connection = replica.pool.acquire()
+        except ConnectionPoolTimeoutError:  # busy, another replica or the primary serves this read
+            return None
+        except DatabaseConnectionError:
+            self._mark_down(replica)
+            return None
+        if replica.checked_at is not None and monotonic() - replica.checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return connection
+        try:
+            lag = self._lag(connection)
+        except Error:
+            replica.pool.release(connection)
+            self._mark_down(replica)
+            return None
+        with self._lock:
+            replica.lag, replica.checked_at = lag, monotonic()
+            if lag > self.max_lag:
+                replica.lagging += 1
+        if lag > self.max_lag:
+            replica.pool.release(connection)
+            return None
+        return connection
+
+
+    @staticmethod
+    def _lag(connection):
+        """Seconds the replica trails its source; 0 if it is not replicating, infinite if replication stopped."""
+        cursor = connection.cursor(buffered=True)
+        try:
+            cursor.execute(select_replica_lag)
+            columns = [column[0] for column in cursor.description]
+            record = cursor.fetchone()
+        finally:
+            cursor.close()
+        if record is None:
+            return 0.0
+        lag = record[columns.index("Seconds_Behind_Source")]
+        return float("inf") if lag is None else float(lag)
+
+
+    def _mark_down(self, replica):
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = monotonic() + REPLICA_RETRY_INTERVAL
+
+
+    def stats(self):
+        with self._lock:
+            return {"fallbacks": self._num_fallbacks, "replicas": [replica.snapshot() for replica in self.replicas]}
+
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
@@ -0,0 +1,121 @@
+import random
+import threading
+from functools import wraps
+
+from mysql.connector import Error, errorcode
+
+from messages import *
+
+RETRY_ATTEMPTS = 3  # replays after the first failure
+RETRY_BACKOFF = 0.05  # seconds before the first replay, doubling after each failure
+RETRY_BACKOFF_MAX = 1.0
+
+# How an operation may be replayed after a transient failure:
+READ = "read"  # reads only, replayed freely
+IDEMPOTENT = "idempotent"  # writes that converge to the same state however often they run
+WRITE = "write"  # replayed only if its transaction is known to have rolled back, see ALREADY_APPLIED
+ONCE = "once"  # never replayed as a whole
+LOCAL = "local"  # no database access, neither replayed nor timed
+
+READ_PREFIXES = ("print_", "fetch_", "recommend_", "check_")
+OPERATION_KINDS = {
+    "schema_version": READ,
+    "train_similarity_model": READ,  # writes nothing but its model files
+    "cache_stats": LOCAL,
+    "similarity_model_stats": LOCAL,
+    "initialize_database": ONCE,  # creates the tables and loads each row in its own replayed step
+    "reset": IDEMPOTENT,
+    "migrate": IDEMPOTENT,
+    "rebuild_movie_stats": IDEMPOTENT,
+    "verify_movie_stats": IDEMPOTENT,
+    "rebuild_similarity_state": IDEMPOTENT,
+    "export_movies": ONCE,  # rows may have been written to the sink already
+    "export_users": ONCE,
+    "rate_movies": ONCE,  # commits chunk by chunk, and each chunk is retried on its own
+    "bulk_load": ONCE,  # a replay as a whole would reject the rows of the chunks committed already
+    "import_ratings": ONCE,
+}
+READ_ONLY_ONCE = {"export_movies", "export_users"}  # never replayed, but may still read from a replica
+
+# The error a replayed write raises when its first attempt was committed after all, and the
+# result that attempt would have returned
+ALREADY_APPLIED = {
+    "insert_movie": (MovieTitleAlreadyExistsError, MovieInsertSuccess),
+    "remove_movie": (MovieNotExistError, MovieRemoveSuccess),
+    "insert_user": (UserAlreadyExistsError, UserInsertSuccess),
+    "remove_user": (UserNotExistError, UserRemoveSuccess),
+    "book_movie": (MovieAlreadyBookedError, MovieBookSuccess),
+    "rate_movie": (UserAlreadyRatedError, MovieRateSuccess),
+}
+
+TRANSIENT_ERRORS = {
+    errorcode.CR_SERVER_GONE_ERROR: "connection_lost",
+    errorcode.CR_SERVER_LOST: "connection_lost",
+    errorcode.CR_SERVER_LOST_EXTENDED: "connection_lost",
+    errorcode.ER_LOCK_DEADLOCK: "deadlock",
+    errorcode.ER_LOCK_WAIT_TIMEOUT: "lock_wait_timeout",
+}
+
+
+def operation_kind(name):
+    if name.startswith(READ_PREFIXES):
+        return READ
+    return OPERATION_KINDS.get(name, WRITE)
+
+
+def is_read_only(name, kind):
+    return kind == READ or name in READ_ONLY_ONCE
+
+
+def transient_reason(error):
+    """Why `error` may go away on its own ("connection_lost", "deadlock", ...), or None."""
+    return TRANSIENT_ERRORS.get(error.errno) if isinstance(error, Error) else None
+
+
+def backoff(attempt):
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))  # full jitter
+
+
+def retried(method):
+    """Replay the agent method `method` after transient database failures, as its kind allows."""
+    @wraps(method)
+    def wrapper(agent, *args, **kwargs):
+        return agent._retrying(method.__name__, lambda: method(agent, *args, **kwargs))
+
+    return wrapper
+
+
+class RetryStats:
+    """Counts of replayed operations, by operation and by the reason of the failure.
+
+    `retries` counts replays, `recovered` the operations that succeeded after one, `exhausted`
+    those that still failed after the last attempt, and `ambiguous_commits` the commits whose
+    outcome was lost with the connection.
+    """
+    EVENTS = ("retries", "recovered", "exhausted", "ambiguous_commits")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+
+    def record(self, name, event, reason=None):
+        with self._lock:
+            stats = self._operations.get(name)
+            if stats is None:
+                stats = self._operations[name] = {**dict.fromkeys(self.EVENTS, 0), "reasons": {}}
+            stats[event] += 1
+            if reason is not None:
+                stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+
+
+    def snapshot(self):
+        with self._lock:
+            operations = {name: {**stats, "reasons": dict(stats["reasons"])} for name, stats in sorted(self._operations.items())}
+        totals = {event: sum(stats[event] for stats in operations.values()) for event in self.EVENTS}
+        return {**totals, "operations": operations}
+
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
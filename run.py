@@ -1,14 +1,32 @@
 from agent import MovieBookingAgent
+from backends import MySQLBackend, SQLiteBackend
+from instrumentation import SLOW_QUERY_MS
+from replicas import SELECTIONS
+from similarity_builder import SIMILARITY_MAX_MEMORY
 from messages import *
+import argparse
 import traceback
 
 
 SUBMISSION = False
 
 
+def print_pages(fetch_page):
+    after_id = 0
+    while True:
+        page, after_id = fetch_page(after_id=after_id)
+        print(page)
+        if after_id is None or input("Next page? (y/n): ") != 'y':
+            return
+
+
+def print_progress(num_done, num_total):
+    print(f"\rBlock pairs computed: {num_done}/{num_total}", end="\n" if num_done == num_total else "", flush=True)
+
+
 # Total of 70 pt.
-def main():
-    agent = MovieBookingAgent()
+def main(backend=None, **agent_options):
+    agent = MovieBookingAgent(backend=backend, **agent_options)
     
     if SUBMISSION:
         confirmation = input("Are you sure to reset the database? (y/n): ")
@@ -41,10 +59,10 @@ def main():
                 result = agent.initialize_database()
                 
             elif menu == 2:
-                result = agent.print_movies()
+                result = print_pages(agent.print_movies_page)
                 
             elif menu == 3:
-                result = agent.print_users()
+                result = print_pages(agent.print_users_page)
                 
             elif menu == 4:
                 title = input("Movie title: ")
@@ -79,11 +97,11 @@ def main():
                 
             elif menu == 10:
                 movie_id = input("Movie ID: ")
-                result = agent.print_users_for_movie(movie_id)
+                result = print_pages(lambda after_id: agent.print_users_for_movie_page(movie_id, after_id))
                 
             elif menu == 11:
                 user_id = input("User ID: ")
-                result = agent.print_movies_for_user(user_id)
+                result = print_pages(lambda after_id: agent.print_movies_for_user_page(user_id, after_id))
                 
             elif menu == 12:
                 user_id = input("User ID: ")
@@ -112,5 +130,56 @@ def main():
     
     agent.terminate()
 
+
+def replica_backend(address, sqlite=False):
+    if sqlite:
+        return SQLiteBackend(address, read_only=True)
+    host, _, port = address.partition(":")
+    return MySQLBackend(host, int(port)) if port else MySQLBackend(host)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true", help="serve the menu actions as JSON endpoints over HTTP")
+    parser.add_argument("--host", help="address to serve on (default: server.SERVER_HOST)")
+    parser.add_argument("--port", type=int, help="port to serve on (default: server.SERVER_PORT)")
+    parser.add_argument("--workers", type=int, help="worker threads and pooled connections (default: server.SERVER_WORKERS)")
+    parser.add_argument("--sqlite", metavar="PATH", help="use an embedded SQLite database (':memory:' or a file) instead of MySQL")
+    parser.add_argument("--replica", action="append", default=[], metavar="HOST[:PORT]",
+                        help="read replica serving read-only actions, repeatable (a SQLite file with --sqlite)")
+    parser.add_argument("--replica-selection", choices=SELECTIONS, default="round_robin")
+    parser.add_argument("--similarity-model", metavar="DIR",
+                        help="score item-based recommendations with the model published in DIR while it matches the database")
+    parser.add_argument("--train-similarity-model", metavar="DIR", help="train the item similarity model, publish it in DIR and exit")
+    parser.add_argument("--train-workers", type=int, help="processes building the similarity matrix (default: one per core)")
+    parser.add_argument("--train-max-memory-mb", type=int, default=SIMILARITY_MAX_MEMORY // 2 ** 20,
+                        help="memory the similarity builder's blocks may take in all")
+    parser.add_argument("--slow-query-log", metavar="PATH", help="append statements slower than --slow-query-ms to PATH as JSON lines")
+    parser.add_argument("--slow-query-ms", type=float, default=SLOW_QUERY_MS)
+    parser.add_argument("--explain-slow-queries", action="store_true", help="add the EXPLAIN plan of slow SELECTs to the log")
+    args = parser.parse_args()
+    backend = SQLiteBackend(args.sqlite) if args.sqlite else None
+    agent_options = {}
+    if args.slow_query_log:
+        agent_options = dict(slow_query_threshold=args.slow_query_ms / 1000, slow_query_log=args.slow_query_log,
+                             explain_slow_queries=args.explain_slow_queries)
+    if args.replica:
+        agent_options["replicas"] = [replica_backend(replica, args.sqlite) for replica in args.replica]
+        agent_options["replica_selection"] = args.replica_selection
+    if args.similarity_model:
+        agent_options["similarity_model"] = args.similarity_model
+    
+    if args.train_similarity_model:
+        agent = MovieBookingAgent(backend=backend, **agent_options)
+        try:
+            print(agent.train_similarity_model(args.train_similarity_model, workers=args.train_workers,
+                                               max_memory=args.train_max_memory_mb * 2 ** 20, progress=print_progress))
+        finally:
+            agent.terminate()
+    elif args.serve:
+        from server import serve  # http.server is only needed by the service
+        server_options = {name: value for name, value in [("host", args.host), ("port", args.port), ("workers", args.workers)]
+                          if value is not None}
+        serve(backend=backend, **server_options, **agent_options)
+    else:
+        main(backend, **agent_options)
\ No newline at end of file
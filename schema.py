@@ -45,4 +45,45 @@ TABLES["rating"] = """\
         FOREIGN KEY (movie_id, user_id) REFERENCES reservation(movie_id, user_id) ON DELETE CASCADE,
         CHECK (rating >= 1 AND rating <= 5)
         );
-    """
\ No newline at end of file
+    """
+
+# Pre-aggregated per-movie counters, kept current by the agent in the same transaction as the writes
+TABLES["movie_stats"] = """\
+    CREATE TABLE IF NOT EXISTS movie_stats(
+        movie_id INT NOT NULL,
+        num_reservations INT NOT NULL DEFAULT 0,
+        reservation_price_sum BIGINT NOT NULL DEFAULT 0,
+        num_ratings INT NOT NULL DEFAULT 0,
+        rating_sum BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (movie_id),
+        FOREIGN KEY (movie_id) REFERENCES movie(movie_id) ON DELETE CASCADE
+        );
+    """
+
+# Version of the tables above; MIGRATIONS evolve them and are recorded in MIGRATIONS_TABLE
+BASELINE_VERSION = 1
+MIGRATIONS_TABLE = """\
+    CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INT NOT NULL,
+        description VARCHAR(255),
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+        );
+    """
+
+# Ordered (version, description, statements). Indexes are built in place while reads and writes go
+# on, and an index that already exists is skipped, so an interrupted migration can run again.
+MIGRATIONS = [
+    (2, "Covering indexes on reservation and rating for lookups by user", [
+        """\
+    ALTER TABLE reservation
+    ADD INDEX reservation_user_covering (user_id, movie_id, reservation_price),
+    ALGORITHM=INPLACE, LOCK=NONE;
+    """,
+        """\
+    ALTER TABLE rating
+    ADD INDEX rating_user_covering (user_id, movie_id, rating),
+    ALGORITHM=INPLACE, LOCK=NONE;
+    """,
+    ]),
+]
@@ -0,0 +1,244 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+
+from agent import PAGE_SIZE, MovieBookingAgent
+from messages import *
+from utils import json_default
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_WORKERS = 16
+KEEP_ALIVE_TIMEOUT = 5.0  # idle keep-alive connections give their worker back after this many seconds
+MAX_PAGE_SIZE = 1000
+MAX_BODY_SIZE = 1 << 20
+
+ERROR_STATUSES = {
+    MovieNotExistError: HTTPStatus.NOT_FOUND,
+    UserNotExistError: HTTPStatus.NOT_FOUND,
+    RatingNotExistError: HTTPStatus.NOT_FOUND,
+    MovieTitleAlreadyExistsError: HTTPStatus.CONFLICT,
+    UserAlreadyExistsError: HTTPStatus.CONFLICT,
+    MovieAlreadyBookedError: HTTPStatus.CONFLICT,
+    MovieFullyBookedError: HTTPStatus.CONFLICT,
+    UserNotBookedError: HTTPStatus.CONFLICT,
+    UserAlreadyRatedError: HTTPStatus.CONFLICT,
+    ConnectionPoolTimeoutError: HTTPStatus.SERVICE_UNAVAILABLE,
+    DatabaseConnectionError: HTTPStatus.SERVICE_UNAVAILABLE,
+    TransactionOutcomeUnknownError: HTTPStatus.SERVICE_UNAVAILABLE,
+}
+
+
+def _rows(headers, records):
+    return {"columns": headers, "rows": [list(record) for record in records]}
+
+
+def _page(headers, records, next_after_id):
+    return {**_rows(headers, records), "next_after_id": next_after_id}
+
+
+def _message(result):
+    return {"message": str(result)}
+
+
+def _field(body, name):
+    if name not in body:
+        raise InvalidRequestError(f"Missing field '{name}'")
+    return body[name]
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params.get(name, [default])[0])
+    except ValueError:
+        raise InvalidRequestError(f"Query parameter '{name}' should be an integer")
+
+
+def _page_params(params):
+    limit = _int_param(params, "limit", PAGE_SIZE)
+    if limit < 1:
+        raise InvalidRequestError("Query parameter 'limit' should be at least 1")
+    return _int_param(params, "after_id", 0), min(limit, MAX_PAGE_SIZE)
+
+
+def _item_based(agent, params, body, user_id):
+    headers, results = agent.fetch_item_based_recommendations([user_id], _int_param(params, "k", 1))
+    result = results[int(user_id)]
+    if isinstance(result, CustomBaseException):
+        raise result
+    return HTTPStatus.OK, _rows(headers, result)
+
+
+def _popularity(agent, params, body, user_id):
+    headers, recommendations = agent.fetch_popularity_recommendations(user_id)
+    return HTTPStatus.OK, {"columns": headers,
+                           "rating_based": [list(record) for record in recommendations["Rating-based"]],
+                           "popularity_based": [list(record) for record in recommendations["Popularity-based"]]}
+
+
+def _reset(agent, params, body):
+    result = agent.reset(_field(body, "confirmation"))
+    return HTTPStatus.OK, _message(result) if result else {"message": "Reset cancelled"}
+
+
+# (method, path, handler(agent, query params, JSON body, *path ids)); menu action 14 (exit) is stopping the server
+ROUTES = [
+    ("POST", r"/database/initialize", lambda agent, params, body: (HTTPStatus.OK, _message(agent.initialize_database()))),
+    ("GET", r"/movies", lambda agent, params, body: (HTTPStatus.OK, _page(*agent.fetch_movies_page(*_page_params(params))))),
+    ("GET", r"/users", lambda agent, params, body: (HTTPStatus.OK, _page(*agent.fetch_users_page(*_page_params(params))))),
+    ("POST", r"/movies", lambda agent, params, body: (HTTPStatus.CREATED, _message(agent.insert_movie(
+        _field(body, "title"), _field(body, "director"), _field(body, "price"))))),
+    ("DELETE", r"/movies/(\d+)", lambda agent, params, body, movie_id: (HTTPStatus.OK, _message(agent.remove_movie(movie_id)))),
+    ("POST", r"/users", lambda agent, params, body: (HTTPStatus.CREATED, _message(agent.insert_user(
+        _field(body, "name"), _field(body, "age"), _field(body, "class"))))),
+    ("DELETE", r"/users/(\d+)", lambda agent, params, body, user_id: (HTTPStatus.OK, _message(agent.remove_user(user_id)))),
+    ("POST", r"/reservations", lambda agent, params, body: (HTTPStatus.CREATED, _message(agent.book_movie(
+        _field(body, "movie_id"), _field(body, "user_id"))))),
+    ("POST", r"/ratings", lambda agent, params, body: (HTTPStatus.CREATED, _message(agent.rate_movie(
+        _field(body, "movie_id"), _field(body, "user_id"), _field(body, "rating"))))),
+    ("GET", r"/movies/(\d+)/users", lambda agent, params, body, movie_id: (HTTPStatus.OK, _page(
+        *agent.fetch_users_for_movie_page(movie_id, *_page_params(params))))),
+    ("GET", r"/users/(\d+)/movies", lambda agent, params, body, user_id: (HTTPStatus.OK, _page(
+        *agent.fetch_movies_for_user_page(user_id, *_page_params(params))))),
+    ("GET", r"/users/(\d+)/recommendations/popularity", _popularity),
+    ("GET", r"/users/(\d+)/recommendations/item-based", _item_based),
+    ("POST", r"/database/reset", _reset),
+    ("GET", r"/stats", lambda agent, params, body: (HTTPStatus.OK, {
+        "pool": agent.pool_stats(), "statements": agent.statement_cache_stats(), "queries": agent.query_stats(),
+        "retries": agent.retry_stats(), "replicas": agent.replica_stats(), "cache": agent.cache_stats(),
+        "similarity_model": agent.similarity_model_stats()})),
+]
+ROUTES = [(method, re.compile(path + "$"), handler) for method, path, handler in ROUTES]
+
+
+class MovieBookingRequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints for the `run.py` menu actions, over persistent HTTP/1.1 connections.
+
+    Each response carries a `Server-Timing` header with the time spent handling the request, which
+    is also appended to the access log line.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+    def _dispatch(self, method):
+        start = perf_counter()
+        try:
+            status, payload = self._route(method)
+        except CustomBaseException as e:
+            status = ERROR_STATUSES.get(type(e), HTTPStatus.BAD_REQUEST)
+            payload = {"error": type(e).__name__, "message": str(e)}
+        except Exception as e:
+            self.log_error("%s %s failed: %r", method, self.path, e)
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "InternalError", "message": "Internal server error"}
+        duration = self._duration = perf_counter() - start
+
+        body = json.dumps(payload, default=json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Server-Timing", f"app;dur={duration * 1000:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        body = self._read_body()
+        path_matched = False
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match is None:
+                continue
+            path_matched = True
+            if route_method == method:
+                return handler(self.server.agent, parse_qs(url.query), body, *match.groups())
+        if path_matched:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "MethodNotAllowed", "message": f"{method} is not allowed on {url.path}"}
+        return HTTPStatus.NOT_FOUND, {"error": "NotFound", "message": f"No endpoint at {url.path}"}
+
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.close_connection = True
+            raise InvalidRequestError("Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True  # the unread body would be taken for the next request
+            raise InvalidRequestError("Request body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise InvalidRequestError("Request body should be a JSON object")
+        if not isinstance(body, dict):
+            raise InvalidRequestError("Request body should be a JSON object")
+        return body
+
+
+    def log_request(self, code="-", size="-"):
+        duration, self._duration = getattr(self, "_duration", None), None  # not carried over to the next request
+        timing = f" {duration * 1000:.3f}ms" if duration is not None else ""
+        self.log_message('"%s" %s %s%s', self.requestline, str(getattr(code, "value", code)), size, timing)
+
+
+class MovieBookingServer(HTTPServer):
+    """HTTP server handling connections on a bounded pool of `workers` threads.
+
+    The agent gets one pooled database connection per worker, so a busy worker never waits for a
+    connection. Connections accepted while every worker is busy wait in the executor's queue.
+    """
+    request_queue_size = 128
+
+    def __init__(self, address, agent, workers=SERVER_WORKERS):
+        super().__init__(address, MovieBookingRequestHandler)
+        self.agent = agent
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="movie-http")
+
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS, backend=None, **agent_options):
+    agent = MovieBookingAgent(pool_size=workers, backend=backend, **agent_options)
+    server = MovieBookingServer((host, port), agent, workers)
+    print(f"Serving on http://{host}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        agent.terminate()
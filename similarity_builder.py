@@ -0,0 +1,194 @@
+import math
+import os
+import tempfile
+
+from recommender import centering
+from utils import lazy_import
+
+np = lazy_import("numpy")  # imported by the first build, so a worker can limit BLAS threads before
+
+SIMILARITY_MAX_MEMORY = 1024 ** 3  # bytes the blocks and dense rows of all workers may take together
+BLOCK_CELL_BYTES = 5 * 8  # float64 dot products, a product of dense rows, norms, quotients and rounded values
+BLAS_THREADS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+INPUTS = ("offsets", "delta_sums", "norms", "column_indptr", "column_rows", "column_deltas")
+
+_worker = {}  # inputs and output of a worker process, see `_start_worker`
+
+
+def build_item_similarity(ratings, means, output, dtype="float32", block_size=None, workers=None,
+                          max_memory=SIMILARITY_MAX_MEMORY, progress=None):
+    """Write `item_similarity(ratings, means)` as `dtype` into the new .npy file `output`, block by block.
+
+    Movies are split into blocks of `block_size` consecutive columns, and each pair of blocks is
+    computed by one of `workers` processes (one per core by default; 1 computes in this process)
+    straight into the memory-mapped output, together with its transpose. Like `item_similarity`,
+    a block holds float64 dot products divided by the norms and rounded to 4 decimals, which are
+    only then cast to `dtype`. The users who rated movies of both blocks are expanded to dense rows
+    a bounded number at a time, so the blocks and rows of all workers stay within `max_memory`
+    bytes; that bound also picks the block size if none is given. The ratings are held once, by this
+    process, and the workers map them read-only. `progress(num_done, num_total)` is called after
+    each pair of blocks.
+
+    The workers are spawned rather than forked, which is safe from a threaded server and lets each
+    of them run a single BLAS thread; like any spawned pool they import the caller's main module,
+    so a script must guard its entry point with `if __name__ == "__main__"`.
+
+    Returns the diagonal and the row sums of the float64 similarities, before the cast, the latter
+    exact and so independent of the blocks and workers.
+    """
+    num_users, num_movies = ratings.shape
+    workers = workers or os.cpu_count() or 1
+    budget = max_memory // workers
+    if block_size is None:
+        block_size = max(1, min(num_movies, math.isqrt(budget // (2 * BLOCK_CELL_BYTES))))
+        if workers > 1:  # about two pairs of blocks per worker at least, to keep them all busy
+            block_size = max(1, min(block_size, math.ceil(num_movies / math.ceil(math.sqrt(4 * workers)))))
+    if 2 * BLOCK_CELL_BYTES * block_size ** 2 > budget:
+        raise ValueError(f"Blocks of {block_size} movies need more than {max_memory} bytes with {workers} workers")
+    max_rows = max(1, (budget - BLOCK_CELL_BYTES * block_size ** 2) // (2 * 8 * block_size))
+
+    inputs = _similarity_inputs(ratings, means)
+    similarity = np.lib.format.open_memmap(output, mode="w+", dtype=dtype, shape=(num_movies, num_movies))
+    starts = range(0, num_movies, block_size)
+    pairs = [(first, second) for first in starts for second in starts if second >= first]
+    diagonal, row_sums = np.zeros(num_movies), np.zeros(num_movies)
+
+    def collect(num_done, result):
+        first, second, first_sums, second_sums, block_diagonal = result
+        row_sums[first:first + len(first_sums)] += first_sums
+        if second_sums is None:
+            diagonal[first:first + len(block_diagonal)] = block_diagonal
+        else:
+            row_sums[second:second + len(second_sums)] += second_sums
+        if progress is not None:
+            progress(num_done, len(pairs))
+
+    if workers == 1:
+        for num_done, (first, second) in enumerate(pairs, 1):
+            collect(num_done, _compute_pair(inputs, similarity, num_users, block_size, max_rows, first, second))
+        similarity.flush()
+        return diagonal, row_sums / 10000
+
+    import multiprocessing  # only a pool of workers needs them, not every process importing the agent
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    similarity.flush()
+    del similarity  # the workers map the file themselves
+    with tempfile.TemporaryDirectory() as input_dir:
+        for name in INPUTS:
+            np.save(os.path.join(input_dir, f"{name}.npy"), inputs[name])
+        del inputs
+        # Spawned workers start without numpy, so their BLAS can be limited to one thread each
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_start_worker,
+                                       initargs=(input_dir, output, num_users, block_size, max_rows))
+        try:
+            futures = [executor.submit(_compute_worker_pair, first, second) for first, second in pairs]
+            for num_done, future in enumerate(as_completed(futures), 1):
+                collect(num_done, future.result())
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    return diagonal, row_sums / 10000
+
+
+def _similarity_inputs(ratings, means):
+    """The column offsets, the sums of the deviations and the norms of every movie, and the deviations
+    in column-major (CSC) order, which is all a worker needs of the ratings."""
+    num_users, num_movies = ratings.shape
+    offsets, deltas = centering(ratings, means)
+    delta_sums = np.bincount(ratings.indices, weights=deltas, minlength=num_movies)
+    squares = np.bincount(ratings.indices, weights=deltas ** 2, minlength=num_movies)
+
+    rows = np.repeat(np.arange(num_users), np.diff(ratings.indptr))
+    order = np.lexsort((rows, ratings.indices))
+    column_indptr = np.zeros(num_movies + 1, dtype=np.int64)
+    np.cumsum(ratings.column_counts(), out=column_indptr[1:])
+    return {
+        "offsets": offsets,
+        "delta_sums": delta_sums,
+        "norms": np.sqrt(num_users * offsets ** 2 + 2 * offsets * delta_sums + squares),
+        "column_indptr": column_indptr,
+        "column_rows": rows[order],
+        "column_deltas": deltas[order],
+    }
+
+
+def _start_worker(input_dir, output, num_users, block_size, max_rows):
+    for variable in BLAS_THREADS:
+        os.environ.setdefault(variable, "1")  # the pool is the parallelism
+    _worker["inputs"] = {name: np.load(os.path.join(input_dir, f"{name}.npy"), mmap_mode="r") for name in INPUTS}
+    _worker["similarity"] = np.load(output, mmap_mode="r+")
+    _worker["options"] = num_users, block_size, max_rows
+
+
+def _compute_worker_pair(first, second):
+    return _compute_pair(_worker["inputs"], _worker["similarity"], *_worker["options"], first, second)
+
+
+def _compute_pair(inputs, similarity, num_users, block_size, max_rows, first, second):
+    """Write the similarities between the blocks starting at `first` and `second`, and their transpose.
+
+    Returns the starts, the row sums of the written rows of either block (None for the second if it
+    is the first) and the block's diagonal if it is on the diagonal. The sums are in units of 1e-4:
+    every rounded similarity is a whole number of them, so adding the sums up is exact whatever the
+    order the blocks complete in.
+    """
+    num_movies = len(inputs["norms"])
+    rows, columns = slice(first, min(first + block_size, num_movies)), slice(second, min(second + block_size, num_movies))
+    offsets, delta_sums, norms = inputs["offsets"], inputs["delta_sums"], inputs["norms"]
+
+    # The centered columns are constant offsets plus sparse deviations, as in `item_similarity`
+    dot_product = num_users * np.outer(offsets[rows], offsets[columns])
+    dot_product += np.outer(offsets[rows], delta_sums[columns])
+    dot_product += np.outer(delta_sums[rows], offsets[columns])
+    _add_shared_ratings(dot_product, inputs, rows, columns, max_rows)
+    with np.errstate(divide="ignore", invalid="ignore"):  # movies without any spread get nan, as in item_similarity
+        block = np.around(dot_product / np.outer(norms[rows], norms[columns]), 4)
+
+    similarity[rows, columns] = block
+    units = np.rint(block * 10000)
+    if first == second:
+        return first, second, units.sum(axis=1), None, np.diag(block).copy()
+    similarity[columns, rows] = block.T
+    return first, second, units.sum(axis=1), units.sum(axis=0), None
+
+
+def _add_shared_ratings(dot_product, inputs, rows, columns, max_rows):
+    """Add the products of the deviations of the users who rated movies of both blocks, `max_rows` users at a time."""
+    first_entries = _column_entries(inputs, rows)
+    second_entries = first_entries if rows == columns else _column_entries(inputs, columns)
+    shared = np.intersect1d(first_entries[0], second_entries[0])
+    if len(shared) == 0:
+        return
+    first_entries = _by_shared_user(shared, *first_entries)
+    second_entries = first_entries if rows == columns else _by_shared_user(shared, *second_entries)
+    for start in range(0, len(shared), max_rows):
+        stop = min(start + max_rows, len(shared))
+        first_block = _dense_rows(first_entries, start, stop, rows.stop - rows.start)
+        second_block = first_block if rows == columns else _dense_rows(second_entries, start, stop, columns.stop - columns.start)
+        dot_product += np.dot(first_block.T, second_block)
+
+
+def _column_entries(inputs, columns):
+    """User, column within the block and deviation of every rating of the movies in `columns`."""
+    indptr = inputs["column_indptr"]
+    lo, hi = indptr[columns.start], indptr[columns.stop]
+    block_columns = np.repeat(np.arange(columns.stop - columns.start), np.diff(indptr[columns.start:columns.stop + 1]))
+    return np.asarray(inputs["column_rows"][lo:hi]), block_columns, np.asarray(inputs["column_deltas"][lo:hi])
+
+
+def _by_shared_user(shared, users, columns, deltas):
+    """The entries of the users in `shared`, ordered by the users' positions in it."""
+    positions = np.searchsorted(shared, users)
+    keep = shared[np.minimum(positions, len(shared) - 1)] == users
+    order = np.argsort(positions[keep], kind="stable")
+    return positions[keep][order], columns[keep][order], deltas[keep][order]
+
+
+def _dense_rows(entries, start, stop, width):
+    positions, columns, deltas = entries
+    lo, hi = np.searchsorted(positions, [start, stop])
+    block = np.zeros((stop - start, width))
+    block[positions[lo:hi] - start, columns[lo:hi]] = deltas[lo:hi]
+    return block
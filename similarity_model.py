@@ -0,0 +1,218 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from time import monotonic
+
+from similarity_builder import build_item_similarity
+from utils import lazy_import
+
+np = lazy_import("numpy")  # imported by the first recommendation, not at startup
+
+MODEL_FORMAT = 1
+MODEL_CHECK_INTERVAL = 1.0  # seconds between comparisons of the model's fingerprint with the database
+MODEL_KEEP = 3  # published versions kept on disk, the current one included
+MODEL_BLOCK_SIZE = 256  # similarity rows widened to float64 at a time while scoring
+CURRENT = "CURRENT"  # file naming the current version of a model directory
+ARRAYS = ("movie_ids", "means", "similarity", "diagonal", "weights")
+
+
+def publish_model(directory, ratings, fingerprint, **build_options):
+    """Train a new version of the model on `ratings` (a `RatingMatrix`) in `directory`, make it the
+    current one and return its name.
+
+    The similarity matrix is built block by block into the version's staging directory (see
+    `build_item_similarity`, which `build_options` go to; float32 by default), next to the movie
+    means and the diagonal and row sums the scores are divided by, which keep their float64 values.
+    Everything is synced before the staging directory is renamed to the version, and `CURRENT` is
+    replaced by a file naming it in a single rename, so readers find either the previous version
+    or the complete new one.
+    """
+    os.makedirs(directory, exist_ok=True)
+    version = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}-{uuid.uuid4().hex[:8]}"  # sorts by publication
+    staging = os.path.join(directory, f".{version}.tmp")
+    os.mkdir(staging)
+    try:
+        means = ratings.column_means()
+        similarity_path = os.path.join(staging, "similarity.npy")
+        diagonal, row_sums = build_item_similarity(ratings, means, similarity_path, **build_options)
+        with open(similarity_path, "rb") as file:
+            os.fsync(file.fileno())
+        arrays = {
+            "movie_ids": ratings.movie_ids,
+            "means": means,
+            "diagonal": diagonal,
+            "weights": row_sums - diagonal,
+        }
+        for name, array in arrays.items():
+            with open(os.path.join(staging, f"{name}.npy"), "wb") as file:
+                np.save(file, array)
+                _sync(file)
+        meta = {"format": MODEL_FORMAT, "version": version, "fingerprint": list(fingerprint),
+                "num_users": ratings.shape[0], "num_movies": ratings.shape[1]}
+        with open(os.path.join(staging, "meta.json"), "w") as file:
+            json.dump(meta, file)
+            _sync(file)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.rename(staging, os.path.join(directory, version))
+
+    pointer = os.path.join(directory, f".{CURRENT}.{version}.tmp")
+    with open(pointer, "w") as file:
+        file.write(version)
+        _sync(file)
+    os.replace(pointer, os.path.join(directory, CURRENT))
+    _prune(directory, version)
+    return version
+
+
+def _sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _prune(directory, current):
+    """Delete all but the MODEL_KEEP newest versions; processes still mapping one keep their pages."""
+    versions = sorted(name for name in os.listdir(directory)
+                      if not name.startswith(".") and os.path.isfile(os.path.join(directory, name, "meta.json")))
+    for version in versions[:-MODEL_KEEP]:
+        if version != current:
+            shutil.rmtree(os.path.join(directory, version), ignore_errors=True)
+
+
+def published_version(directory):
+    try:
+        with open(os.path.join(directory, CURRENT)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SimilarityModel:
+    """A published version of the item similarity model, its arrays memory-mapped read-only.
+
+    Every process serving the same version shares one page-cached copy of the files.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta.get("format") != MODEL_FORMAT:
+            raise ValueError(f"Unsupported similarity model format {meta.get('format')!r} in {path}")
+        self.path = path
+        self.version = meta["version"]
+        self.fingerprint = meta["fingerprint"]
+        self.num_users = meta["num_users"]
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.movie_index = {int(movie_id): i for i, movie_id in enumerate(self.movie_ids)}
+
+
+    def filled_row(self, ratings):
+        """Ratings `{movie_id: rating}` of one user with unrated movies filled by the movie means."""
+        row = np.array(self.means)
+        for movie_id, rating in ratings.items():
+            if movie_id in self.movie_index:  # a movie added after training is unknown to the model
+                row[self.movie_index[movie_id]] = rating
+        return row
+
+
+    def estimate(self, filled_matrix, block_size=MODEL_BLOCK_SIZE):
+        """Expected ratings as in `MovieBookingAgent._score_item_based`, widening bounded blocks of
+        similarity rows to float64. The float32 similarities may move a rating by one in its last
+        (fourth) decimal."""
+        numerators = np.empty(filled_matrix.shape)
+        for start in range(0, len(self.movie_ids), block_size):
+            stop = min(start + block_size, len(self.movie_ids))
+            block = np.asarray(self.similarity[start:stop], dtype=np.float64)
+            numerators[:, start:stop] = np.dot(filled_matrix, block.T)
+        with np.errstate(invalid="ignore"):  # nan similarities give nan ratings, as in the engine
+            return np.round((numerators - filled_matrix * self.diagonal) / self.weights, 4)
+
+
+class SimilarityModelStore:
+    """The model currently published in `directory`, as long as it was trained on the current data.
+
+    `fresh(fingerprint)` compares the model's fingerprint with the database's, read by calling
+    `fingerprint()` at most every `check_interval` seconds or after `expire()`. When they differ,
+    the version `CURRENT` names is loaded and swapped in if it is another one; the swap replaces a
+    single reference, so a scoring pass keeps the version it started with. Returns None while no
+    published model matches the database.
+
+    The fingerprint is read outside the lock, by the one thread whose call found a check due; the
+    others keep serving the current state meanwhile. Its result is dropped if `expire()` ran while
+    it was read, since it may predate the write that expired the model.
+    """
+    def __init__(self, directory, check_interval=MODEL_CHECK_INTERVAL):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._model = None
+        self._fresh = False
+        self._checked_at = float("-inf")
+        self._generation = 0  # advanced by every `expire()`
+        self._num_served = 0
+        self._num_stale = 0
+        self._num_swaps = 0
+        self._num_load_errors = 0
+
+
+    def fresh(self, fingerprint):
+        with self._lock:
+            due = monotonic() - self._checked_at >= self.check_interval
+            if due:  # claimed by this call, so the other threads do not query as well
+                self._checked_at, generation = monotonic(), self._generation
+        if due:
+            try:
+                current = list(fingerprint())
+            except BaseException:
+                with self._lock:
+                    if generation == self._generation:
+                        self._checked_at = float("-inf")
+                raise
+            with self._lock:
+                if generation == self._generation:
+                    self._check(current)
+        with self._lock:
+            if self._fresh:
+                self._num_served += 1
+                return self._model
+            self._num_stale += 1
+            return None
+
+
+    def _check(self, fingerprint):
+        if self._model is None or self._model.fingerprint != fingerprint:
+            version = published_version(self.directory)
+            if version is not None and (self._model is None or version != self._model.version):
+                try:
+                    model = SimilarityModel(os.path.join(self.directory, version))
+                except (OSError, ValueError, KeyError):  # pruned meanwhile, or written by another format
+                    self._num_load_errors += 1
+                else:
+                    self._model = model
+                    self._num_swaps += 1
+        self._fresh = self._model is not None and self._model.fingerprint == fingerprint
+        self._checked_at = monotonic()
+
+
+    def expire(self):
+        """Compare the fingerprints again before the next use, after this process wrote."""
+        with self._lock:
+            self._generation += 1
+            self._fresh = False
+            self._checked_at = float("-inf")
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self._model.version if self._model is not None else None,
+                "fresh": self._fresh,
+                "served": self._num_served,
+                "stale": self._num_stale,
+                "swaps": self._num_swaps,
+                "load_errors": self._num_load_errors,
+            }
@@ -1,4 +1,5 @@
-from schema import DB_NAME
+from schema import DB_NAME, TABLES
+from utils import DiscountRate
 
 #  all format parameters are converted via str(),
 insert_into_movie = """\
@@ -22,12 +23,10 @@ insert_into_rating = """\
     """
     
 select_all_from_movie = """\
-    SELECT movie.movie_id, title, director, price, AVG(reservation_price) as avg_price, COUNT(DISTINCT reservation.user_id) as num_reservations, AVG(rating) as avg_rating
+    SELECT movie_id, title, director, price, reservation_price_sum / NULLIF(num_reservations, 0) as avg_price, COALESCE(num_reservations, 0) as num_reservations, rating_sum / NULLIF(num_ratings, 0) as avg_rating
     FROM movie 
-    LEFT OUTER JOIN reservation ON movie.movie_id = reservation.movie_id 
-    LEFT OUTER JOIN rating ON movie.movie_id = rating.movie_id
-    GROUP BY movie.movie_id
-    ORDER BY movie.movie_id;
+    LEFT OUTER JOIN movie_stats USING (movie_id)
+    ORDER BY movie_id;
     """
     
 select_all_from_user = """\
@@ -36,14 +35,50 @@ select_all_from_user = """\
     ORDER BY user_id;
     """
 
+select_all_user_ids = """\
+    SELECT user_id
+    FROM user
+    ORDER BY user_id;
+    """
+
+select_all_movie_ids = """\
+    SELECT movie_id
+    FROM movie
+    ORDER BY movie_id;
+    """
+
 drop_all_tables = """\
-    DROP TABLE IF EXISTS rating, reservation, user, movie;
+    DROP TABLE IF EXISTS schema_migrations, movie_stats, rating, reservation, user, movie;
     """
     
 check_database_empty = f"""\
     SELECT COUNT(DISTINCT table_name) 
     FROM information_schema.tables
-    where table_schema = '{DB_NAME}';
+    where table_schema = '{DB_NAME}' AND table_name IN ({', '.join(f"'{name}'" for name in TABLES)});
+    """
+
+select_schema_version = """\
+    SELECT MAX(version)
+    FROM schema_migrations;
+    """
+
+insert_schema_version = """\
+    INSERT INTO schema_migrations (version, description)
+    VALUES (%s, %s);
+    """
+
+# Bounds the wait for a table's metadata lock, which would otherwise stall every query queued behind the DDL
+set_lock_wait_timeout = """\
+    SET SESSION lock_wait_timeout = %s;
+    """
+
+reset_lock_wait_timeout = """\
+    SET SESSION lock_wait_timeout = DEFAULT;
+    """
+
+# One row with Seconds_Behind_Source on a replica (NULL while replication is stopped), none otherwise
+select_replica_lag = """\
+    SHOW REPLICA STATUS;
     """
      
 delete_from_movie = """\
@@ -138,52 +173,6 @@ count_num_ratings = """\
     """
     
 
-select_highest_rating_movie = """\
-    WITH unseen AS (
-        SELECT movie.movie_id, title, price, COUNT(DISTINCT reservation.user_id) as num_reservations, COALESCE(AVG(rating), 0) as avg_rating
-        FROM movie
-        JOIN reservation USING (movie_id)
-        LEFT OUTER JOIN rating USING (movie_id)
-        WHERE NOT EXISTS (
-            SELECT 1
-            FROM reservation
-            WHERE reservation.user_id = %s AND reservation.movie_id = movie.movie_id
-        )
-        GROUP BY movie_id
-    ),
-    max_rating AS (
-        SELECT MAX(avg_rating) as max_avg_rating FROM unseen
-    )
-    SELECT unseen.movie_id, unseen.title, unseen.price, unseen.num_reservations, unseen.avg_rating
-    FROM unseen, max_rating
-    WHERE unseen.avg_rating = max_rating.max_avg_rating
-    ORDER BY unseen.movie_id
-    LIMIT 1;
-    """
-    
-select_most_popular_movie = """\
-    WITH unseen AS (
-        SELECT movie.movie_id, title, price, COUNT(DISTINCT reservation.user_id) as num_reservations, AVG(rating) as avg_rating
-        FROM movie
-        JOIN reservation USING (movie_id)
-        LEFT OUTER JOIN rating USING (movie_id)
-        WHERE NOT EXISTS (
-            SELECT 1
-            FROM reservation
-            WHERE reservation.user_id = %s AND reservation.movie_id = movie.movie_id
-        )
-        GROUP BY movie_id
-    ),
-    max_reservations AS (
-        SELECT MAX(num_reservations) as max_num_reservations FROM unseen
-    )
-    SELECT unseen.movie_id, unseen.title, unseen.price, unseen.num_reservations, unseen.avg_rating
-    FROM unseen, max_reservations
-    WHERE unseen.num_reservations = max_reservations.max_num_reservations
-    ORDER BY unseen.movie_id
-    LIMIT 1;
-    """
-   
 count_num_movies = """\
     SELECT COUNT(DISTINCT movie_id)
     FROM movie;
@@ -205,16 +194,327 @@ select_user_movie_rating_triples = """\
     );
     """
 
-    
-select_movie_recommend_info = """\
-    SELECT movie_id, title, price, AVG(rating) as avg_rating
+select_ratings_for_users = """\
+    SELECT user_id, movie_id, rating
+    FROM rating
+    WHERE user_id IN ({placeholders});
+    """
+
+# Changes with every user, movie and rating written. The per-movie sums come from movie_stats; only
+# the user-weighted checksum scans rating, since two users exchanging their ratings keep every movie's sums
+select_rating_fingerprint = """\
+    SELECT
+        (SELECT COUNT(*) FROM user),
+        (SELECT COALESCE(SUM(user_id), 0) FROM user),
+        (SELECT COALESCE(SUM(user_id * movie_id * rating), 0) FROM rating),
+        COUNT(*),
+        COALESCE(SUM(movie_id), 0),
+        COALESCE(SUM(num_ratings), 0),
+        COALESCE(SUM(rating_sum), 0),
+        COALESCE(SUM(movie_id * rating_sum), 0)
     FROM movie
-    LEFT OUTER JOIN rating USING (movie_id)
-    WHERE movie_id IN ({placeholders}) 
-        AND movie_id NOT IN (
-            SELECT movie_id 
-            FROM reservation 
-            WHERE user_id = %s
-        )
+    LEFT OUTER JOIN movie_stats USING (movie_id);
+    """
+
+select_movie_id_title_pairs = """\
+    SELECT movie_id, title
+    FROM movie;
+    """
+
+select_user_id_name_age_triples = """\
+    SELECT user_id, name, age
+    FROM user;
+    """
+
+select_reservation_counts = """\
+    SELECT movie_id, COUNT(*)
+    FROM reservation
     GROUP BY movie_id;
-    """
\ No newline at end of file
+    """
+
+select_reservation_pairs = """\
+    SELECT movie_id, user_id
+    FROM reservation;
+    """
+
+select_class_for_users = """\
+    SELECT user_id, class
+    FROM user
+    WHERE user_id IN ({placeholders});
+    """
+
+select_reservations_for_users = """\
+    SELECT user_id, movie_id
+    FROM reservation
+    WHERE user_id IN ({placeholders});
+    """
+
+select_movies_recommend_info = """\
+    SELECT movie_id, title, price, rating_sum / NULLIF(num_ratings, 0) as avg_rating
+    FROM movie
+    LEFT OUTER JOIN movie_stats USING (movie_id)
+    WHERE movie_id IN ({placeholders});
+    """
+
+insert_into_movie_stats = """\
+    INSERT INTO movie_stats (movie_id)
+    VALUES (%s);
+    """
+
+update_movie_stats_for_reservation = """\
+    UPDATE movie_stats
+    SET reservation_price_sum = reservation_price_sum + (
+            SELECT reservation_price
+            FROM reservation
+            WHERE movie_id = %s AND user_id = %s
+        )
+    WHERE movie_id = %s;
+    """
+
+update_movie_stats_for_rating = """\
+    UPDATE movie_stats
+    SET num_ratings = num_ratings + 1,
+        rating_sum = rating_sum + (
+            SELECT rating
+            FROM rating
+            WHERE movie_id = %s AND user_id = %s
+        )
+    WHERE movie_id = %s;
+    """
+
+update_movie_stats_for_user_removal = """\
+    UPDATE movie_stats
+    JOIN reservation ON reservation.movie_id = movie_stats.movie_id AND reservation.user_id = %s
+    LEFT OUTER JOIN rating ON rating.movie_id = reservation.movie_id AND rating.user_id = reservation.user_id
+    SET num_reservations = num_reservations - 1,
+        reservation_price_sum = reservation_price_sum - reservation_price,
+        num_ratings = num_ratings - (rating IS NOT NULL),
+        rating_sum = rating_sum - COALESCE(rating, 0);
+    """
+
+computed_movie_stats = """\
+    SELECT movie.movie_id,
+        COALESCE(reservation_stats.num_reservations, 0) as num_reservations,
+        COALESCE(reservation_stats.reservation_price_sum, 0) as reservation_price_sum,
+        COALESCE(rating_stats.num_ratings, 0) as num_ratings,
+        COALESCE(rating_stats.rating_sum, 0) as rating_sum
+    FROM movie
+    LEFT OUTER JOIN (
+        SELECT movie_id, COUNT(*) as num_reservations, SUM(reservation_price) as reservation_price_sum
+        FROM reservation
+        {condition}
+        GROUP BY movie_id
+    ) as reservation_stats ON reservation_stats.movie_id = movie.movie_id
+    LEFT OUTER JOIN (
+        SELECT movie_id, COUNT(*) as num_ratings, SUM(rating) as rating_sum
+        FROM rating
+        {condition}
+        GROUP BY movie_id
+    ) as rating_stats ON rating_stats.movie_id = movie.movie_id
+    {movie_condition}
+    """
+
+refresh_movie_stats = """\
+    INSERT INTO movie_stats (movie_id, num_reservations, reservation_price_sum, num_ratings, rating_sum)
+    {computed}
+    ON DUPLICATE KEY UPDATE
+        num_reservations = VALUES(num_reservations),
+        reservation_price_sum = VALUES(reservation_price_sum),
+        num_ratings = VALUES(num_ratings),
+        rating_sum = VALUES(rating_sum);
+    """
+
+# Creates the missing movie_stats rows and leaves the existing ones, which may be ahead of a concurrent count
+insert_missing_movie_stats = """\
+    INSERT INTO movie_stats (movie_id, num_reservations, reservation_price_sum, num_ratings, rating_sum)
+    {computed}
+    ON DUPLICATE KEY UPDATE movie_id = movie_id;
+    """
+
+select_drifted_movie_stats = """\
+    SELECT computed.movie_id
+    FROM ({computed}) as computed
+    LEFT OUTER JOIN movie_stats ON movie_stats.movie_id = computed.movie_id
+    WHERE movie_stats.movie_id IS NULL
+        OR movie_stats.num_reservations <> computed.num_reservations
+        OR movie_stats.reservation_price_sum <> computed.reservation_price_sum
+        OR movie_stats.num_ratings <> computed.num_ratings
+        OR movie_stats.rating_sum <> computed.rating_sum
+    ORDER BY computed.movie_id;
+    """
+
+select_class_and_booked_movies = """\
+    SELECT class, movie_id
+    FROM user
+    LEFT OUTER JOIN reservation USING (user_id)
+    WHERE user_id = %s;
+    """
+
+select_popularity_leaderboard = """\
+    (
+        SELECT 'rating' as ranking, movie_id, title, price, num_reservations, COALESCE(rating_sum / NULLIF(num_ratings, 0), 0) as avg_rating
+        FROM movie
+        JOIN movie_stats USING (movie_id)
+        WHERE num_reservations > 0
+        ORDER BY COALESCE(rating_sum / NULLIF(num_ratings, 0), 0) DESC, movie_id
+        LIMIT %s
+    )
+    UNION ALL
+    (
+        SELECT 'popularity' as ranking, movie_id, title, price, num_reservations, rating_sum / NULLIF(num_ratings, 0) as avg_rating
+        FROM movie
+        JOIN movie_stats USING (movie_id)
+        WHERE num_reservations > 0
+        ORDER BY num_reservations DESC, movie_id
+        LIMIT %s
+    );
+    """
+
+select_popularity_recommendations = """\
+    WITH target AS (
+        SELECT class
+        FROM user
+        WHERE user_id = %s
+    ),
+    unseen AS (
+        SELECT movie_id, title, price, num_reservations, rating_sum / NULLIF(num_ratings, 0) as avg_rating
+        FROM movie
+        JOIN movie_stats USING (movie_id)
+        WHERE num_reservations > 0 AND NOT EXISTS (
+            SELECT 1
+            FROM reservation
+            WHERE reservation.user_id = %s AND reservation.movie_id = movie.movie_id
+        )
+    ),
+    highest_rating AS (
+        SELECT movie_id, title, price, num_reservations, COALESCE(avg_rating, 0) as avg_rating
+        FROM unseen
+        ORDER BY COALESCE(avg_rating, 0) DESC, movie_id
+        LIMIT 1
+    ),
+    most_popular AS (
+        SELECT movie_id, title, price, num_reservations, avg_rating
+        FROM unseen
+        ORDER BY num_reservations DESC, movie_id
+        LIMIT 1
+    )
+    SELECT 'rating' as ranking, class, highest_rating.*
+    FROM target
+    LEFT OUTER JOIN highest_rating ON TRUE
+    UNION ALL
+    SELECT 'popularity' as ranking, class, most_popular.*
+    FROM target
+    LEFT OUTER JOIN most_popular ON TRUE;
+    """
+
+select_movies_page = """\
+    SELECT movie_id, title, director, price, reservation_price_sum / NULLIF(num_reservations, 0) as avg_price, COALESCE(num_reservations, 0) as num_reservations, rating_sum / NULLIF(num_ratings, 0) as avg_rating
+    FROM movie 
+    LEFT OUTER JOIN movie_stats USING (movie_id)
+    WHERE movie_id > %s
+    ORDER BY movie_id
+    LIMIT %s;
+    """
+
+select_users_page = """\
+    SELECT *
+    FROM user
+    WHERE user_id > %s
+    ORDER BY user_id
+    LIMIT %s;
+    """
+
+select_users_for_movie_page = """\
+    SELECT reservation.user_id, name, age, reservation_price, rating
+    FROM reservation 
+    JOIN user ON reservation.user_id = user.user_id
+    LEFT OUTER JOIN rating ON reservation.movie_id = rating.movie_id AND reservation.user_id = rating.user_id
+    WHERE reservation.movie_id = %s AND reservation.user_id > %s
+    ORDER BY reservation.user_id
+    LIMIT %s;
+    """
+
+select_movies_for_user_page = """\
+    SELECT reservation.movie_id, title, director, reservation_price, rating
+    FROM reservation
+    JOIN movie ON reservation.movie_id = movie.movie_id
+    LEFT OUTER JOIN rating ON reservation.movie_id = rating.movie_id AND reservation.user_id = rating.user_id
+    WHERE reservation.user_id = %s AND reservation.movie_id > %s
+    ORDER BY reservation.movie_id
+    LIMIT %s;
+    """
+
+select_column_widths = """\
+    SELECT {columns}
+    FROM ({query}) as listing;
+    """
+
+discount_rate = "CASE {class_} " + " ".join(f"WHEN '{rate.name.lower()}' THEN {rate.value}" for rate in DiscountRate) + " END"
+
+reserve_seat = """\
+    UPDATE movie_stats
+    SET num_reservations = num_reservations + 1
+    WHERE movie_id = %s AND num_reservations < %s;
+    """
+
+select_seat_count = """\
+    SELECT num_reservations
+    FROM movie
+    LEFT OUTER JOIN movie_stats USING (movie_id)
+    WHERE movie_id = %s;
+    """
+
+# price and class default to the movie's price and the user's class when passed as NULL; a class
+# passed as "Premium" gets its discount on SQLite too, whose CASE compares bound strings by case
+insert_into_reservation_with_price = f"""\
+    INSERT INTO reservation (movie_id, user_id, reservation_price)
+    SELECT movie_id, user_id, ROUND(COALESCE(%s, price) * (1 - {discount_rate.format(class_="LOWER(COALESCE(%s, class))")}))
+    FROM movie, user
+    WHERE movie_id = %s AND user_id = %s;
+    """
+
+select_movies_for_booking = """\
+    SELECT movie_id, price, num_reservations
+    FROM movie
+    JOIN movie_stats USING (movie_id)
+    WHERE movie_id IN ({placeholders})
+    FOR UPDATE OF movie_stats;
+    """
+
+select_reservations_for_pairs = """\
+    SELECT movie_id, user_id
+    FROM reservation
+    WHERE movie_id IN ({movie_placeholders}) AND user_id IN ({user_placeholders});
+    """
+
+select_existing_movie_ids = """\
+    SELECT movie_id
+    FROM movie
+    WHERE movie_id IN ({placeholders});
+    """
+
+select_ratings_for_pairs = """\
+    SELECT movie_id, user_id
+    FROM rating
+    WHERE movie_id IN ({movie_placeholders}) AND user_id IN ({user_placeholders});
+    """
+
+upsert_into_rating = """\
+    INSERT INTO rating (movie_id, user_id, rating)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE rating = VALUES(rating);
+    """
+
+# Hot single-row lookups and booking statements, executed as server-side prepared statements.
+# Only `execute` prepares, so statements the agent also runs with `executemany` do not belong here:
+# their batches go through the text protocol, which sends an INSERT batch as one multi-row statement.
+PREPARED_QUERIES = frozenset([
+    check_movie_id,
+    check_user_id,
+    select_class_and_booked_movies,
+    select_seat_count,
+    reserve_seat,
+    insert_into_reservation_with_price,
+    update_movie_stats_for_reservation,
+    update_movie_stats_for_rating,
+])
@@ -0,0 +1,205 @@
+import re
+from functools import lru_cache
+
+from schema import TABLES
+from sql_queries import (check_database_empty, drop_all_tables, reset_lock_wait_timeout, select_popularity_leaderboard,
+                         select_replica_lag, set_lock_wait_timeout, update_movie_stats_for_user_removal)
+
+# SQLite versions of the `schema.py` tables. ENUM becomes a named CHECK so its violation can be
+# reported like MySQL's data truncation, and text columns compare case-insensitively as MySQL's
+# default collation does.
+SQLITE_TABLES = {}
+SQLITE_TABLES["movie"] = """\
+    CREATE TABLE movie(
+        movie_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title VARCHAR(255) COLLATE NOCASE,
+        director VARCHAR(255) COLLATE NOCASE,
+        price INT,
+        UNIQUE (title),
+        CHECK (price >= 0 AND price <= 100000)
+        );
+    """
+
+SQLITE_TABLES["user"] = """\
+    CREATE TABLE user(
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) COLLATE NOCASE,
+        age INT,
+        class TEXT COLLATE NOCASE CONSTRAINT class_enum CHECK (class IN ('basic', 'premium', 'vip')),
+        UNIQUE (name, age),
+        CHECK (age >= 12 AND age <= 110)
+        );
+    """
+
+SQLITE_TABLES["reservation"] = """\
+    CREATE TABLE reservation(
+        movie_id INT NOT NULL,
+        user_id INT NOT NULL,
+        reservation_price INT,
+        PRIMARY KEY (movie_id, user_id),
+        FOREIGN KEY (movie_id) REFERENCES movie(movie_id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE
+        );
+    """
+
+SQLITE_TABLES["rating"] = """\
+    CREATE TABLE rating(
+        movie_id INT NOT NULL,
+        user_id INT NOT NULL,
+        rating INT,
+        PRIMARY KEY (movie_id, user_id),
+        FOREIGN KEY (movie_id, user_id) REFERENCES reservation(movie_id, user_id) ON DELETE CASCADE,
+        CHECK (rating >= 1 AND rating <= 5)
+        );
+    """
+
+SQLITE_TABLES["movie_stats"] = """\
+    CREATE TABLE IF NOT EXISTS movie_stats(
+        movie_id INT NOT NULL,
+        num_reservations INT NOT NULL DEFAULT 0,
+        reservation_price_sum BIGINT NOT NULL DEFAULT 0,
+        num_ratings INT NOT NULL DEFAULT 0,
+        rating_sum BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (movie_id),
+        FOREIGN KEY (movie_id) REFERENCES movie(movie_id) ON DELETE CASCADE
+        );
+    """
+
+# MySQL rounds fractional values stored in INT columns, SQLite keeps them as REAL
+SQLITE_TRIGGERS = {}
+SQLITE_TRIGGERS["reservation"] = """\
+    CREATE TRIGGER IF NOT EXISTS reservation_price_to_int
+    AFTER INSERT ON reservation
+    WHEN NEW.reservation_price <> CAST(NEW.reservation_price AS INTEGER)
+    BEGIN
+        UPDATE reservation
+        SET reservation_price = CAST(ROUND(NEW.reservation_price) AS INTEGER)
+        WHERE movie_id = NEW.movie_id AND user_id = NEW.user_id;
+    END;
+    """
+
+# Primary keys named by ON CONFLICT when translating ON DUPLICATE KEY UPDATE
+CONFLICT_KEYS = {
+    "movie": "movie_id",
+    "user": "user_id",
+    "reservation": "movie_id, user_id",
+    "rating": "movie_id, user_id",
+    "movie_stats": "movie_id",
+}
+
+sqlite_check_database_empty = f"""\
+    SELECT COUNT(*)
+    FROM sqlite_master
+    WHERE type = 'table' AND name IN ({', '.join(f"'{name}'" for name in TABLES)});
+    """
+
+sqlite_select_replica_lag = """\
+    SELECT NULL AS Seconds_Behind_Source
+    WHERE 0;
+    """
+
+sqlite_show_tables = """\
+    SELECT name
+    FROM sqlite_master
+    WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+    ORDER BY name;
+    """
+
+sqlite_select_popularity_leaderboard = """\
+    SELECT * FROM (
+        SELECT 'rating' as ranking, movie_id, title, price, num_reservations, COALESCE(ROUND(CAST(rating_sum AS REAL) / NULLIF(num_ratings, 0), 4), 0) as avg_rating
+        FROM movie
+        JOIN movie_stats USING (movie_id)
+        WHERE num_reservations > 0
+        ORDER BY avg_rating DESC, movie_id
+        LIMIT ?
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'popularity' as ranking, movie_id, title, price, num_reservations, ROUND(CAST(rating_sum AS REAL) / NULLIF(num_ratings, 0), 4) as avg_rating
+        FROM movie
+        JOIN movie_stats USING (movie_id)
+        WHERE num_reservations > 0
+        ORDER BY num_reservations DESC, movie_id
+        LIMIT ?
+    );
+    """
+
+sqlite_update_movie_stats_for_user_removal = """\
+    UPDATE movie_stats
+    SET num_reservations = num_reservations - 1,
+        reservation_price_sum = reservation_price_sum - removed.reservation_price,
+        num_ratings = num_ratings - (removed.rating IS NOT NULL),
+        rating_sum = rating_sum - COALESCE(removed.rating, 0)
+    FROM (
+        SELECT reservation.movie_id, reservation_price, rating
+        FROM reservation
+        LEFT OUTER JOIN rating ON rating.movie_id = reservation.movie_id AND rating.user_id = reservation.user_id
+        WHERE reservation.user_id = ?
+    ) as removed
+    WHERE movie_stats.movie_id = removed.movie_id;
+    """
+
+# Whole statements without a mechanical translation, each mapped to the statements replacing it
+SQLITE_STATEMENTS = {
+    check_database_empty: (sqlite_check_database_empty,),
+    "SHOW TABLES": (sqlite_show_tables,),
+    drop_all_tables: tuple(f"DROP TABLE IF EXISTS {name};" for name in ["schema_migrations"] + list(reversed(TABLES))),
+    set_lock_wait_timeout: (),  # DDL takes the database write lock, bounded by the busy timeout
+    reset_lock_wait_timeout: (),
+    select_replica_lag: (sqlite_select_replica_lag,),  # an embedded database is never behind
+    select_popularity_leaderboard: (sqlite_select_popularity_leaderboard,),
+    update_movie_stats_for_user_removal: (sqlite_update_movie_stats_for_user_removal,),
+    **{TABLES[name]: (SQLITE_TABLES[name],) + ((SQLITE_TRIGGERS[name],) if name in SQLITE_TRIGGERS else ())
+       for name in TABLES},
+}
+
+WRITE_STATEMENT = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP)\b", re.IGNORECASE)
+FOR_UPDATE = re.compile(r"\s+FOR UPDATE( OF \w+(, \w+)*)?", re.IGNORECASE)
+DIVISION = re.compile(r"(\w+) / NULLIF\((\w+), 0\)")
+EXPLAIN = re.compile(r"\s*EXPLAIN ", re.IGNORECASE)  # the rest is the query exactly as given
+ADD_INDEX = re.compile(r"\s*ALTER TABLE (\w+)\s+ADD INDEX (\w+) \(([^)]*)\)[^;]*;\s*$")
+PAIR_FILTER = re.compile(r"\bAND user_id IN \(")
+UPSERT = re.compile(r"\s*INSERT INTO (\w+) \(([^)]*)\)\s*(.*?)\s*ON DUPLICATE KEY UPDATE\s*(.*?);?\s*$", re.DOTALL)
+
+
+@lru_cache(maxsize=1024)
+def translate(query):
+    """SQLite statements for a MySQL `query` of `sql_queries.py`, and whether they write.
+
+    Statements in `SQLITE_STATEMENTS` are replaced as a whole. Everything else is rewritten
+    mechanically: `%s` placeholders become `?`, divisions by `NULLIF` keep MySQL's 4 decimals
+    instead of truncating, `FOR UPDATE` is dropped (the transaction takes the write lock up front
+    instead) and `ON DUPLICATE KEY UPDATE` becomes `ON CONFLICT ... DO UPDATE`. In the pair filters
+    `movie_id IN (...) AND user_id IN (...)`, only the movie list may use the primary key, since
+    SQLite would otherwise probe every combination of the two lists. `EXPLAIN` of a query becomes
+    `EXPLAIN QUERY PLAN` of its translation, and `ALTER TABLE ... ADD INDEX` a `CREATE INDEX`.
+    """
+    explain = EXPLAIN.match(query)
+    if explain is not None:
+        statements, _ = translate(query[explain.end():])
+        return tuple(f"EXPLAIN QUERY PLAN {statement.strip()}" for statement in statements), False
+
+    if query in SQLITE_STATEMENTS:
+        statements = SQLITE_STATEMENTS[query]
+        return statements, any(WRITE_STATEMENT.match(statement) for statement in statements)
+
+    add_index = ADD_INDEX.match(query)
+    if add_index is not None:
+        table, name, columns = add_index.groups()
+        return (f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});",), True
+
+    locks = FOR_UPDATE.search(query) is not None
+    query = FOR_UPDATE.sub("", query)
+    query = DIVISION.sub(r"ROUND(CAST(\1 AS REAL) / NULLIF(\2, 0), 4)", query)
+    query = query.replace("CHAR_LENGTH(", "LENGTH(").replace("%s", "?")
+    query = PAIR_FILTER.sub("AND +user_id IN (", query)
+    upsert = UPSERT.match(query)
+    if upsert is not None:
+        table, columns, source, assignments = upsert.groups()
+        if not source.upper().startswith("VALUES"):  # WHERE true keeps ON CONFLICT from parsing as a join constraint
+            source = f"SELECT * FROM ({source.rstrip().rstrip(';')}) WHERE true"
+        assignments = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", assignments)
+        query = f"INSERT INTO {table} ({columns}) {source} ON CONFLICT ({CONFLICT_KEYS[table]}) DO UPDATE SET {assignments};"
+
+    return (query,), locks or WRITE_STATEMENT.match(query) is not None
@@ -0,0 +1,79 @@
+import csv
+import os
+import random
+
+import pytest
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from sql_queries import select_all_user_ids, select_reservation_pairs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIELDNAMES = ["title", "director", "price", "name", "age", "class"]
+
+
+@pytest.fixture
+def empty_agent(monkeypatch):
+    """Agent on an in-memory SQLite database with the tables created but no rows."""
+    monkeypatch.chdir(ROOT)  # `initialize_database` reads data.csv from the working directory
+    agent = MovieBookingAgent(backend=SQLiteBackend())
+    agent.initialize_database(only_create_tables=True)
+    yield agent
+    agent.terminate()
+
+
+@pytest.fixture
+def agent(empty_agent):
+    """Agent on an in-memory SQLite database loaded from data.csv."""
+    empty_agent.initialize_database()
+    return empty_agent
+
+
+@pytest.fixture
+def rated_agent(agent):
+    """`agent` with ratings for about half of the reservations, and its similarity engine built."""
+    with agent._cursor() as cursor:
+        cursor.execute(select_reservation_pairs)
+        pairs = sorted(cursor.fetchall())
+    rng = random.Random(0)
+    agent.rate_movies([(movie_id, user_id, rng.randint(1, 5)) for movie_id, user_id in pairs if rng.random() < 0.5])
+    agent.rebuild_similarity_state()
+    return agent
+
+
+def recommendations(agent, user_ids=range(1, 30), k=5):
+    """Records of every user, exceptions as their type and message so that results compare by value."""
+    _, results = agent.fetch_item_based_recommendations(list(user_ids), k)
+    return {user_id: (type(result), str(result)) if isinstance(result, Exception) else result
+            for user_id, result in results.items()}
+
+
+def write_rows(path, rows):
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(FIELDNAMES)
+        writer.writerows(rows)
+    return str(path)
+
+
+def count(agent, table):
+    with agent._cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def popularity(agent, user_id):
+    _, recommendations = agent.fetch_popularity_recommendations(user_id)
+    return recommendations
+
+
+def unbooked_pair(agent):
+    """A booked (movie, user) pair and another user who has not booked that movie."""
+    with agent._cursor() as cursor:
+        cursor.execute(select_reservation_pairs)
+        pairs = set(cursor.fetchall())
+        cursor.execute(select_all_user_ids)
+        user_ids = [record[0] for record in cursor.fetchall()]
+    movie_id, user_id = max(pairs)
+    other_user_id = next(other for other in user_ids if (movie_id, other) not in pairs)
+    return movie_id, user_id, other_user_id
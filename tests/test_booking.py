@@ -0,0 +1,72 @@
+import pytest
+
+from messages import MovieAlreadyBookedError, MovieBookSuccess, MovieFullyBookedError, UserClassError
+from sql_queries import select_id_from_movie, select_id_from_user
+
+
+def new_movie_and_users(agent, num_users, price=10000):
+    agent.insert_movie("Booking Test", "Director", price)
+    with agent._cursor() as cursor:
+        cursor.execute(select_id_from_movie, ("Booking Test",))
+        movie_id = cursor.fetchone()[0]
+    user_ids = []
+    for i in range(num_users):
+        agent.insert_user(f"Booking Test {i}", 30, "basic")
+        with agent._cursor() as cursor:
+            cursor.execute(select_id_from_user, (f"Booking Test {i}", 30))
+            user_ids.append(cursor.fetchone()[0])
+    return movie_id, user_ids
+
+
+def reservation_price(agent, movie_id, user_id):
+    """Price of the reservation, None if there is none."""
+    with agent._cursor() as cursor:
+        cursor.execute("SELECT reservation_price FROM reservation WHERE movie_id = %s AND user_id = %s", (movie_id, user_id))
+        record = cursor.fetchone()
+    return record[0] if record is not None else None
+
+
+@pytest.mark.parametrize("class_, price", [("premium", 7500), ("Premium", 7500), ("VIP", 5000), ("Basic", 10000), (None, 10000)])
+def test_book_movie_discounts_any_class_spelling(agent, class_, price):
+    movie_id, (user_id,) = new_movie_and_users(agent, 1)
+    agent.book_movie(movie_id, user_id, 10000, class_)
+    assert reservation_price(agent, movie_id, user_id) == price
+
+
+@pytest.mark.parametrize("class_", ["platinum", "premium "])
+def test_book_movie_rejects_unknown_class(agent, class_):
+    movie_id, (user_id,) = new_movie_and_users(agent, 1)
+    with pytest.raises(UserClassError):
+        agent.book_movie(movie_id, user_id, 10000, class_)
+    assert reservation_price(agent, movie_id, user_id) is None
+    agent.book_movie(movie_id, user_id)
+    assert agent.verify_movie_stats(repair=False) == []
+
+
+def test_book_movie_keeps_capacity_and_uniqueness(agent):
+    movie_id, user_ids = new_movie_and_users(agent, 11)
+    for user_id in user_ids[:9]:
+        agent.book_movie(movie_id, user_id)
+    with pytest.raises(MovieAlreadyBookedError):
+        agent.book_movie(movie_id, user_ids[0])
+    agent.book_movie(movie_id, user_ids[9])
+    with pytest.raises(MovieFullyBookedError):
+        agent.book_movie(movie_id, user_ids[10])
+    with agent._cursor() as cursor:
+        cursor.execute("SELECT num_reservations FROM movie_stats WHERE movie_id = %s", (movie_id,))
+        assert cursor.fetchone()[0] == 10
+    assert agent.verify_movie_stats(repair=False) == []
+
+
+def test_book_movies_creates_missing_stats_row_before_locking(agent):
+    movie_id, user_ids = new_movie_and_users(agent, 12)
+    for user_id in user_ids[:8]:
+        agent.book_movie(movie_id, user_id)
+    with agent._cursor() as cursor:
+        cursor.execute("DELETE FROM movie_stats WHERE movie_id = %s", (movie_id,))
+    results = agent.book_movies([(movie_id, user_id) for user_id in user_ids[8:]])
+    assert [type(result) for result in results] == [MovieBookSuccess, MovieBookSuccess, MovieFullyBookedError, MovieFullyBookedError]
+    with agent._cursor() as cursor:
+        cursor.execute("SELECT num_reservations FROM movie_stats WHERE movie_id = %s", (movie_id,))
+        assert cursor.fetchone()[0] == 10
+    assert agent.verify_movie_stats(repair=False) == []
@@ -0,0 +1,53 @@
+import csv
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from conftest import count, write_rows
+from sql_queries import select_id_from_movie
+
+
+def test_bulk_load_matches_row_by_row_loop(agent, tmp_path):
+    rejects = tmp_path / "rejects.csv"
+    bulk = MovieBookingAgent(backend=SQLiteBackend())
+    try:
+        bulk.initialize_database(bulk=True, chunk_size=7, rejects=str(rejects))
+        assert bulk.fetch_movies() == agent.fetch_movies()
+        assert bulk.fetch_users() == agent.fetch_users()
+        with open("data.csv") as csvfile, open(rejects) as rejectfile:
+            num_rows, num_rejected = (sum(1 for _ in csv.DictReader(file)) for file in (csvfile, rejectfile))
+        assert count(bulk, "reservation") == count(agent, "reservation") == num_rows - num_rejected
+    finally:
+        bulk.terminate()
+
+
+def test_bulk_load_dedupes_as_the_collation_compares(empty_agent, tmp_path):
+    path = write_rows(tmp_path / "data.csv", [
+        ("Alien", "Ridley Scott", 100, "Ann", 30, "basic"),
+        ("alien", "Ridley Scott", 100, "Bob", 40, "premium"),
+        ("ALIEN ", "Ridley Scott", 100, "ann", 30, "vip"),  # Ann booked Alien already
+        ("Heat", "Michael Mann", 200, "BOB", 40, "premium"),
+    ])
+    rejects = tmp_path / "rejects.csv"
+
+    empty_agent.bulk_load(path, chunk_size=1, rejects=str(rejects))
+
+    assert count(empty_agent, "movie") == 2
+    assert count(empty_agent, "user") == 2
+    assert count(empty_agent, "reservation") == 3
+    with empty_agent._cursor() as cursor:
+        cursor.execute(select_id_from_movie, ("Alien",))
+        assert cursor.fetchone() is not None
+    with open(rejects) as rejectfile:
+        assert [row["title"] for row in csv.DictReader(rejectfile)] == ["ALIEN "]
+
+
+def test_bulk_load_rejects_rows_loaded_before(empty_agent, tmp_path):
+    path = write_rows(tmp_path / "data.csv", [("Heat", "Michael Mann", 200, "Ann", 30, "basic")])
+    rejects = tmp_path / "rejects.csv"
+
+    empty_agent.bulk_load(path)
+    empty_agent.bulk_load(path, rejects=str(rejects))
+
+    assert count(empty_agent, "reservation") == 1
+    with open(rejects) as rejectfile:
+        assert [row["reason"] for row in csv.DictReader(rejectfile)] == ["User Ann has already booked movie Heat"]
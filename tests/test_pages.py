@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import count
+
+
+def walk(fetch_page, limit):
+    ids, after_id = [], 0
+    while after_id is not None:
+        _, records, after_id = fetch_page(after_id, limit)
+        ids += [record[0] for record in records]
+    return ids
+
+
+@pytest.mark.parametrize("limit", [1, 7, 1000])
+def test_pages_cover_every_row_once(agent, limit):
+    movie_ids = walk(agent.fetch_movies_page, limit)
+    assert movie_ids == sorted(set(movie_ids)) and len(movie_ids) == count(agent, "movie")
+    user_ids = walk(agent.fetch_users_page, limit)
+    assert user_ids == sorted(set(user_ids)) and len(user_ids) == count(agent, "user")
+
+
+@pytest.mark.parametrize("limit", [0, -1, -5])
+def test_page_limit_below_one_is_rejected(agent, limit):
+    for fetch_page in (agent.fetch_movies_page, agent.fetch_users_page,
+                       lambda after_id, limit: agent.fetch_users_for_movie_page(1, after_id, limit),
+                       lambda after_id, limit: agent.fetch_movies_for_user_page(1, after_id, limit)):
+        with pytest.raises(ValueError, match="at least 1"):
+            fetch_page(0, limit)
@@ -0,0 +1,35 @@
+import recommender
+from conftest import popularity, unbooked_pair
+from recommender import PopularityLeaderboard
+from sql_queries import select_all_user_ids
+
+
+def test_leaderboard_matches_whole_catalog_ranking(agent):
+    with agent._cursor() as cursor:
+        cursor.execute(select_all_user_ids)
+        user_ids = [record[0] for record in cursor.fetchall()]
+    cached = {user_id: popularity(agent, user_id) for user_id in user_ids}
+    agent.leaderboard = PopularityLeaderboard(1)  # almost every user falls back to ranking the whole catalog
+    assert {user_id: popularity(agent, user_id) for user_id in user_ids} == cached
+
+
+def test_rating_invalidates_leaderboard(agent):
+    movie_id, user_id, other_user_id = unbooked_pair(agent)
+    assert popularity(agent, other_user_id)["Rating-based"][0][0] != movie_id
+    agent.rate_movie(movie_id, user_id, 5)
+    assert popularity(agent, other_user_id)["Rating-based"][0][0] == movie_id
+
+
+def test_leaderboard_expires_after_ttl(agent, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recommender, "monotonic", lambda: now[0])
+    agent.leaderboard = PopularityLeaderboard(agent.leaderboard.size, ttl=60)
+    movie_id, _, other_user_id = unbooked_pair(agent)
+    before = popularity(agent, other_user_id)
+
+    with agent._cursor() as cursor:  # a rating written by another process
+        cursor.execute("UPDATE movie_stats SET num_ratings = 1, rating_sum = 5 WHERE movie_id = %s", (movie_id,))
+    now[0] += 59
+    assert popularity(agent, other_user_id) == before
+    now[0] += 1
+    assert popularity(agent, other_user_id)["Rating-based"][0][0] == movie_id
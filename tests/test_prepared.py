@@ -0,0 +1,25 @@
+import pytest
+
+from backends import SQLiteBackend
+from prepared import PreparedCursor, StatementCache, StatementStats
+
+CREATE = "CREATE TABLE item (item_id INTEGER PRIMARY KEY, name TEXT);"
+INSERT = "INSERT INTO item (name) VALUES (%s);"
+
+
+@pytest.fixture
+def cursor():
+    connection = SQLiteBackend().connect()
+    text_cursor = connection.cursor()
+    text_cursor.execute(CREATE)
+    yield PreparedCursor(text_cursor, StatementCache(connection, StatementStats()), frozenset([INSERT]))
+    connection.close()
+
+
+def test_executemany_reports_its_own_results(cursor):
+    cursor.execute(INSERT, ("prepared",))
+    assert (cursor.rowcount, cursor.lastrowid, cursor.with_rows) == (1, 1, False)
+    cursor.executemany("INSERT INTO item (name) VALUES (%s);", [("a",), ("b",), ("c",)])
+    assert cursor.rowcount == 3
+    cursor.execute("SELECT name FROM item ORDER BY item_id;")
+    assert cursor.with_rows and cursor.fetchall() == [("prepared",), ("a",), ("b",), ("c",)]
@@ -0,0 +1,32 @@
+import ast
+import os
+
+import sql_queries
+from conftest import ROOT
+from sql_queries import PREPARED_QUERIES
+
+
+def executed_queries(method):
+    """Names of the `sql_queries` constants the agent passes to `cursor.<method>(...)`, either
+    directly or as a branch of a conditional expression."""
+    with open(os.path.join(ROOT, "agent.py")) as file:
+        tree = ast.parse(file.read())
+    queries = [call.args[0] for call in ast.walk(tree)
+               if isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == method and call.args]
+    queries += [branch for query in queries if isinstance(query, ast.IfExp) for branch in (query.body, query.orelse)]
+    return {query.id for query in queries if isinstance(query, ast.Name)}
+
+
+def prepared_names():
+    names = {query: name for name, query in vars(sql_queries).items() if isinstance(query, str)}
+    return {names[query] for query in PREPARED_QUERIES}
+
+
+def test_prepared_queries_are_executed_by_the_agent():
+    assert prepared_names() <= executed_queries("execute")
+
+
+def test_prepared_queries_are_never_batched():
+    """Only `execute` prepares, so a query the agent also runs with `executemany` gains nothing from the set."""
+    assert "insert_into_rating" in executed_queries("executemany")
+    assert not prepared_names() & executed_queries("executemany")
@@ -0,0 +1,51 @@
+import shutil
+import threading
+
+import pytest
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from conftest import ROOT, popularity, unbooked_pair
+
+
+@pytest.fixture
+def replicated_agent(tmp_path, monkeypatch):
+    """Agent on a SQLite file whose replica is a read-only copy that never catches up."""
+    monkeypatch.chdir(ROOT)
+    primary, replica = str(tmp_path / "primary.db"), str(tmp_path / "replica.db")
+    loader = MovieBookingAgent(backend=SQLiteBackend(primary))
+    loader.initialize_database()
+    loader.terminate()
+    shutil.copy(primary, replica)
+    agent = MovieBookingAgent(backend=SQLiteBackend(primary), pool_size=2, replica_max_lag=60,
+                              replicas=[SQLiteBackend(replica, read_only=True)])
+    yield agent
+    agent.terminate()
+
+
+def in_other_thread(call):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(call()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def test_reads_go_to_the_replica(replicated_agent):
+    replicated_agent.fetch_movies_page()
+    assert replicated_agent.replica_stats()["replicas"][0]["reads"] == 1
+
+
+def test_thread_reads_its_own_writes(replicated_agent):
+    movie_id, _, user_id = unbooked_pair(replicated_agent)
+    replicated_agent.book_movie(movie_id, user_id)
+    _, records, _ = replicated_agent.fetch_movies_for_user_page(user_id)
+    assert movie_id in [record[0] for record in records]
+
+
+def test_leaderboard_is_not_loaded_from_a_lagging_replica(replicated_agent):
+    movie_id, user_id, other_user_id = in_other_thread(lambda: unbooked_pair(replicated_agent))
+    assert popularity(replicated_agent, other_user_id)["Rating-based"][0][0] != movie_id
+    in_other_thread(lambda: replicated_agent.rate_movie(movie_id, user_id, 5))
+    assert popularity(replicated_agent, other_user_id)["Rating-based"][0][0] == movie_id
+    assert replicated_agent.replica_stats()["replicas"][0]["reads"] == 2  # the user's rows, twice; the leaderboard always came from the primary
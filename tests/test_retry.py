@@ -0,0 +1,94 @@
+import csv
+
+import pytest
+
+from agent import MovieBookingAgent
+from backends import SQLiteBackend
+from conftest import ROOT, count
+from fault_injection import COMMIT_FAULTS, STATEMENT_FAULTS, FaultInjector
+from messages import MovieBookSuccess, TransactionOutcomeUnknownError
+
+
+class ScriptedFaults(FaultInjector):
+    """Injects `fault` once, into the statement or commit that is the `after`-th one it fits."""
+    def __init__(self, backend):
+        super().__init__(backend, rate=0)
+        self.planned = None
+
+
+    def plan(self, fault, after=0):
+        self.planned = [fault, after]
+
+
+    def draw(self, faults):
+        if self.planned is None or self.planned[0] not in faults:
+            return None
+        if self.planned[1] > 0:
+            self.planned[1] -= 1
+            return None
+        fault, self.planned = self.planned[0], None
+        self.injected[fault] += 1
+        return fault
+
+
+@pytest.fixture
+def faulty_agent(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    faults = ScriptedFaults(SQLiteBackend())
+    agent = MovieBookingAgent(backend=faults)
+    agent.initialize_database(only_create_tables=True)
+    yield agent, faults
+    agent.terminate()
+
+
+def load(agent, tmp_path, name):
+    rejects = tmp_path / f"{name}.csv"
+    agent.bulk_load(chunk_size=10, rejects=str(rejects))
+    with open(rejects) as rejectfile:
+        return agent.fetch_movies(), agent.fetch_users(), count(agent, "reservation"), list(csv.DictReader(rejectfile))
+
+
+def test_local_accessors_are_not_wrapped():
+    assert not hasattr(MovieBookingAgent.cache_stats, "__wrapped__")
+    assert not hasattr(MovieBookingAgent.similarity_model_stats, "__wrapped__")
+    assert hasattr(MovieBookingAgent.book_movie, "__wrapped__")
+
+
+@pytest.mark.parametrize("fault", STATEMENT_FAULTS)
+@pytest.mark.parametrize("after", [0, 5, 14, 21, 30, 35])  # reads, movie and user chunks, ids, reservation chunks
+def test_bulk_load_replays_only_the_failed_chunk(faulty_agent, empty_agent, tmp_path, fault, after):
+    agent, faults = faulty_agent
+    expected = load(empty_agent, tmp_path, "expected")
+
+    faults.plan(fault, after)
+    assert load(agent, tmp_path, "rejects") == expected
+    assert faults.injected[fault] == 1
+    assert agent.retry_stats()["operations"]["bulk_load"]["recovered"] == 1
+
+
+def test_bulk_load_reports_lost_chunk_commit(faulty_agent):
+    agent, faults = faulty_agent
+    faults.plan("commit_lost_after", 8)
+    with pytest.raises(TransactionOutcomeUnknownError):
+        agent.bulk_load(chunk_size=10)
+
+
+def test_initialize_database_replays_single_rows(faulty_agent, empty_agent, tmp_path):
+    agent, faults = faulty_agent
+    empty_agent.initialize_database()
+    faults.plan("commit_lost_after", 40)
+    agent.initialize_database()
+    assert agent.fetch_movies() == empty_agent.fetch_movies()
+    assert count(agent, "reservation") == count(empty_agent, "reservation")
+    assert agent.retry_stats()["operations"]["initialize_database"]["recovered"] == 1
+
+
+@pytest.mark.parametrize("fault", COMMIT_FAULTS)
+def test_book_movie_recovers_from_lost_commit(faulty_agent, fault):
+    agent, faults = faulty_agent
+    agent.insert_movie("Retry", "Director", 100)
+    agent.insert_user("Retry", 30, "basic")
+    faults.plan(fault)
+    assert isinstance(agent.book_movie(1, 1), MovieBookSuccess)
+    assert count(agent, "reservation") == 1
+    assert agent.verify_movie_stats(repair=False) == []
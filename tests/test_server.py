@@ -0,0 +1,40 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from server import MAX_PAGE_SIZE, MovieBookingServer
+
+
+@pytest.fixture
+def base_url(agent):
+    """URL of a server on an ephemeral port, answering from `agent`."""
+    server = MovieBookingServer(("127.0.0.1", 0), agent, workers=1)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01})
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def get(url):
+    try:
+        with urlopen(url) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_page_limit_is_capped(base_url):
+    status, page = get(f"{base_url}/movies?limit={MAX_PAGE_SIZE + 1}")
+    assert status == 200 and len(page["rows"]) <= MAX_PAGE_SIZE
+
+
+@pytest.mark.parametrize("path", ["/movies", "/users", "/movies/1/users", "/users/1/movies"])
+@pytest.mark.parametrize("limit", ["0", "-1", "x"])
+def test_invalid_page_limit_is_a_bad_request(base_url, path, limit):
+    status, payload = get(f"{base_url}{path}?limit={limit}")
+    assert status == 400 and payload["error"] == "InvalidRequestError"
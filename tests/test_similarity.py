@@ -0,0 +1,122 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, count, recommendations, write_rows
+from similarity_model import SimilarityModelStore
+
+
+def assert_matches_rebuild(agent):
+    """The incrementally maintained engine agrees with one rebuilt from the database."""
+    assert agent.similarity_engine.ready
+    incremental = recommendations(agent)
+    assert agent.check_similarity_state()
+    agent.rebuild_similarity_state()
+    assert recommendations(agent) == incremental
+
+
+def test_rate_movie_updates_engine(rated_agent):
+    with rated_agent._cursor() as cursor:
+        cursor.execute("SELECT movie_id, user_id FROM reservation WHERE (movie_id, user_id) NOT IN (SELECT movie_id, user_id FROM rating)")
+        unrated = sorted(cursor.fetchall())[:10]
+    for movie_id, user_id in unrated:
+        rated_agent.rate_movie(movie_id, user_id, 4)
+    assert_matches_rebuild(rated_agent)
+
+
+def test_remove_movie_and_user_update_engine(rated_agent):
+    rated_agent.remove_movie(3)
+    rated_agent.remove_user(5)
+    assert_matches_rebuild(rated_agent)
+
+
+def test_insert_movie_after_removal_updates_engine(rated_agent):
+    rated_agent.remove_movie(60)
+    rated_agent.insert_movie("Newly Added", "Director", 10000)
+    with rated_agent._cursor() as cursor:
+        cursor.execute("SELECT MAX(movie_id) FROM movie")
+        movie_id = cursor.fetchone()[0]
+    assert rated_agent.similarity_engine.movie_ids[-1] == movie_id != 60
+    assert_matches_rebuild(rated_agent)
+
+
+def test_insert_user_updates_engine(rated_agent):
+    rated_agent.insert_user("Newcomer", 30, "basic")
+    assert_matches_rebuild(rated_agent)
+
+
+def test_bulk_load_invalidates_engine(rated_agent, tmp_path):
+    path = write_rows(tmp_path / "data.csv", [
+        ("Bulk Movie A", "Director", 100, "Ann", 30, "basic"),
+        ("Bulk Movie B", "Director", 200, "Bob", 40, "premium"),
+    ])
+    num_movies = count(rated_agent, "movie")
+    rated_agent.bulk_load(path)
+    recommendations(rated_agent)
+    assert len(rated_agent.similarity_engine.movie_ids) == num_movies + 2
+    assert rated_agent.check_similarity_state()
+
+
+def test_engine_similarity_matches_dense_computation(rated_agent):
+    from recommender import RatingMatrix, item_similarity
+
+    user_ids, movie_ids, triples = rated_agent._load_ratings()
+    ratings = RatingMatrix(user_ids, movie_ids, triples)
+    expected = item_similarity(ratings, ratings.column_means())
+    np.testing.assert_array_equal(rated_agent.similarity_engine.similarity(), expected)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_block_builder_matches_dense_computation(rated_agent, tmp_path, workers):
+    from recommender import RatingMatrix, item_similarity
+    from similarity_builder import build_item_similarity
+
+    user_ids, movie_ids, triples = rated_agent._load_ratings()
+    ratings = RatingMatrix(user_ids, movie_ids, triples)
+    output = str(tmp_path / "similarity.npy")
+    build_item_similarity(ratings, ratings.column_means(), output, dtype="float64", block_size=16, workers=workers)
+    expected = item_similarity(ratings, ratings.column_means())
+    np.testing.assert_array_equal(np.load(output), expected)
+
+
+def test_agent_import_leaves_process_pool_unloaded():
+    check = "import sys, agent; print('multiprocessing' in sys.modules, 'concurrent.futures' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "False"]
+
+
+def test_engine_statistics_match_dense_computation(rated_agent):
+    from recommender import ItemSimilarityEngine, RatingMatrix
+
+    user_ids, movie_ids, triples = rated_agent._load_ratings()
+    ratings = RatingMatrix(user_ids, movie_ids, triples)
+    values = ratings.dense_rows(0, len(user_ids))
+    rated = ratings.dense_rows(0, len(user_ids), np.ones_like(ratings.data))
+    engine = rated_agent.similarity_engine
+    for statistic, expected in zip((engine.P, engine.S, engine.C), (values.T @ values, values.T @ rated, rated.T @ rated)):
+        assert statistic.dtype == np.int32
+        np.testing.assert_array_equal(statistic, expected)
+
+    small_blocks = ItemSimilarityEngine()
+    small_blocks.rebuild(user_ids, movie_ids, triples, max_pairs=1)
+    assert rated_agent._same_statistics(small_blocks.statistics(), engine.statistics())
+    np.testing.assert_array_equal(small_blocks._compute_similarity(block_size=7), engine.similarity())
+
+
+def test_unrated_catalog_scores_without_warnings(agent, tmp_path):
+    """Without ratings every similarity is 0/0; the divisions that allow it must not warn."""
+    from recommender import RatingMatrix, item_similarity
+
+    agent.rebuild_similarity_state()
+    assert np.isnan(agent.similarity_engine.similarity()).all()
+    user_ids, movie_ids, triples = agent._load_ratings()
+    ratings = RatingMatrix(user_ids, movie_ids, triples)
+    assert np.isnan(item_similarity(ratings, ratings.column_means())).all()
+    assert all(len(result) == 5 for result in recommendations(agent).values() if not isinstance(result, tuple))
+
+    agent.train_similarity_model(str(tmp_path), workers=1)
+    agent.similarity_model = SimilarityModelStore(str(tmp_path))
+    recommendations(agent)
+    assert agent.similarity_model_stats()["served"] == 1
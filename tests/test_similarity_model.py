@@ -0,0 +1,96 @@
+import pytest
+
+from conftest import recommendations
+from similarity_model import SimilarityModelStore, published_version
+
+USER_CHECKSUM = 2  # position of the user-weighted rating checksum in the fingerprint
+
+
+@pytest.fixture
+def model_agent(rated_agent, tmp_path):
+    """`rated_agent` serving item-based recommendations from a model trained on its ratings."""
+    directory = str(tmp_path / "model")
+    rated_agent.train_similarity_model(directory, workers=1)
+    rated_agent.similarity_model = SimilarityModelStore(directory)
+    return rated_agent, directory
+
+
+def exchange_ratings(agent):
+    """Swap the different ratings two users gave the same movie, which keeps every movie's sums."""
+    with agent._cursor() as cursor:
+        cursor.execute("""
+            SELECT a.movie_id, a.user_id, a.rating, b.user_id, b.rating
+            FROM rating a JOIN rating b ON a.movie_id = b.movie_id AND a.user_id < b.user_id AND a.rating <> b.rating
+            ORDER BY a.movie_id, a.user_id, b.user_id
+            """)
+        movie_id, user_id, rating, other_user_id, other_rating = cursor.fetchone()
+        cursor.execute("UPDATE rating SET rating = %s WHERE movie_id = %s AND user_id = %s", (other_rating, movie_id, user_id))
+        cursor.execute("UPDATE rating SET rating = %s WHERE movie_id = %s AND user_id = %s", (rating, movie_id, other_user_id))
+
+
+def test_fresh_model_is_served(model_agent):
+    agent, _ = model_agent
+    recommendations(agent)
+    stats = agent.similarity_model_stats()
+    assert stats["fresh"] and stats["served"] == 1 and stats["stale"] == 0
+
+
+def test_exchanged_ratings_make_model_stale(model_agent):
+    agent, directory = model_agent
+    recommendations(agent)
+    before = agent._rating_fingerprint()
+    exchange_ratings(agent)
+    after = agent._rating_fingerprint()
+    assert after[USER_CHECKSUM] != before[USER_CHECKSUM]
+    assert after[:USER_CHECKSUM] + after[USER_CHECKSUM + 1:] == before[:USER_CHECKSUM] + before[USER_CHECKSUM + 1:]
+
+    agent.similarity_model.check_interval = 0  # as if written by another process, which does not expire it
+    recommendations(agent)
+    assert not agent.similarity_model_stats()["fresh"]
+
+    agent.train_similarity_model(directory, workers=1)
+    recommendations(agent)
+    stats = agent.similarity_model_stats()
+    assert stats["fresh"] and stats["version"] == published_version(directory) and stats["swaps"] == 2
+
+
+def test_write_expires_model(model_agent):
+    agent, _ = model_agent
+    recommendations(agent)
+    exchange_ratings(agent)
+    recommendations(agent)
+    assert agent.similarity_model_stats()["fresh"]  # not checked again within the interval
+
+    with agent._cursor() as cursor:
+        cursor.execute("SELECT movie_id, user_id FROM reservation WHERE (movie_id, user_id) NOT IN (SELECT movie_id, user_id FROM rating)")
+        movie_id, user_id = cursor.fetchone()
+    agent.rate_movie(movie_id, user_id, 3)
+    recommendations(agent)
+    assert not agent.similarity_model_stats()["fresh"]
+
+
+def test_fingerprint_is_read_outside_the_lock(tmp_path):
+    store = SimilarityModelStore(str(tmp_path))
+
+    def fingerprint():
+        assert not store._lock.locked()
+        return [0]
+
+    assert store.fresh(fingerprint) is None
+    assert store.stats()["stale"] == 1
+
+
+def test_fingerprint_read_before_expire_is_dropped(tmp_path):
+    store = SimilarityModelStore(str(tmp_path), check_interval=60)
+    reads = []
+
+    def fingerprint():
+        reads.append(len(reads))
+        if len(reads) == 1:
+            store.expire()  # a write committed while the fingerprint was read
+        return [0]
+
+    store.fresh(fingerprint)
+    assert store._checked_at == float("-inf")
+    store.fresh(fingerprint)
+    assert len(reads) == 2 and store._checked_at > float("-inf")
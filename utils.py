@@ -1,24 +1,88 @@
+import csv
+import importlib.util
+import io
+import json
+import sys
+from decimal import Decimal
 from enum import Enum
-from typing import List, Tuple
+from itertools import chain, islice
+from typing import IO, Iterable, List, Optional, Tuple
+
+WIDTH_SAMPLE_SIZE = 1000
+OUTPUT_FORMATS = ("table", "csv", "jsonl")
+
 
 def format_select_output(headers: List[str], records: List[Tuple], title=None) -> str:
-    column_widths = [len(header) for header in headers]
-    for record in records:
-        for i, value in enumerate(record):
-            column_widths[i] = max(column_widths[i], len(str(value)))
-    column_widths = [width + 1 for width in column_widths]  # for better readability
-    separator_length = sum(column_widths) + len(column_widths) # including gaps between columns
-            
-    output = '-' * separator_length + '\n'
+    output = io.StringIO()
+    write_select_output(output, headers, records, title=title, sample_size=None)
+    
+    return output.getvalue()
+
+
+def write_select_output(sink: IO[str], headers: List[str], records: Iterable[Tuple], title=None, fmt="table",
+                        column_widths: Optional[List[int]] = None, sample_size: Optional[int] = WIDTH_SAMPLE_SIZE) -> int:
+    """Write `records` to `sink` as they arrive and return the number of records written.
+
+    In "table" format column widths come from `column_widths` if given, otherwise from the first
+    `sample_size` records (all of them if None), so longer values later on may overflow their column.
+    "csv" and "jsonl" need no widths and never buffer records.
+    """
+    if fmt == "csv":
+        writer = csv.writer(sink)
+        writer.writerow(headers)
+        num_records = 0
+        for record in records:
+            writer.writerow(record)
+            num_records += 1
+        return num_records
+    if fmt == "jsonl":
+        num_records = 0
+        for record in records:
+            sink.write(json.dumps(dict(zip(headers, record)), default=json_default) + '\n')
+            num_records += 1
+        return num_records
+    if fmt != "table":
+        raise ValueError(f"Output format should be one of {', '.join(OUTPUT_FORMATS)}")
+    
+    records = iter(records)
+    if column_widths is None:
+        sample = [tuple(map(str, record)) for record in (records if sample_size is None else islice(records, sample_size))]
+        column_widths = [max([len(header)] + [len(record[i]) for record in sample]) for i, header in enumerate(headers)]
+        records = chain(sample, records)
+    column_widths = [max(width, len(header)) + 1 for width, header in zip(column_widths, headers)]  # for better readability
+    separator = '-' * (sum(column_widths) + len(column_widths)) # including gaps between columns
+    
+    sink.write(separator + '\n')
     if title:
-        output += title + '\n'
-    output += ' '.join(f"{header:<{width}}" for header, width in zip(headers, column_widths)) + '\n'
-    output += '-' * separator_length + '\n'
+        sink.write(title + '\n')
+    sink.write(' '.join(header.ljust(width) for header, width in zip(headers, column_widths)) + '\n')
+    sink.write(separator + '\n')
+    num_records = 0
     for record in records:
-        output += ' '.join(f"{field:<{width}}" if field is not None else "None".ljust(width) for field, width in zip(record, column_widths)) + '\n'
-    output += '-' * separator_length
+        sink.write(' '.join(str(field).ljust(width) for field, width in zip(record, column_widths)) + '\n')
+        num_records += 1
+    sink.write(separator)
     
-    return output
+    return num_records
+
+
+def lazy_import(name):
+    """Module `name`, executed on its first attribute access instead of now."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = sys.modules[name] = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def json_default(value):
+    """`json.dumps` fallback for the values in query results (e.g. `Decimal` averages)."""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
 
 
 class DiscountRate(Enum):